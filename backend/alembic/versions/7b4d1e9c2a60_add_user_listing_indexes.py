@@ -0,0 +1,40 @@
+"""add user listing indexes
+
+Revision ID: 7b4d1e9c2a60
+Revises: 5e2c8a7f1b34
+Create Date: 2026-10-17 20:05:17.284113
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7b4d1e9c2a60'
+down_revision: Union[str, Sequence[str], None] = '5e2c8a7f1b34'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Built CONCURRENTLY so the user table stays writable while they build, which can't run inside a transaction
+    with op.get_context().autocommit_block():
+        op.create_index('ix_user_time_created_id', 'user', ['time_created', 'id'], unique=False, postgresql_concurrently=True)
+        op.create_index('ix_user_email_prefix', 'user', [sa.text('lower(email) varchar_pattern_ops')], unique=False,
+                        postgresql_concurrently=True)
+        op.create_index('ix_user_first_name_prefix', 'user', [sa.text('lower(first_name) varchar_pattern_ops')], unique=False,
+                        postgresql_concurrently=True)
+        op.create_index('ix_user_last_name_prefix', 'user', [sa.text('lower(last_name) varchar_pattern_ops')], unique=False,
+                        postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_user_last_name_prefix', table_name='user', postgresql_concurrently=True)
+        op.drop_index('ix_user_first_name_prefix', table_name='user', postgresql_concurrently=True)
+        op.drop_index('ix_user_email_prefix', table_name='user', postgresql_concurrently=True)
+        op.drop_index('ix_user_time_created_id', table_name='user', postgresql_concurrently=True)
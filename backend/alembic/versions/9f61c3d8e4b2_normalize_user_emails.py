@@ -0,0 +1,44 @@
+"""normalize user emails
+
+Revision ID: 9f61c3d8e4b2
+Revises: 7b4d1e9c2a60
+Create Date: 2026-10-17 21:12:09.530871
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9f61c3d8e4b2'
+down_revision: Union[str, Sequence[str], None] = '7b4d1e9c2a60'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Accounts whose emails only differ in case become the same email once lowercased. Those have to be merged or renamed by hand first, picking
+    # one here would silently lock someone out
+    if not op.get_context().as_sql:
+        clashes = op.get_bind().execute(sa.text(
+            'SELECT lower(btrim(email)) FROM "user" GROUP BY lower(btrim(email)) HAVING count(*) > 1 LIMIT 20')).scalars().all()
+        if clashes:
+            raise RuntimeError(f"These emails belong to more than one account once lowercased, resolve them before migrating: {', '.join(clashes)}")
+
+    op.execute('UPDATE "user" SET email = lower(btrim(email)) WHERE email <> lower(btrim(email))')
+
+    # NOT VALID then VALIDATE: adding the constraint only takes a brief lock and the scan of existing rows only blocks other schema changes, not
+    # writes. That only holds once ADD CONSTRAINT's lock is gone, so the migration's transaction is committed before the VALIDATE.
+    # trim() is btrim() on Postgres, it's spelled the portable way here and in entities.py since SQLite has no btrim
+    op.execute('ALTER TABLE "user" ADD CONSTRAINT ck_user_email_normalized CHECK (email = lower(trim(email))) NOT VALID')
+    with op.get_context().autocommit_block():
+        op.execute('ALTER TABLE "user" VALIDATE CONSTRAINT ck_user_email_normalized')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # The emails stay lowercased, their original case is gone
+    op.drop_constraint('ck_user_email_normalized', 'user', type_='check')
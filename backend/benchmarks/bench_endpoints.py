@@ -0,0 +1,154 @@
+"""
+Drives the auth and users endpoints in-process against src.main:app (no network, no uvicorn) and reports per endpoint:
+p50/p95/p99 latency, throughput and DB queries per request.
+
+By default it runs against a throwaway SQLite file through the async engine so it works anywhere. Point DATABASE_URL at a local Postgres to
+benchmark against the real thing (tables are created if missing, nothing is dropped).
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_endpoints --users 20 --requests 500 --concurrency 10 --output results.json
+    python -m benchmarks.compare baseline.json results.json
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, List
+from uuid import uuid4
+from benchmarks.common import setup_env, percentile, save_results
+
+setup_env()
+os.environ.setdefault("ADMISSION_CONTROL", "false")      # Measures the endpoints themselves, bench_overload covers load shedding
+
+import httpx                                    # noqa: E402
+from sqlalchemy import event                    # noqa: E402
+from src.main import app                        # noqa: E402
+from src.core.config import settings            # noqa: E402
+from src.database.core import Base, engine      # noqa: E402
+import src.core.entities                        # noqa: E402,F401  (registers the tables on Base.metadata)
+
+PASSWORD = "benchmark-password"
+
+
+class QueryCounter:
+    """ Counts every statement the engine sends to the database """
+    def __init__(self):
+        self.count = 0
+        event.listen(engine.sync_engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args: Any) -> None:
+        self.count += 1
+
+
+async def run_endpoint(name: str, send: Callable[[int], Awaitable[httpx.Response]], requests: int, concurrency: int,
+                       queries: QueryCounter) -> Dict[str, Any]:
+    """ Calls send(i) for i in range(requests) with at most concurrency calls in flight and summarizes the latencies """
+    latencies: List[float] = []
+    errors = 0
+    next_index = 0
+
+    async def worker():
+        nonlocal errors, next_index
+        while next_index < requests:
+            i = next_index
+            next_index += 1
+            start = time.perf_counter()
+            response = await send(i)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                errors += 1
+
+    queries_before = queries.count
+    started_at = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started_at
+
+    result = {
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": errors,
+        "throughput_rps": requests / elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "queries_per_request": (queries.count - queries_before) / requests,
+    }
+    print(f"{name:<22} {result['throughput_rps']:>9.1f} req/s  p50 {result['p50_ms']:>8.2f} ms  p95 {result['p95_ms']:>8.2f} ms  "
+          f"p99 {result['p99_ms']:>8.2f} ms  {result['queries_per_request']:>5.2f} q/req  {errors} errors")
+    return result
+
+
+async def main(users: int, requests: int, concurrency: int, output: str | None) -> None:
+    if settings.DATABASE_URL.startswith("sqlite") and os.path.exists("bench.sqlite3"):
+        os.remove("bench.sqlite3")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    logging.getLogger().setLevel(logging.WARNING)      # Per-request info logs would drown the results
+    queries = QueryCounter()
+    run_id = uuid4().hex[:8]        # Keeps emails unique when running against a persistent database
+    emails = [f"bench-{run_id}-{i}@example.com" for i in range(users)]
+    tokens: List[Dict[str, str]] = []
+    results: Dict[str, Any] = {}
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            # bcrypt bound endpoints only run once per user, the rest run `requests` times spread over the users
+            results["POST /auth/register"] = await run_endpoint(
+                "POST /auth/register",
+                lambda i: client.post("/auth/register", json={"email": emails[i], "first_name": "Bench", "last_name": "User", "password": PASSWORD}),
+                users, concurrency, queries)
+
+            async def login(i: int) -> httpx.Response:
+                response = await client.post("/auth/token", data={"username": emails[i], "password": PASSWORD})
+                if response.status_code == 200:
+                    tokens.append(response.json())
+                return response
+
+            results["POST /auth/token"] = await run_endpoint("POST /auth/token", login, users, concurrency, queries)
+            if not tokens:
+                raise RuntimeError("No user could log in, check the register/login results above")
+
+            def auth_header(i: int) -> Dict[str, str]:
+                return {"Authorization": f"Bearer {tokens[i % len(tokens)]['access_token']}"}
+
+            # Refresh tokens are single use (a replay revokes the whole family), so each user's refreshes run one after the other and always
+            # send the token the previous refresh returned
+            refresh_locks = [asyncio.Lock() for _ in tokens]
+
+            async def refresh(i: int) -> httpx.Response:
+                slot = i % len(tokens)
+                async with refresh_locks[slot]:
+                    response = await client.post("/auth/refresh", json={"refresh_token": tokens[slot]["refresh_token"]})
+                    if response.status_code == 200:
+                        tokens[slot] = response.json()
+                return response
+
+            results["POST /auth/refresh"] = await run_endpoint("POST /auth/refresh", refresh, requests, concurrency, queries)
+
+            results["GET /users/me"] = await run_endpoint(
+                "GET /users/me", lambda i: client.get("/users/me", headers=auth_header(i)), requests, concurrency, queries)
+
+            results["PATCH /users/me"] = await run_endpoint(
+                "PATCH /users/me",
+                lambda i: client.patch("/users/me", headers=auth_header(i), json={"university": f"University {i}"}),
+                requests, concurrency, queries)
+
+    await engine.dispose()
+
+    if output:
+        save_results(output, results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the auth/users endpoints in-process")
+    parser.add_argument("--users", type=int, default=20, help="Users to register and log in (each costs two bcrypt operations)")
+    parser.add_argument("--requests", type=int, default=500, help="Requests per non-bcrypt endpoint")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    asyncio.run(main(args.users, args.requests, args.concurrency, args.output))
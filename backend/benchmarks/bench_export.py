@@ -0,0 +1,123 @@
+"""
+Memory and throughput of GET /users/export. The export is streamed from a server side cursor a batch at a time, so the peak memory it needs should
+be the same for 50k users as for 500k: run it at two sizes and compare the peaks (traced with tracemalloc, so only Python allocations count).
+
+Usage (from the backend directory): python -m benchmarks.bench_export [--users 200000] [--format ndjson] [--output export.json]
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import time
+import tracemalloc
+from typing import Any, Dict
+from uuid import UUID, uuid4
+from benchmarks.common import setup_env, save_results
+
+setup_env()
+os.environ.setdefault("ADMISSION_CONTROL", "false")
+
+import httpx                                    # noqa: E402
+from src.main import app                        # noqa: E402
+from src.auth.service import password_hasher, insert_new_users      # noqa: E402
+from src.core.config import settings            # noqa: E402
+from src.database.core import AsyncSessionLocal, Base, engine      # noqa: E402
+import src.core.entities                        # noqa: E402,F401  (registers the tables on Base.metadata)
+
+PASSWORD = "benchmark-password"
+ADMIN_EMAIL = "export-admin@example.com"
+INSERT_BATCH = 5000
+
+
+def user_id() -> UUID:
+    # SQLite gives the UUID column numeric affinity, so an id whose hex happens to read as a number (digits and one e) would come back as a
+    # float. At hundreds of thousands of rows that happens, starting every id with a letter rules it out
+    return UUID(int=uuid4().int | (0xA << 124))
+
+
+async def main(users: int, format: str, output: str | None) -> None:
+    if settings.DATABASE_URL.startswith("sqlite") and os.path.exists("bench.sqlite3"):
+        os.remove("bench.sqlite3")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    logging.getLogger().setLevel(logging.WARNING)
+    run_id = uuid4().hex[:8]
+    password_hash = await password_hasher.hash(PASSWORD)
+    async with AsyncSessionLocal() as db:
+        for start in range(0, users, INSERT_BATCH):
+            await db.execute(insert_new_users().values([
+                {"id": user_id(), "email": f"export-{run_id}-{i}@example.com", "first_name": "Bench", "last_name": "User", "password_hash": "x"}
+                for i in range(start, min(start + INSERT_BATCH, users))
+            ]))
+        await db.execute(insert_new_users().values(
+            id=user_id(), email=ADMIN_EMAIL, first_name="Bench", last_name="Admin", password_hash=password_hash))
+        await db.commit()
+
+    async with app.router.lifespan_context(app):
+        logging.getLogger().setLevel(logging.WARNING)
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=None) as client:
+            token = (await client.post("/auth/token", data={"username": ADMIN_EMAIL, "password": PASSWORD})).json()["access_token"]
+
+        # The app is called directly rather than through the client: httpx's ASGI transport collects the whole body before handing it over,
+        # which would put the entire export in memory on the client side of the measurement
+        scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http", "path": "/users/export",
+                 "raw_path": b"/users/export", "root_path": "", "query_string": f"format={format}".encode(), "server": ("bench", 80),
+                 "client": ("127.0.0.1", 1234), "headers": [(b"host", b"bench"), (b"authorization", f"Bearer {token}".encode())]}
+        status_code = 0
+        size = lines = 0
+
+        request_sent = False
+
+        async def receive() -> Dict[str, Any]:
+            nonlocal request_sent
+            if not request_sent:
+                request_sent = True
+                return {"type": "http.request", "body": b"", "more_body": False}
+            await asyncio.Event().wait()        # The client never disconnects, StreamingResponse cancels this once it's done
+            return {"type": "http.disconnect"}
+
+        async def send(message: Dict[str, Any]) -> None:
+            nonlocal status_code, size, lines
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+                lines += message.get("body", b"").count(b"\n")
+
+        tracemalloc.start()
+        started_at = time.perf_counter()
+        await app(scope, receive, send)
+        elapsed = time.perf_counter() - started_at
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    await engine.dispose()
+
+    results: Dict[str, Any] = {
+        "users": users,
+        "format": format,
+        "status": status_code,
+        "lines": lines,
+        "megabytes": size / 1e6,
+        "seconds": elapsed,
+        "rows_per_second": lines / elapsed,
+        "peak_traced_megabytes": peak / 1e6,
+    }
+    print(f"GET /users/export?format={format}: {status_code}, {lines} lines, {size / 1e6:.1f} MB in {elapsed:.2f}s "
+          f"({lines / elapsed:,.0f} rows/s), peak traced memory {peak / 1e6:.1f} MB")
+
+    if output:
+        save_results(output, results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the memory and throughput of the streaming user export")
+    parser.add_argument("--users", type=int, default=200_000)
+    parser.add_argument("--format", choices=("ndjson", "csv"), default="ndjson")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    os.environ.setdefault("ADMIN_EMAILS", f'["{ADMIN_EMAIL}"]')
+    asyncio.run(main(args.users, args.format, args.output))
@@ -0,0 +1,89 @@
+"""
+How long `import src.main` takes in a fresh interpreter, which is what every new worker (and every test run) pays before serving anything.
+Runs python -X importtime a few times and reports the median, the slowest top-level packages and our own modules, and fails when:
+
+- the median is over --budget-ms
+- the import needed the environment (the settings are read on first use, so importing the app must work without any of them set)
+- a module that should only load on first use (passlib, the database drivers, redis) was imported anyway
+
+Usage (from the backend directory): python -m benchmarks.bench_import_time [--budget-ms 1500] [--runs 5] [--output import.json]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+from benchmarks.common import save_results
+
+LAZY_MODULES = ("passlib", "redis", "asyncpg", "aiosqlite")
+
+
+def clean_env() -> Dict[str, str]:
+    """ The current environment minus every Settings field, so a module reading the settings on import fails the run """
+    from src.core.config import Settings
+    return {key: value for key, value in os.environ.items() if key not in Settings.model_fields}
+
+
+def run_once(module: str) -> Tuple[float, Dict[str, float]]:
+    """ Returns the total import time in ms and the cumulative ms per module """
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                               capture_output=True, text=True, env=clean_env())
+    if completed.returncode != 0:
+        raise SystemExit(f"import {module} failed without the environment set:\n{completed.stderr[-2000:]}")
+
+    cumulative: Dict[str, float] = {}
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line or "cumulative" in line:
+            continue
+        _, cumulative_us, name = line.split("|")
+        cumulative[name.strip()] = int(cumulative_us) / 1000
+    return cumulative.get(module, 0.0), cumulative
+
+
+def top(cumulative: Dict[str, float], names: List[str], count: int) -> List[Tuple[str, float]]:
+    return sorted(((name, cumulative[name]) for name in names), key=lambda item: item[1], reverse=True)[:count]
+
+
+def main(module: str, runs: int, budget_ms: float, output: str | None) -> int:
+    totals = []
+    cumulative: Dict[str, float] = {}
+    for _ in range(runs):
+        total, cumulative = run_once(module)
+        totals.append(total)
+    median = statistics.median(totals)
+
+    packages = [name for name in cumulative if "." not in name and name != "src"]
+    own = [name for name in cumulative if name.startswith("src.")]
+    print(f"import {module}: median {median:.1f} ms over {runs} runs (min {min(totals):.1f}, max {max(totals):.1f}), budget {budget_ms:.0f} ms")
+    print("  slowest packages:")
+    for name, ms in top(cumulative, packages, 10):
+        print(f"    {name:<40} {ms:>8.1f} ms")
+    print("  slowest src modules (cumulative, includes what they import):")
+    for name, ms in top(cumulative, own, 10):
+        print(f"    {name:<40} {ms:>8.1f} ms")
+
+    failed = False
+    eager = [name for name in LAZY_MODULES if name in cumulative]
+    if eager:
+        print(f"Imported eagerly, should only load on first use: {', '.join(eager)}")
+        failed = True
+    if median > budget_ms:
+        print(f"Over budget by {median - budget_ms:.1f} ms")
+        failed = True
+
+    if output:
+        save_results(output, {f"import {module}": {"median_ms": median, "min_ms": min(totals), "max_ms": max(totals)}})
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure and budget the import time of the app")
+    parser.add_argument("--module", default="src.main")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=1500.0, help="Fail when the median import takes longer than this")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    sys.exit(main(args.module, args.runs, args.budget_ms, args.output))
@@ -0,0 +1,133 @@
+"""
+Overload behaviour: a flood of logins (far more than bcrypt can keep up with) while a steady trickle of GET /users/me runs next to it, the way an
+app sees a credential stuffing burst or a thundering herd of re-logins after an outage.
+
+Without admission control every login is accepted and queues for the password hasher, so the login latency grows with the flood until clients
+time out. With it (src/core/admission.py) the hashing class settles on a limit that keeps accepted logins near ADMISSION_HASHING_TARGET_SECONDS
+and turns the rest away at once with a 503, while /users/me has a budget of its own. The hashing limit starts at what the password hasher accepts,
+so the first burst of the flood is let in and waits its turn either way; give the limit time to settle (--duration 60 or more) before comparing.
+Run it both ways and compare:
+
+Usage (from the backend directory): python -m benchmarks.bench_overload [--duration 20] [--login-concurrency 64] [--no-admission] [--output overload.json]
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import time
+from collections import Counter
+from typing import Any, Dict, List
+from uuid import uuid4
+from benchmarks.common import setup_env, percentile, save_results
+
+setup_env()
+
+import httpx                                    # noqa: E402
+from src.main import app                        # noqa: E402
+from src.auth.service import password_hasher, insert_new_users      # noqa: E402
+from src.core import admission                  # noqa: E402
+from src.core.config import settings            # noqa: E402
+from src.database.core import AsyncSessionLocal, Base, engine      # noqa: E402
+import src.core.entities                        # noqa: E402,F401  (registers the tables on Base.metadata)
+
+PASSWORD = "benchmark-password"
+
+
+def summarize(latencies: List[float], statuses: Counter) -> Dict[str, Any]:
+    return {
+        "requests": sum(statuses.values()),
+        "statuses": {str(code): count for code, count in sorted(statuses.items())},
+        "ok_p50_ms": percentile(latencies, 50) * 1000,
+        "ok_p99_ms": percentile(latencies, 99) * 1000,
+        "ok_max_ms": max(latencies, default=0.0) * 1000,
+    }
+
+
+async def main(duration: float, login_concurrency: int, me_concurrency: int, output: str | None) -> None:
+    if settings.DATABASE_URL.startswith("sqlite") and os.path.exists("bench.sqlite3"):
+        os.remove("bench.sqlite3")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    logging.getLogger().setLevel(logging.WARNING)
+    run_id = uuid4().hex[:8]
+    emails = [f"overload-{run_id}-{i}@example.com" for i in range(login_concurrency)]
+
+    # The users are inserted directly (one hash shared by all of them) since only the flood is being measured
+    password_hash = await password_hasher.hash(PASSWORD)
+    async with AsyncSessionLocal() as db:
+        await db.execute(insert_new_users().values([
+            {"id": uuid4(), "email": email, "first_name": "Bench", "last_name": "User", "password_hash": password_hash} for email in emails
+        ]))
+        await db.commit()
+
+    login_latencies: List[float] = []
+    login_statuses: Counter = Counter()
+    me_latencies: List[float] = []
+    me_statuses: Counter = Counter()
+
+    async with app.router.lifespan_context(app):
+        logging.getLogger().setLevel(logging.WARNING)      # The lifespan configures logging, per request logs would drown the results
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=None) as client:
+            token = (await client.post("/auth/token", data={"username": emails[0], "password": PASSWORD})).json()["access_token"]
+            headers = {"Authorization": f"Bearer {token}"}
+            deadline = time.perf_counter() + duration
+
+            async def login_worker(worker: int) -> None:
+                while time.perf_counter() < deadline:
+                    start = time.perf_counter()
+                    response = await client.post("/auth/token", data={"username": emails[worker], "password": PASSWORD})
+                    login_statuses[response.status_code] += 1
+                    if response.status_code == 200:
+                        login_latencies.append(time.perf_counter() - start)
+                    else:
+                        await asyncio.sleep(float(response.headers.get("retry-after", 0.05)))      # Well behaved clients back off
+
+            async def me_worker() -> None:
+                while time.perf_counter() < deadline:
+                    start = time.perf_counter()
+                    response = await client.get("/users/me", headers=headers)
+                    me_statuses[response.status_code] += 1
+                    if response.status_code == 200:
+                        me_latencies.append(time.perf_counter() - start)
+                    await asyncio.sleep(0.01)
+
+            await asyncio.gather(*(login_worker(worker) for worker in range(login_concurrency)), *(me_worker() for _ in range(me_concurrency)))
+
+    await engine.dispose()
+
+    results: Dict[str, Any] = {
+        "admission_control": settings.ADMISSION_CONTROL,
+        "duration_seconds": duration,
+        "POST /auth/token": summarize(login_latencies, login_statuses),
+        "GET /users/me": summarize(me_latencies, me_statuses),
+        "final_limits": {name: round(limit.limit, 1) for name, limit in admission.limits.items()},
+    }
+    print(f"{duration:.0f}s flood, {login_concurrency} login clients, {me_concurrency} /users/me clients, "
+          f"admission control {'on' if settings.ADMISSION_CONTROL else 'off'}")
+    for name in ("POST /auth/token", "GET /users/me"):
+        summary = results[name]
+        print(f"  {name:<18} {summary['statuses']}  200s: p50 {summary['ok_p50_ms']:>8.1f} ms  p99 {summary['ok_p99_ms']:>8.1f} ms  "
+              f"max {summary['ok_max_ms']:>8.1f} ms")
+    if settings.ADMISSION_CONTROL:
+        print(f"  limits at the end   {results['final_limits']}")
+
+    if output:
+        save_results(output, results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Flood the login endpoint and see how the app degrades")
+    parser.add_argument("--duration", type=float, default=20.0, help="Seconds the flood lasts")
+    parser.add_argument("--login-concurrency", type=int, default=64)
+    parser.add_argument("--me-concurrency", type=int, default=4)
+    parser.add_argument("--no-admission", action="store_true", help="Run with ADMISSION_CONTROL=false for the baseline")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    # Settings are read on first use, so they can still be changed here
+    if args.no_admission:
+        os.environ["ADMISSION_CONTROL"] = "false"
+    os.environ.setdefault("BCRYPT_ROUNDS", "12")        # The real cost, the point is what happens when hashing can't keep up
+    asyncio.run(main(args.duration, args.login_concurrency, args.me_concurrency, args.output))
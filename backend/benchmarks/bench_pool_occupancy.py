@@ -0,0 +1,141 @@
+"""
+Connection pool occupancy during a burst of logins. Logins are bcrypt bound, so a login that keeps its pooled connection checked out while it
+verifies the password holds that connection for the whole hash and a handful of them drain the pool for everyone else.
+
+The burst runs against a deliberately small pool (--pool-size, no overflow) while a probe runs a trivial query every few milliseconds the way
+any unrelated request would. Reported: how many connections were checked out (sampled every millisecond), how long the probe waited, and the
+login latency. With the connection released before bcrypt the occupancy stays near zero and the probe is not slowed down by the burst.
+
+Usage (from the backend directory): python -m benchmarks.bench_pool_occupancy [--logins 32] [--concurrency 16] [--pool-size 2] [--output pool.json]
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Dict, List
+from uuid import uuid4
+from benchmarks.common import setup_env, percentile, save_results
+
+setup_env()
+os.environ.setdefault("ADMISSION_CONTROL", "false")      # Measures the endpoints themselves, bench_overload covers load shedding
+
+import httpx                                    # noqa: E402
+from sqlalchemy import exc, text                # noqa: E402
+from src.main import app                        # noqa: E402
+from src.auth.service import password_hasher, insert_new_users      # noqa: E402
+from src.core.config import settings            # noqa: E402
+from src.database.core import AsyncSessionLocal, Base, engine      # noqa: E402
+import src.core.entities                        # noqa: E402,F401  (registers the tables on Base.metadata)
+
+PASSWORD = "benchmark-password"
+
+
+async def sample_occupancy(samples: List[int], stop: asyncio.Event) -> None:
+    while not stop.is_set():
+        samples.append(engine.pool.checkedout())
+        await asyncio.sleep(0.001)
+
+
+async def probe(latencies: List[float], timeouts: List[float], stop: asyncio.Event) -> None:
+    """ What an unrelated request sees: one short query, which has to wait whenever the pool is empty """
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            async with AsyncSessionLocal() as db:
+                await db.execute(text("SELECT 1"))
+        except exc.TimeoutError:
+            timeouts.append(time.perf_counter() - start)        # Gave up after DB_POOL_TIMEOUT waiting for a connection
+        latencies.append(time.perf_counter() - start)
+        await asyncio.sleep(0.005)
+
+
+async def main(logins: int, concurrency: int, output: str | None) -> None:
+    if settings.DATABASE_URL.startswith("sqlite") and os.path.exists("bench.sqlite3"):
+        os.remove("bench.sqlite3")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    logging.getLogger().setLevel(logging.WARNING)
+    run_id = uuid4().hex[:8]
+    emails = [f"pool-{run_id}-{i}@example.com" for i in range(concurrency)]
+
+    # The users are inserted directly (one hash shared by all of them) since only the logins are being measured
+    password_hash = await password_hasher.hash(PASSWORD)
+    async with AsyncSessionLocal() as db:
+        await db.execute(insert_new_users().values([
+            {"id": uuid4(), "email": email, "first_name": "Bench", "last_name": "User", "password_hash": password_hash} for email in emails
+        ]))
+        await db.commit()
+
+    samples: List[int] = []
+    probe_latencies: List[float] = []
+    probe_timeouts: List[float] = []
+    login_latencies: List[float] = []
+    failures = 0
+    stop = asyncio.Event()
+
+    async with app.router.lifespan_context(app):
+        logging.getLogger().setLevel(logging.WARNING)      # The lifespan configures logging, per request logs would drown the results
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+            next_login = 0
+
+            async def login_worker(worker: int) -> None:
+                nonlocal next_login, failures
+                while next_login < logins:
+                    next_login += 1
+                    start = time.perf_counter()
+                    response = await client.post("/auth/token", data={"username": emails[worker], "password": PASSWORD})
+                    login_latencies.append(time.perf_counter() - start)
+                    if response.status_code != 200:
+                        failures += 1
+
+            background = [asyncio.create_task(sample_occupancy(samples, stop)), asyncio.create_task(probe(probe_latencies, probe_timeouts, stop))]
+            await asyncio.sleep(0.05)       # Probe baseline before the burst
+            started_at = time.perf_counter()
+            await asyncio.gather(*(login_worker(worker) for worker in range(concurrency)))
+            elapsed = time.perf_counter() - started_at
+            stop.set()
+            await asyncio.gather(*background)
+
+    await engine.dispose()
+
+    results: Dict[str, Any] = {
+        "logins": logins,
+        "concurrency": concurrency,
+        "pool_size": settings.DB_POOL_SIZE,
+        "failures": failures,
+        "logins_per_second": logins / elapsed,
+        "peak_checked_out": max(samples, default=0),
+        "mean_checked_out": sum(samples) / len(samples) if samples else 0.0,
+        "login_p50_ms": percentile(login_latencies, 50) * 1000,
+        "login_p99_ms": percentile(login_latencies, 99) * 1000,
+        "probe_p50_ms": percentile(probe_latencies, 50) * 1000,
+        "probe_p99_ms": percentile(probe_latencies, 99) * 1000,
+        "probe_max_ms": max(probe_latencies, default=0.0) * 1000,
+        "probe_timeouts": len(probe_timeouts),
+    }
+    print(f"{logins} logins, {concurrency} at a time, pool of {settings.DB_POOL_SIZE} (no overflow), {failures} failed")
+    print(f"  checked out connections   peak {results['peak_checked_out']}  mean {results['mean_checked_out']:.2f}")
+    print(f"  login latency             p50 {results['login_p50_ms']:>8.1f} ms  p99 {results['login_p99_ms']:>8.1f} ms")
+    print(f"  probe query latency       p50 {results['probe_p50_ms']:>8.1f} ms  p99 {results['probe_p99_ms']:>8.1f} ms  "
+          f"max {results['probe_max_ms']:>8.1f} ms  {len(probe_timeouts)} timed out")
+
+    if output:
+        save_results(output, results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure pool occupancy and checkout waits during a login burst")
+    parser.add_argument("--logins", type=int, default=32)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--pool-size", type=int, default=2, help="Kept small (and without overflow) so holding connections shows")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    # Settings are read on first use, so the pool can still be sized here
+    os.environ.setdefault("DB_POOL_SIZE", str(args.pool_size))
+    os.environ.setdefault("DB_MAX_OVERFLOW", "0")
+    os.environ.setdefault("DB_POOL_TIMEOUT", "10")      # Logins that hold a connection while waiting for a second one fail instead of hanging
+    asyncio.run(main(args.logins, args.concurrency, args.output))
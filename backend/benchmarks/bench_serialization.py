@@ -0,0 +1,95 @@
+"""
+Serialization cost per request for the /users/me and /auth/token responses: the default path (build the model, then FastAPI validates it again
+against response_model and renders it with JSONResponse) against the FAST_JSON_RESPONSES path (one validation through a cached TypeAdapter,
+rendered by pydantic-core). Only the response handling is timed, not the routing or the handler itself.
+
+Usage (from the backend directory): python -m benchmarks.bench_serialization [--iterations 20000] [--output serialization.json]
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict
+from uuid import uuid4
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute, serialize_response
+from benchmarks.common import setup_env, print_results, save_results
+
+setup_env()
+
+from src.main import app                                            # noqa: E402
+from src.auth.schemas import Token                                  # noqa: E402
+from src.core.config import settings                                # noqa: E402
+from src.core.responses import model_response                       # noqa: E402
+from src.users.schemas import CurrentUserResponse                   # noqa: E402
+
+
+async def time_per_await(func, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        await func()
+    return (time.perf_counter() - start) / iterations
+
+
+def response_field(path: str, method: str):
+    for route in app.routes:
+        if isinstance(route, APIRoute) and route.path == path and method in route.methods:
+            return route.response_field
+    raise LookupError(f"No route for {method} {path}")
+
+
+async def main(iterations: int, output: str | None) -> None:
+    # What the handlers have in hand: the cached user columns for /users/me and the freshly signed tokens for /auth/token
+    profile = {
+        "id": uuid4(), "first_name": "Ada", "last_name": "Lovelace", "email": "ada@university.edu", "university": "University",
+        "password_hash": "$2b$12$" + "x" * 53, "token_version": 1,
+        "time_created": datetime.now(timezone.utc), "time_updated": datetime.now(timezone.utc),
+    }
+    tokens = {"access_token": "a" * 200, "refresh_token": "r" * 200, "token_type": "bearer"}
+
+    me_field = response_field("/users/me", "GET")
+    token_field = response_field("/auth/token", "POST")
+
+    async def default_me():
+        content = await serialize_response(field=me_field, response_content=CurrentUserResponse.model_validate(profile))
+        return JSONResponse(content).body
+
+    async def default_token():
+        content = await serialize_response(field=token_field, response_content=Token(**tokens))
+        return JSONResponse(content).body
+
+    async def fast_me():
+        return model_response(CurrentUserResponse, profile).body
+
+    async def fast_token():
+        return model_response(Token, Token(**tokens)).body
+
+    settings.FAST_JSON_RESPONSES = True
+    # Both paths must produce the same document (the bytes differ only in formatting)
+    assert json.loads(await fast_me()) == json.loads(await default_me())
+    assert json.loads(await fast_token()) == json.loads(await default_token())
+
+    results: Dict[str, Any] = {
+        "/users/me default": await time_per_await(default_me, iterations),
+        "/users/me fast": await time_per_await(fast_me, iterations),
+        "/auth/token default": await time_per_await(default_token, iterations),
+        "/auth/token fast": await time_per_await(fast_token, iterations),
+    }
+
+    print_results(f"Response serialization, {iterations} iterations", results)
+    for name in ("/users/me", "/auth/token"):
+        print(f"  {name}: {results[f'{name} default'] / results[f'{name} fast']:.1f}x faster with FAST_JSON_RESPONSES")
+
+    if output:
+        save_results(output, {name: {"seconds_per_call": seconds} for name, seconds in results.items()})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the default and FAST_JSON_RESPONSES response serialization")
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    asyncio.run(main(args.iterations, args.output))
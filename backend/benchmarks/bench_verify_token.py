@@ -0,0 +1,45 @@
+"""
+Measures what the verify_token cache saves per authenticated request: a full jwt.decode (cold) against a cache hit (warm) on the same access token.
+
+Usage (from the backend directory): python -m benchmarks.bench_verify_token [iterations]
+"""
+
+import sys
+from datetime import timedelta
+from uuid import uuid4
+from benchmarks.common import setup_env, time_per_call, print_results
+
+setup_env()
+
+from src.auth.service import create_token, verify_token, token_cache     # noqa: E402
+from src.core.config import settings                                      # noqa: E402
+
+
+def main(iterations: int = 20_000) -> None:
+    token = create_token(user_id=uuid4(),
+                         token_version=1,
+                         expiry=timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES),
+                         SECRET_KEY=settings.SECRET_KEY,
+                         ALGORITHM=settings.ALGORITHM,
+                         refresh=False)
+
+    def cold():
+        token_cache.clear()
+        verify_token(token=token, SECRET_KEY=settings.SECRET_KEY, ALGORITHM=settings.ALGORITHM, refresh=False)
+
+    def warm():
+        verify_token(token=token, SECRET_KEY=settings.SECRET_KEY, ALGORITHM=settings.ALGORITHM, refresh=False)
+
+    cold_seconds = time_per_call(cold, iterations)
+    warm()      # Prime the cache
+    warm_seconds = time_per_call(warm, iterations)
+
+    print_results(f"verify_token ({iterations} iterations)", {
+        "jwt.decode (cache miss)": cold_seconds,
+        "cache hit": warm_seconds,
+        "saved per request": cold_seconds - warm_seconds,
+    })
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20_000)
@@ -0,0 +1,71 @@
+"""
+Checks that the CSV export can't be used for formula injection: users whose names start with a character a spreadsheet treats as the start of a
+formula (= + - @, a tab or a carriage return) are exported with a leading ', everything else comes out unchanged.
+
+Usage (from the backend directory): python -m benchmarks.check_export_escaping
+"""
+
+import asyncio
+import csv
+import io
+import os
+import sys
+from uuid import uuid4
+from benchmarks.common import setup_env
+
+setup_env()
+
+from src.auth.service import insert_new_users  # noqa: E402
+from src.core.config import settings            # noqa: E402
+from src.database.core import AsyncSessionLocal, Base, engine      # noqa: E402
+from src.users.listing import export_users      # noqa: E402
+import src.core.entities                        # noqa: E402,F401  (registers the tables on Base.metadata)
+
+# first name -> what the export has to contain
+NAMES = {
+    "=HYPERLINK(\"http://evil.example\",\"click\")": "'=HYPERLINK(\"http://evil.example\",\"click\")",
+    "+1+1": "'+1+1",
+    "-2+3": "'-2+3",
+    "@SUM(A1:A9)": "'@SUM(A1:A9)",
+    "\t=1+1": "'\t=1+1",
+    "\r=1+1": "'\r=1+1",
+    "Ada": "Ada",
+    "O'Brien": "O'Brien",
+    "Jean-Luc": "Jean-Luc",
+}
+
+
+async def main() -> int:
+    if settings.DATABASE_URL.startswith("sqlite") and os.path.exists("bench.sqlite3"):
+        os.remove("bench.sqlite3")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    run_id = uuid4().hex[:8]
+    async with AsyncSessionLocal() as db:
+        await db.execute(insert_new_users().values([
+            {"id": uuid4(), "email": f"escape-{run_id}-{i}@example.com", "first_name": name, "last_name": "User", "password_hash": "x"}
+            for i, name in enumerate(NAMES)
+        ]))
+        await db.commit()
+
+    body = b"".join([chunk async for chunk in export_users("csv", f"escape-{run_id}")])
+    await engine.dispose()
+
+    rows = list(csv.DictReader(io.StringIO(body.decode(), newline="")))
+    exported = {row["email"]: row["first_name"] for row in rows}
+    failed = []
+    for i, (name, expected) in enumerate(NAMES.items()):
+        got = exported.get(f"escape-{run_id}-{i}@example.com")
+        if got != expected:
+            failed.append(f"{name!r} was exported as {got!r}, expected {expected!r}")
+
+    for reason in failed:
+        print(f"FAIL {reason}")
+    if not failed:
+        print(f"ok    {len(NAMES)} names exported, the ones a spreadsheet would run as a formula are escaped")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
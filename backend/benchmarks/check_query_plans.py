@@ -0,0 +1,91 @@
+"""
+Checks that the lookups on the user table can be answered from an index, by running EXPLAIN on each of them against DATABASE_URL and failing
+when the plan scans the table. Run it after touching a lookup or the indexes (e.g. in CI against a scratch Postgres), a seq scan on the user table
+only shows up in production once the table is big.
+
+- Postgres: the plan is taken with enable_seqscan off, so a tiny test table still gets its index plan when there is one, and any "Seq Scan" on
+  user means no index can serve the query
+- SQLite: EXPLAIN QUERY PLAN must SEARCH user (or SCAN it USING an INDEX, for the ordered listing) rather than SCAN the table. The prefix search
+  is skipped there, SQLite's case-insensitive LIKE can't use a regular index
+
+Usage (from the backend directory): DATABASE_URL=postgresql+asyncpg://... python -m benchmarks.check_query_plans
+"""
+
+import asyncio
+import json
+import sys
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Tuple
+from uuid import uuid4
+from benchmarks.common import setup_env
+
+setup_env()
+
+from sqlalchemy import Select, select, text, tuple_       # noqa: E402
+from src.auth.schemas import normalize_email                # noqa: E402
+from src.auth.service import _USER_COLUMN_ATTRS, _user_id_in    # noqa: E402
+from src.core.entities import User                          # noqa: E402
+from src.database.core import Base, engine                  # noqa: E402
+from src.users.listing import _users_query                  # noqa: E402
+
+USER_ID = uuid4()
+
+# The statements the app sends, with made up values
+LOOKUPS: List[Tuple[str, Select, Tuple[str, ...]]] = [
+    ("login (authenticate_user)",
+     select(User.id, User.token_version, User.password_hash).filter(User.email == normalize_email(" Someone@University.EDU ")), ()),
+    ("existing emails (bulk import)", select(User.email).where(User.email.in_(["a@x.edu", "b@x.edu"])), ()),
+    ("user by id (load_user_snapshot)", select(*_USER_COLUMN_ATTRS).filter(User.id == USER_ID), ()),
+    ("token versions (introspect)", select(User.id, User.token_version).where(_user_id_in([USER_ID, uuid4()])), ()),
+    ("listing, first page", _users_query(None).limit(51), ()),
+    ("listing, next page", _users_query(None).limit(51).filter(
+        tuple_(User.time_created, User.id) < tuple_(datetime(2026, 1, 1, tzinfo=timezone.utc), USER_ID)), ()),
+    ("listing, prefix search", _users_query("some").limit(51), ("sqlite",)),
+]
+
+
+def _postgres_seq_scans(plan: Dict[str, Any]) -> List[str]:
+    scans = [plan["Relation Name"]] if plan["Node Type"] == "Seq Scan" else []
+    for child in plan.get("Plans", []):
+        scans += _postgres_seq_scans(child)
+    return scans
+
+
+async def explain(statement: Select) -> Tuple[str, bool]:
+    """ The plan as text, and whether it scans the user table """
+    sql = str(statement.compile(dialect=engine.dialect, compile_kwargs={"literal_binds": True}))
+    async with engine.connect() as conn:
+        if engine.dialect.name == "postgresql":
+            await conn.execute(text("SET LOCAL enable_seqscan = off"))
+            plan = (await conn.execute(text(f"EXPLAIN (FORMAT JSON) {sql}"))).scalar_one()
+            plan = plan if isinstance(plan, list) else json.loads(plan)
+            return json.dumps(plan[0]["Plan"], indent=1), "user" in _postgres_seq_scans(plan[0]["Plan"])
+
+        details = [row[-1] for row in (await conn.execute(text(f"EXPLAIN QUERY PLAN {sql}"))).all()]
+        scans = [detail for detail in details if detail.startswith("SCAN user") and "USING" not in detail]
+        return "\n".join(details), bool(scans)
+
+
+async def main() -> int:
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    failed = []
+    for name, statement, skip_on in LOOKUPS:
+        if engine.dialect.name in skip_on:
+            print(f"skip  {name} (not on {engine.dialect.name})")
+            continue
+        plan, scans = await explain(statement)
+        print(f"{'FAIL' if scans else 'ok':<5} {name}")
+        if scans:
+            failed.append(name)
+            print("      " + plan.replace("\n", "\n      "))
+
+    await engine.dispose()
+    if failed:
+        print(f"{len(failed)} lookup(s) scan the user table: {', '.join(failed)}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,79 @@
+"""
+Checks refresh token reuse handling around the grace window (REFRESH_REUSE_GRACE_SECONDS, see src/auth/sessions.py):
+
+- the same refresh token sent by N clients at once (a double-submit) gets exactly one 200 and a 409 for every other request, and the token the
+  200 returned still works, i.e. the family wasn't revoked
+- the old token sent again after the grace window is treated as a reuse: 401 and the whole family is revoked, the latest token stops working
+
+Usage (from the backend directory): python -m benchmarks.check_refresh_double_submit [--clients 5]
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import sys
+from collections import Counter
+from uuid import uuid4
+from benchmarks.common import setup_env
+
+setup_env()
+os.environ.setdefault("ADMISSION_CONTROL", "false")
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+os.environ.setdefault("REFRESH_REUSE_GRACE_SECONDS", "2")       # Short, so the check doesn't wait long for it to pass
+
+import httpx                                    # noqa: E402
+from src.main import app                        # noqa: E402
+from src.core.config import settings            # noqa: E402
+from src.database.core import Base, engine      # noqa: E402
+import src.core.entities                        # noqa: E402,F401  (registers the tables on Base.metadata)
+
+
+async def main(clients: int) -> int:
+    if settings.DATABASE_URL.startswith("sqlite") and os.path.exists("bench.sqlite3"):
+        os.remove("bench.sqlite3")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    failed = []
+    email = f"refresh-{uuid4().hex[:8]}@example.com"
+    async with app.router.lifespan_context(app):
+        logging.getLogger().setLevel(logging.CRITICAL)
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=None) as client:
+            await client.post("/auth/register", json={"email": email, "first_name": "Refresh", "last_name": "Check", "password": "refresh-password"})
+            original = (await client.post("/auth/token", data={"username": email, "password": "refresh-password"})).json()["refresh_token"]
+
+            responses = await asyncio.gather(*(client.post("/auth/refresh", json={"refresh_token": original}) for _ in range(clients)))
+            statuses = Counter(response.status_code for response in responses)
+            print(f"{clients} concurrent refreshes with one token: {dict(sorted(statuses.items()))}")
+            if statuses != Counter({200: 1, 409: clients - 1}):
+                failed.append(f"expected one 200 and {clients - 1} 409s")
+            successor = next((response.json()["refresh_token"] for response in responses if response.status_code == 200), None)
+
+            if successor is not None:
+                response = await client.post("/auth/refresh", json={"refresh_token": successor})
+                print(f"the successor after the double-submit: {response.status_code}")
+                if response.status_code != 200:
+                    failed.append("the double-submit revoked the family")
+                latest = response.json().get("refresh_token")
+
+                await asyncio.sleep(settings.REFRESH_REUSE_GRACE_SECONDS + 0.5)
+                replay = await client.post("/auth/refresh", json={"refresh_token": original})
+                after = await client.post("/auth/refresh", json={"refresh_token": latest})
+                print(f"the original after the grace window: {replay.status_code}, the latest token after that: {after.status_code}")
+                if replay.status_code != 401 or after.status_code != 401:
+                    failed.append("a reuse after the grace window didn't revoke the family")
+
+    await engine.dispose()
+    for reason in failed:
+        print(f"FAIL {reason}")
+    if not failed:
+        print("ok")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Send one refresh token several times at once and check the family survives")
+    parser.add_argument("--clients", type=int, default=5)
+    args = parser.parse_args()
+    sys.exit(asyncio.run(main(args.clients)))
@@ -0,0 +1,83 @@
+"""
+Checks that concurrent registrations of the same email can't race: N clients POST /auth/register with one email at the same time, and exactly
+one of them must get a 201 and every other one a 409. A 500 (or a second 201) means the uniqueness check and the insert came apart again.
+
+A 503 isn't an answer: admission control or the password hasher's queue turned the request away before it got to the insert, so the client
+waits out Retry-After and sends it again, the way a real client would. How many of those there were is reported next to the results.
+
+Usage (from the backend directory): python -m benchmarks.check_register_race [--clients 50] [--mixed-case]
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import sys
+from collections import Counter
+from uuid import uuid4
+from benchmarks.common import setup_env
+
+setup_env()
+os.environ.setdefault("BCRYPT_ROUNDS", "4")     # What's checked is the insert, not the hashing
+
+import httpx                                    # noqa: E402
+from src.main import app                        # noqa: E402
+from src.core.config import settings            # noqa: E402
+from src.database.core import Base, engine      # noqa: E402
+import src.core.entities                        # noqa: E402,F401  (registers the tables on Base.metadata)
+
+MAX_ATTEMPTS = 20
+
+
+async def main(clients: int, mixed_case: bool) -> int:
+    if settings.DATABASE_URL.startswith("sqlite") and os.path.exists("bench.sqlite3"):
+        os.remove("bench.sqlite3")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    email = f"race-{uuid4().hex[:8]}@example.com"
+    statuses: Counter = Counter()
+    shed = 0
+
+    async with app.router.lifespan_context(app):
+        logging.getLogger().setLevel(logging.CRITICAL)     # Every loser logs its 409
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=None) as client:
+            start = asyncio.Event()
+
+            async def register(i: int) -> None:
+                nonlocal shed
+                # With --mixed-case every client spells the email differently, they still have to end up as one account
+                address = email.upper() if mixed_case and i % 2 else email
+                payload = {"email": address, "first_name": "Race", "last_name": f"Client{i}", "password": "race-password"}
+                await start.wait()
+                for _ in range(MAX_ATTEMPTS):
+                    response = await client.post("/auth/register", json=payload)
+                    if response.status_code != 503:
+                        statuses[response.status_code] += 1
+                        return
+                    shed += 1
+                    await asyncio.sleep(float(response.headers.get("retry-after", 1)))
+                statuses[503] += 1
+
+            tasks = [asyncio.create_task(register(i)) for i in range(clients)]
+            await asyncio.sleep(0)
+            start.set()
+            await asyncio.gather(*tasks)
+
+    await engine.dispose()
+
+    print(f"{clients} concurrent registrations of {email}: {dict(sorted(statuses.items()))} ({shed} 503s retried)")
+    expected = Counter({201: 1, 409: clients - 1}) if clients > 1 else Counter({201: 1})
+    if statuses != expected:
+        print(f"FAIL expected {dict(sorted(expected.items()))}")
+        return 1
+    print("ok")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Register one email from many clients at once and check only one of them wins")
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--mixed-case", action="store_true", help="Alternate the case of the email between clients")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(main(args.clients, args.mixed_case)))
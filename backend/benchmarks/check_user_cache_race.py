@@ -0,0 +1,79 @@
+"""
+Checks that a user load which was already running when the user got invalidated doesn't put its (old) row in the user cache. The load is held
+right after its SELECT returned, the user is invalidated the way every write path does it, then the load is let go: the callers that were waiting
+on it still get the row, but the cache must stay empty. A load started after the invalidation has to fill it again as usual.
+
+Usage (from the backend directory): python -m benchmarks.check_user_cache_race
+"""
+
+import asyncio
+import os
+import sys
+from uuid import uuid4
+from benchmarks.common import setup_env
+
+setup_env()
+
+from sqlalchemy import event                    # noqa: E402
+from sqlalchemy.util import await_only          # noqa: E402
+from src.auth.service import insert_new_users, invalidate_cached_user, load_user_snapshot, user_cache, user_loads   # noqa: E402
+from src.core.config import settings            # noqa: E402
+from src.database.core import AsyncSessionLocal, Base, engine      # noqa: E402
+import src.core.entities                        # noqa: E402,F401  (registers the tables on Base.metadata)
+
+
+async def main() -> int:
+    if settings.DATABASE_URL.startswith("sqlite") and os.path.exists("bench.sqlite3"):
+        os.remove("bench.sqlite3")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    user_id = uuid4()
+    async with AsyncSessionLocal() as db:
+        await db.execute(insert_new_users().values(id=user_id, email="cache-race@example.com", first_name="Cache", last_name="Race",
+                                                   password_hash="x"))
+        await db.commit()
+
+    selected = asyncio.Event()
+    release = asyncio.Event()
+
+    # Runs inside the greenlet of the load's query, await_only suspends the load there without blocking the event loop
+    def hold_after_select(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT") and not release.is_set():
+            selected.set()
+            await_only(release.wait())
+
+    event.listen(engine.sync_engine, "after_cursor_execute", hold_after_select)
+    try:
+        async with AsyncSessionLocal() as db:
+            waiting = asyncio.create_task(load_user_snapshot(user_id, db))
+            await asyncio.wait_for(selected.wait(), timeout=10)
+            invalidate_cached_user(user_id)       # What a password change or profile update does right after its commit
+            release.set()
+            snapshot = await asyncio.wait_for(waiting, timeout=10)
+    finally:
+        event.remove(engine.sync_engine, "after_cursor_execute", hold_after_select)
+
+    failed = []
+    if snapshot is None or snapshot["id"] != user_id:
+        failed.append("the callers waiting on the load didn't get the row")
+    if user_cache.get(user_id) is not None:
+        failed.append("the load that was invalidated mid-flight cached its snapshot")
+
+    async with AsyncSessionLocal() as db:
+        await load_user_snapshot(user_id, db)
+    if user_cache.get(user_id) is None:
+        failed.append("a load started after the invalidation didn't cache its snapshot")
+    if len(user_loads):
+        failed.append(f"{len(user_loads)} load(s) still registered")
+
+    await engine.dispose()
+    for reason in failed:
+        print(f"FAIL {reason}")
+    if not failed:
+        print("ok    a load invalidated mid-flight leaves the user cache alone")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,80 @@
+import json
+import math
+import os
+import platform
+import subprocess
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List
+
+"""
+Shared helpers for the benchmark scripts. Run them from the backend directory, e.g. python -m benchmarks.bench_verify_token
+
+Settings() needs every secret from config.py to be present, so we fill in throwaway values for anything that isn't already set in the environment.
+This has to happen before the settings are first used (importing src is fine, they are read on first access).
+"""
+
+BENCH_ENV = {
+    "CELERY_BROKER_URL": "redis://localhost:6379/0",
+    "CELERY_RESULT_BACKEND": "redis://localhost:6379/0",
+    "PGADMIN_EMAIL": "bench@example.com",
+    "PGADMIN_PASSWORD": "bench",
+    "DATABASE_URL": "sqlite+aiosqlite:///bench.sqlite3",
+    "DB_USER": "bench",
+    "DB_PASSWORD": "bench",
+    "DB_NAME": "bench",
+    "SECRET_KEY": "benchmark-secret-key-benchmark-secret-key",
+    "ALGORITHM": "HS256",
+    "ACCESS_TOKEN_EXPIRE_MINUTES": "15",
+    "REFRESH_TOKEN_EXPIRE_MINUTES": "10080",
+    "LOGIN_THROTTLE_ENABLED": "false",        # Every simulated login comes from the same client
+}
+
+def setup_env() -> None:
+    for key, value in BENCH_ENV.items():
+        os.environ.setdefault(key, value)
+
+
+def time_per_call(func: Callable[[], object], iterations: int) -> float:
+    """ Returns the mean seconds per call of func over the given number of iterations """
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - start) / iterations
+
+
+def print_results(title: str, results: Dict[str, float]) -> None:
+    print(title)
+    for name, seconds in results.items():
+        print(f"  {name:<40} {seconds * 1e6:>10.2f} us/call")
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    """ Nearest-rank percentile of an unsorted list of samples """
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def save_results(path: str, results: Dict[str, Any]) -> None:
+    """ Writes results as JSON together with enough context (commit, python, machine) to compare runs later with benchmarks.compare """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    document = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "commit": commit,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+        },
+        "results": results,
+    }
+    with open(path, "w") as f:
+        json.dump(document, f, indent=2)
+    print(f"Saved results to {path}")
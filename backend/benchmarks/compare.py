@@ -0,0 +1,62 @@
+"""
+Compares two benchmark result files (from --output) and exits non-zero if any metric regressed by more than the threshold, so it can gate a deploy.
+
+Usage (from the backend directory): python -m benchmarks.compare baseline.json current.json [--threshold 10]
+"""
+
+import argparse
+import json
+import sys
+
+# Metric name -> True when a higher value is better
+METRICS = {
+    "throughput_rps": True,
+    "p50_ms": False,
+    "p95_ms": False,
+    "p99_ms": False,
+    "queries_per_request": False,
+    "seconds_per_call": False,
+}
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> int:
+    regressions = 0
+    for name, current_metrics in current["results"].items():
+        baseline_metrics = baseline["results"].get(name)
+        if baseline_metrics is None:
+            print(f"{name}: no baseline, skipping")
+            continue
+
+        for metric, higher_is_better in METRICS.items():
+            if metric not in current_metrics or metric not in baseline_metrics:
+                continue
+
+            old, new = baseline_metrics[metric], current_metrics[metric]
+            if old == 0:
+                change = 0.0 if new == 0 else float("inf")
+            else:
+                change = (new - old) / old * 100
+
+            regressed = change < -threshold if higher_is_better else change > threshold
+            regressions += regressed
+            marker = "REGRESSION" if regressed else ""
+            print(f"{name:<28} {metric:<20} {old:>12.4f} -> {new:>12.4f} ({change:+7.1f}%) {marker}")
+
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--threshold", type=float, default=10.0, help="Allowed change in percent before a metric counts as a regression")
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+
+    regressions = compare(baseline, current, args.threshold)
+    print(f"{regressions} regression(s) over {args.threshold}%")
+    sys.exit(1 if regressions else 0)
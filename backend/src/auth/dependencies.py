@@ -1,11 +1,14 @@
 import logging
+import math
+import secrets
 from uuid import UUID
-from fastapi import Depends, HTTPException
+from fastapi import Depends, Header, HTTPException, Request
 from starlette import status
-from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy import select
-from src.database.core import DB_Session
-from src.auth.service import verify_token
+from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
+from src.database.core import DB_Session, DB_ReadSession, recent_writes
+from src.auth.rate_limit import LoginThrottled
+from src.auth.schemas import normalize_email
+from src.auth.service import verify_token, load_user, load_user_snapshot, token_store, login_throttle, auth_revoked_tokens, Principal
 from src.core.config import settings
 from src.core.entities import User
 from typing import Annotated
@@ -19,23 +22,11 @@ the access_token. The only reason we use the tokenUrl specified is for documenta
 oauth2_bearer = OAuth2PasswordBearer(tokenUrl='auth/token')
 Bearer_Token = Annotated[str, Depends(oauth2_bearer)]       # Basically, Bearer_Token is of type str but it also depends on oauth2_bearer to extract the token from the authorization header
 
-# Dependency function which also depends on the
-async def get_current_user(token: Bearer_Token, db: DB_Session) -> User:
+async def get_current_principal(token: Bearer_Token, read_db: DB_ReadSession) -> Principal:
     """
-    Docstring for get_current_user
-
-    :param token: this is another dependency which extracts the bearer token from the authorization header
-    :type token: Bearer_Token
-    :param db: this is used for querying via the extracted token data to get the full user object
-    :type db: DB_Session
-    :return: this returns a full reflection of the actual user object stored in the database omitted sensitive details ofcourse like password hash
-    :rtype: CurrentUserResponse
-
-    This function should verify the token, extract the user relevant metadata from the token, query the database for all the information about this user,
-    populate the CurrentUserResponse object with the data it recieves and return that object
+    Verifies the access token and checks it hasn't been revoked. When the token store knows the user this costs no query at all, otherwise the
+    user's row is read once (through a replica when there is one) which also warms the user cache for CurrentUser and /users/me.
     """
-
-    # First verify the access token
     token_data = verify_token(token=token,
                               SECRET_KEY=settings.SECRET_KEY,
                               ALGORITHM=settings.ALGORITHM,
@@ -47,8 +38,55 @@ async def get_current_user(token: Bearer_Token, db: DB_Session) -> User:
                             headers={"WWW-Authenticate": "Bearer"})
 
     token_id = UUID(token_data['sub'])
-    result = await db.execute(select(User).filter(User.id == token_id))
-    user = result.scalars().first()
+    recent_writes.route(read_db, token_id)      # Users who just changed their row read it back from the primary
+
+    # The token store answers the revocation check without touching the database, we only fall back to it when the store doesn't know this user
+    token_version = await token_store.get(token_id)
+    if token_version is None:
+        snapshot = await load_user_snapshot(token_id, read_db)
+        if snapshot is None:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Invalid token",
+                headers={"WWW-Authenticate": "Bearer"})
+
+        token_version = snapshot['token_version']
+        await token_store.add(token_id, token_version)
+
+    if token_version != token_data['token_version']:
+        auth_revoked_tokens.inc(("access",))
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED, detail="Token revoked"
+        )
+
+    return Principal(id=token_id, token_version=token_version)
+
+
+# For routes that only need to know who is calling
+CurrentPrincipal = Annotated[Principal, Depends(get_current_principal)]
+
+
+# Dependency function which also depends on the principal
+async def get_current_user(principal: CurrentPrincipal, db: DB_Session, read_db: DB_ReadSession) -> User:
+    """
+    Docstring for get_current_user
+
+    :param principal: the verified and not revoked caller, see get_current_principal
+    :type principal: CurrentPrincipal
+    :param db: the returned user is attached to this session so routes can modify it and commit
+    :type db: DB_Session
+    :param read_db: the lookup itself goes through here so it can be served by a read replica
+    :type read_db: DB_ReadSession
+    :return: the full ORM user
+    :rtype: User
+
+    Only routes that modify the user need this, everything else should use CurrentPrincipal. The user comes from the user cache when possible
+    and is attached to db without a query, so db only takes a connection once the route writes (sessions connect on their first statement).
+    """
+    user = await load_user(principal.id, db, token_version=principal.token_version, read_db=read_db)
+    # The routes behind CurrentUser only write through db, so hand read_db's connection (if the lookups above took one) back to the pool now
+    # rather than at the end of the request. Otherwise change-password would hold it through two bcrypt runs
+    await read_db.commit()
 
     if not user:
         raise HTTPException(
@@ -56,7 +94,9 @@ async def get_current_user(token: Bearer_Token, db: DB_Session) -> User:
             detail="Invalid token",
             headers={"WWW-Authenticate": "Bearer"})
 
-    if token_data['token_version'] != user.token_version:
+    # The store and the row can briefly disagree (e.g. the store entry expired before a password change reached us), the row wins
+    if user.token_version != principal.token_version:
+        auth_revoked_tokens.inc(("access",))
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail="Token revoked"
         )
@@ -65,8 +105,40 @@ async def get_current_user(token: Bearer_Token, db: DB_Session) -> User:
     return user
 
 
-# This is the object that will be imported and used which depends on get_current_user which essentially extracts the bearer token from the header, verifies it, and return the user data
+# This is the object that will be imported and used by routes that modify the user. It depends on get_current_principal which extracts the
+# bearer token from the header and verifies it, and returns the full user
 CurrentUser = Annotated[User, Depends(get_current_user)]
 
 
+async def get_admin_user(user: CurrentUser) -> User:
+    """ Same as get_current_user but only lets through the accounts listed in ADMIN_EMAILS """
+    if user.email not in {normalize_email(email) for email in settings.ADMIN_EMAILS}:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required")
+    return user
+
+
+AdminUser = Annotated[User, Depends(get_admin_user)]
 
+
+async def enforce_login_rate_limit(request: Request, form_data: Annotated[OAuth2PasswordRequestForm, Depends()]) -> None:
+    """
+    Runs before the login handler, so before any bcrypt work, and turns away attempts over the per IP / per account limits with a 429.
+    The IP is the connecting client's, run uvicorn with --proxy-headers (and --forwarded-allow-ips) behind a load balancer so it's the real one.
+    """
+    ip = request.client.host if request.client else "unknown"
+    email = normalize_email(form_data.username)
+    try:
+        await login_throttle.check(ip, email)
+    except LoginThrottled as e:
+        logger.warning("Throttled login attempt for %s from %s (%s)", email, ip, e.reason)
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                            detail="Too many login attempts. Please try again later",
+                            headers={"Retry-After": str(math.ceil(e.retry_after))})
+
+
+async def require_introspection_key(x_api_key: Annotated[str | None, Header()] = None) -> None:
+    """ Guards POST /auth/introspect when INTROSPECT_API_KEY is set """
+    if settings.INTROSPECT_API_KEY is None:
+        return
+    if x_api_key is None or not secrets.compare_digest(x_api_key.encode(), settings.INTROSPECT_API_KEY.encode()):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid API key")
@@ -0,0 +1,204 @@
+import argparse
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any, Callable, Dict, List
+from src.core.metrics import Histogram
+
+if TYPE_CHECKING:
+    from passlib.context import CryptContext
+
+logger = logging.getLogger(__name__)
+
+"""
+bcrypt is deliberately slow (100+ ms per call) so running it directly inside an async handler freezes the whole event loop for that long. This module
+moves every hash/verify onto a worker pool and puts an admission limit in front of it:
+
+- at most max_workers jobs run at once (one per core by default)
+- at most max_pending jobs wait in line for a worker; anything past that is rejected straight away with PasswordHasherBusy
+  instead of piling up and making every login time out
+
+Note: the bcrypt backend releases the GIL while hashing, so the thread pool already scales with cores. The process pool is there for backends that don't.
+The module level _hash and _verify functions are what gets shipped to the workers which is why they can't be methods (process pools need to pickle them).
+"""
+
+DEFAULT_ROUNDS = 12
+
+@lru_cache(maxsize=None)
+def _bcrypt_context(rounds: int) -> "CryptContext":
+    # passlib (and its bcrypt backend, loaded on the first hash) is only imported once something actually hashes, in whichever worker does it
+    from passlib.context import CryptContext
+    return CryptContext(schemes=['bcrypt'], deprecated='auto', bcrypt__rounds=rounds)
+
+# The cost is passed along with every job (rather than configured on the module) so process pool workers always hash with the configured rounds
+def _hash(password: str, rounds: int = DEFAULT_ROUNDS) -> str:
+    return _bcrypt_context(rounds).hash(password)
+
+def _verify(plain_password: str, hashed_password: str) -> bool:
+    return _bcrypt_context(DEFAULT_ROUNDS).verify(plain_password, hashed_password)     # Any cost verifies, the rounds only matter for new hashes
+
+
+HASH_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+password_hash_seconds = Histogram("password_hash_seconds", "Time spent inside bcrypt per job",
+                                  buckets=HASH_BUCKETS, labelnames=("operation",))
+password_hash_queue_wait_seconds = Histogram("password_hash_queue_wait_seconds", "Time a job waited for a free hashing worker",
+                                             buckets=(0.0,) + HASH_BUCKETS, labelnames=("operation",))
+
+
+class PasswordHasherBusy(Exception):
+    """ Raised when the hashing queue is full and the job was shed instead of queued """
+
+
+class PasswordHasher:
+    def __init__(self, executor: str = "thread", max_workers: int | None = None, max_pending: int = 64, rounds: int = DEFAULT_ROUNDS):
+        if executor not in ("thread", "process"):
+            raise ValueError(f"Unknown password hash executor: {executor}. Expected 'thread' or 'process'")
+
+        self.executor_kind = executor
+        self.rounds = rounds
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_pending = max_pending
+        self._executor: Executor | None = None      # Created on first use so importing this module never spawns workers
+        self._slots: asyncio.Semaphore | None = None
+
+        # Metrics: these are only ever touched from the event loop thread so plain ints/floats are enough
+        self.pending = 0                # Jobs waiting for a free worker (queue depth)
+        self.in_flight = 0              # Jobs currently running on a worker
+        self.completed = 0
+        self.rejected = 0
+        self.queue_wait_seconds = 0.0   # Total time spent waiting for a worker
+        self.hash_seconds = 0.0         # Total time spent inside bcrypt
+        self.max_hash_seconds = 0.0
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.executor_kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="password-hasher")
+        return self._executor
+
+    async def _run(self, operation: str, func: Callable[..., Any], *args: Any, shed: bool = True) -> Any:
+        # Admission control: shed the job right away if the line is already full
+        if shed and self.pending + self.in_flight >= self.max_workers + self.max_pending:
+            self.rejected += 1
+            logger.warning("Password hasher saturated (%d running, %d queued). Rejecting job", self.in_flight, self.pending)
+            raise PasswordHasherBusy()
+
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_workers)
+
+        queued_at = time.perf_counter()
+        self.pending += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.pending -= 1
+
+        started_at = time.perf_counter()
+        self.queue_wait_seconds += started_at - queued_at
+        password_hash_queue_wait_seconds.observe(started_at - queued_at, (operation,))
+        self.in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), func, *args)
+        finally:
+            elapsed = time.perf_counter() - started_at
+            self.in_flight -= 1
+            self.completed += 1
+            self.hash_seconds += elapsed
+            self.max_hash_seconds = max(self.max_hash_seconds, elapsed)
+            password_hash_seconds.observe(elapsed, (operation,))
+            self._slots.release()
+
+    async def hash(self, password: str) -> str:
+        return await self._run("hash", _hash, password, self.rounds)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run("verify", _verify, plain_password, hashed_password)
+
+    async def hash_many(self, passwords: List[str], concurrency: int | None = None) -> List[str]:
+        """
+        Hashes a whole batch (bulk imports) using up to concurrency workers at once, max_workers by default. These jobs skip admission control
+        since the caller already bounds how many it has queued, but they wait in the same line as everyone else so logins still get their turn.
+        """
+        limit = asyncio.Semaphore(concurrency or self.max_workers)
+
+        async def hash_one(password: str) -> str:
+            async with limit:
+                return await self._run("hash", _hash, password, self.rounds, shed=False)
+
+        return await asyncio.gather(*(hash_one(password) for password in passwords))
+
+    def needs_update(self, hashed_password: str) -> bool:
+        """
+        True when the hash is weaker than the configured rounds (or uses a deprecated scheme) and should be replaced next time we see the password.
+        Hashes stronger than the setting are left alone, so lowering BCRYPT_ROUNDS speeds up new hashes without downgrading existing ones.
+        Only parses the hash, nothing is computed, so it's fine to call on the event loop.
+        """
+        if not _bcrypt_context(self.rounds).needs_update(hashed_password):
+            return False
+        try:
+            return int(hashed_password.split("$")[2]) < self.rounds
+        except (IndexError, ValueError):
+            return True     # Not a bcrypt hash we understand, replace it
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "executor": self.executor_kind,
+            "rounds": self.rounds,
+            "max_workers": self.max_workers,
+            "max_pending": self.max_pending,
+            "pending": self.pending,
+            "in_flight": self.in_flight,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "queue_wait_seconds": self.queue_wait_seconds,
+            "hash_seconds": self.hash_seconds,
+            "max_hash_seconds": self.max_hash_seconds,
+        }
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+
+def calibrate(target_ms: float, min_rounds: int = 10, max_rounds: int = 16) -> int:
+    """
+    Times a hash at each cost from min_rounds up and returns the highest one that still hashes within target_ms on this machine (never less than
+    min_rounds). Every extra round doubles the time, so we stop as soon as we're past the target.
+    """
+    chosen = min_rounds
+    for rounds in range(min_rounds, max_rounds + 1):
+        context = _bcrypt_context(rounds)
+        samples = []
+        for _ in range(3):
+            started_at = time.perf_counter()
+            context.hash("calibration-password")
+            samples.append((time.perf_counter() - started_at) * 1000)
+        elapsed_ms = sorted(samples)[1]     # Median of three
+        print(f"rounds={rounds:<3} {elapsed_ms:8.1f} ms")
+        if elapsed_ms > target_ms:
+            break
+        chosen = rounds
+    return chosen
+
+
+"""
+Picking BCRYPT_ROUNDS for the hardware a deployment runs on (from the backend directory):
+
+python -m src.auth.hashing --target-ms 250
+"""
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find the bcrypt cost that hashes within a target time on this machine")
+    parser.add_argument("--target-ms", type=float, default=250.0)
+    parser.add_argument("--min-rounds", type=int, default=10)
+    parser.add_argument("--max-rounds", type=int, default=16)
+    args = parser.parse_args()
+
+    print(f"BCRYPT_ROUNDS={calibrate(args.target_ms, args.min_rounds, args.max_rounds)}")
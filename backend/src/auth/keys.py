@@ -0,0 +1,112 @@
+import argparse
+import json
+import logging
+from pathlib import Path
+from typing import Any, Dict
+import jwt
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+
+logger = logging.getLogger(__name__)
+
+"""
+Asymmetric signing keys for JWTs. With ALGORITHM set to RS256, ES256 or EdDSA tokens are signed with a private key and anyone holding the public key
+can verify them, so other services can validate our tokens locally (via /.well-known/jwks.json) instead of calling back into this API.
+
+Keys live in JWT_KEYS_DIR, one file per key id (kid):
+- <kid>.pem       private key. Can sign (if it is JWT_ACTIVE_KID) and verify
+- <kid>.pub.pem   public key only. Still verifies tokens but never signs, which is how a retired key is kept around until its tokens expire
+
+Rotation: generate a new key, make it JWT_ACTIVE_KID, and replace the old private key with its .pub.pem once the new kid is live everywhere.
+Every PEM is parsed exactly once at startup, signing and verification only ever see the parsed key objects.
+"""
+
+ASYMMETRIC_ALGORITHMS = {"RS256", "RS384", "RS512", "ES256", "ES384", "ES512", "EdDSA"}
+
+
+class KeyRing:
+    def __init__(self, algorithm: str, active_kid: str, private_keys: Dict[str, Any], public_keys: Dict[str, Any]):
+        if active_kid not in private_keys:
+            raise ValueError(f"No private key found for the active kid '{active_kid}'")
+
+        self.algorithm = algorithm
+        self.active_kid = active_kid
+        self._private_keys = private_keys
+        self._public_keys = public_keys
+
+        # The JWKS document never changes while the process runs so serialize it once
+        to_jwk = jwt.get_algorithm_by_name(algorithm).to_jwk
+        jwks_keys = []
+        for kid, public_key in sorted(public_keys.items()):
+            jwk = to_jwk(public_key, as_dict=True)
+            jwk.update({"kid": kid, "alg": algorithm, "use": "sig"})
+            jwks_keys.append(jwk)
+        self.jwks_json = json.dumps({"keys": jwks_keys}).encode()
+
+    @classmethod
+    def from_directory(cls, path: str, algorithm: str, active_kid: str) -> "KeyRing":
+        private_keys: Dict[str, Any] = {}
+        public_keys: Dict[str, Any] = {}
+
+        for key_file in sorted(Path(path).glob("*.pem")):
+            data = key_file.read_bytes()
+            if key_file.name.endswith(".pub.pem"):
+                kid = key_file.name.removesuffix(".pub.pem")
+                public_keys[kid] = serialization.load_pem_public_key(data)
+            else:
+                kid = key_file.name.removesuffix(".pem")
+                private_keys[kid] = serialization.load_pem_private_key(data, password=None)
+                public_keys[kid] = private_keys[kid].public_key()
+
+        logger.info("Loaded %d JWT verification keys (%d can sign) from %s", len(public_keys), len(private_keys), path)
+        return cls(algorithm=algorithm, active_kid=active_kid, private_keys=private_keys, public_keys=public_keys)
+
+    def signing_key(self) -> tuple[str, Any]:
+        return self.active_kid, self._private_keys[self.active_kid]
+
+    def verification_key(self, kid: str | None) -> Any | None:
+        if kid is None:
+            return None
+        return self._public_keys.get(kid)
+
+
+def load_key_ring(algorithm: str, keys_dir: str | None, active_kid: str | None) -> KeyRing | None:
+    """ Returns None for the HMAC algorithms, those keep using SECRET_KEY """
+    if algorithm not in ASYMMETRIC_ALGORITHMS:
+        return None
+    if not keys_dir or not active_kid:
+        raise RuntimeError(f"ALGORITHM={algorithm} needs JWT_KEYS_DIR and JWT_ACTIVE_KID to be set")
+    return KeyRing.from_directory(keys_dir, algorithm=algorithm, active_kid=active_kid)
+
+
+def generate_private_key(algorithm: str):
+    if algorithm.startswith("RS"):
+        return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    if algorithm.startswith("ES"):
+        curve = {"ES256": ec.SECP256R1(), "ES384": ec.SECP384R1(), "ES512": ec.SECP521R1()}[algorithm]
+        return ec.generate_private_key(curve)
+    if algorithm == "EdDSA":
+        return ed25519.Ed25519PrivateKey.generate()
+    raise ValueError(f"Unsupported algorithm: {algorithm}")
+
+
+"""
+Generating a new key for rotation (from the backend directory):
+
+python -m src.auth.keys --kid 2026-10 --algorithm EdDSA --out keys/
+"""
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a JWT signing key")
+    parser.add_argument("--kid", required=True)
+    parser.add_argument("--algorithm", default="EdDSA", choices=sorted(ASYMMETRIC_ALGORITHMS))
+    parser.add_argument("--out", default=".")
+    args = parser.parse_args()
+
+    private_key = generate_private_key(args.algorithm)
+    out_file = Path(args.out) / f"{args.kid}.pem"
+    out_file.parent.mkdir(parents=True, exist_ok=True)
+    out_file.write_bytes(private_key.private_bytes(encoding=serialization.Encoding.PEM,
+                                                   format=serialization.PrivateFormat.PKCS8,
+                                                   encryption_algorithm=serialization.NoEncryption()))
+    out_file.chmod(0o600)
+    print(f"Wrote {out_file}")
@@ -0,0 +1,236 @@
+import abc
+import logging
+import time
+from typing import Tuple
+from src.core.cache import TTLCache
+from src.core.metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+"""
+Login throttling. Every login attempt costs a full bcrypt verify, so a credential stuffing run could otherwise keep every core busy. Attempts are
+checked here before the password is even looked at and anything over the limits gets a cheap 429:
+
+- per IP and per account token buckets: burst attempts back to back, after that the allowance refills at a steady rate per minute
+- per account exponential lockout: after lockout_threshold failures in a row the account is locked for lockout_seconds, doubling with every
+  further failure up to lockout_max_seconds. A successful login clears it. Failures are forgotten after lockout_max_seconds without a new one
+
+Accounts are keyed by the normalized (lowercased) username, registered or not, so the limits behave the same for unknown emails and don't reveal
+which ones exist. Note that anyone can get an account locked by failing on purpose, which is why the lockout is capped.
+
+The in-memory store is per process. With several workers/pods use the Redis store so every node counts against the same limits. Like the token store,
+Redis being down never fails a login, the limits are just skipped until it's back.
+"""
+
+auth_login_throttled = Counter("auth_login_throttled_total", "Login attempts rejected before checking the password, by limit hit",
+                               labelnames=("reason",))
+
+
+class LoginThrottled(Exception):
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class LoginThrottleStore(abc.ABC):
+    @abc.abstractmethod
+    async def take(self, key: str, capacity: int, refill_per_second: float) -> float:
+        """ Takes one token from the bucket. Returns 0 when there was one, otherwise how many seconds until there will be """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def locked_for(self, key: str) -> float:
+        """ Seconds left on the key's lockout, 0 when it isn't locked """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def record_failure(self, key: str, threshold: int, lockout_seconds: float, lockout_max_seconds: float) -> float:
+        """ Counts a failure and locks the key once there are threshold of them. Returns the lockout that was set (0 for none) """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def reset(self, key: str) -> None:
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        pass
+
+
+def _lockout(failures: int, threshold: int, lockout_seconds: float, lockout_max_seconds: float) -> float:
+    if failures < threshold:
+        return 0.0
+    return min(lockout_max_seconds, lockout_seconds * 2 ** (failures - threshold))
+
+
+class InMemoryLoginThrottleStore(LoginThrottleStore):
+    def __init__(self, maxsize: int = 100_000):
+        # Entries carry their own ttl (set to when they'd be back to their default) so the caches only ever hold keys that are being limited
+        self._buckets = TTLCache(maxsize=maxsize, ttl=3600)
+        self._failures = TTLCache(maxsize=maxsize, ttl=3600)
+        self._locks = TTLCache(maxsize=maxsize, ttl=3600)
+
+    async def take(self, key: str, capacity: int, refill_per_second: float) -> float:
+        now = time.monotonic()
+        tokens, updated_at = self._buckets.get(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated_at) * refill_per_second)
+        if tokens < 1:
+            return (1 - tokens) / refill_per_second
+
+        tokens -= 1
+        self._buckets.set(key, (tokens, now), ttl=(capacity - tokens) / refill_per_second)
+        return 0.0
+
+    async def locked_for(self, key: str) -> float:
+        locked_until = self._locks.get(key)
+        return max(0.0, locked_until - time.monotonic()) if locked_until is not None else 0.0
+
+    async def record_failure(self, key: str, threshold: int, lockout_seconds: float, lockout_max_seconds: float) -> float:
+        failures = self._failures.get(key, 0) + 1
+        self._failures.set(key, failures, ttl=lockout_max_seconds)
+
+        lockout = _lockout(failures, threshold, lockout_seconds, lockout_max_seconds)
+        if lockout:
+            self._locks.set(key, time.monotonic() + lockout, ttl=lockout)
+        return lockout
+
+    async def reset(self, key: str) -> None:
+        self._failures.pop(key)
+        self._locks.pop(key)
+
+
+# Both scripts run atomically inside Redis so concurrent attempts on different nodes can't both take the last token. Times come from the Redis
+# server clock so the nodes' clocks don't have to agree. Floats are returned as strings since Redis truncates Lua numbers to integers
+_TAKE_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+local tokens = tonumber(state[1]) or capacity
+local updated_at = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + (now - updated_at) * rate)
+if tokens < 1 then
+    return tostring((1 - tokens) / rate)
+end
+tokens = tokens - 1
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated_at', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil((capacity - tokens) / rate * 1000))
+return '0'
+"""
+
+_FAILURE_SCRIPT = """
+local failures = redis.call('INCR', KEYS[1])
+redis.call('PEXPIRE', KEYS[1], math.ceil(tonumber(ARGV[3]) * 1000))
+local threshold = tonumber(ARGV[1])
+if failures < threshold then
+    return '0'
+end
+local lockout = math.min(tonumber(ARGV[3]), tonumber(ARGV[2]) * 2 ^ (failures - threshold))
+redis.call('SET', KEYS[2], '1', 'PX', math.ceil(lockout * 1000))
+return tostring(lockout)
+"""
+
+
+class RedisLoginThrottleStore(LoginThrottleStore):
+    def __init__(self, url: str, prefix: str = "login_throttle:"):
+        try:
+            from redis import asyncio as redis
+        except ImportError as e:
+            raise RuntimeError("A Redis URL is set for login throttling but the redis package is not installed (pip install 'backend[redis]')") from e
+
+        self._redis = redis.from_url(url)
+        self._prefix = prefix
+        self._take = self._redis.register_script(_TAKE_SCRIPT)
+        self._record_failure = self._redis.register_script(_FAILURE_SCRIPT)
+
+    def _keys(self, key: str) -> Tuple[str, str]:
+        return f"{self._prefix}failures:{key}", f"{self._prefix}lock:{key}"
+
+    async def take(self, key: str, capacity: int, refill_per_second: float) -> float:
+        try:
+            return float(await self._take(keys=[f"{self._prefix}bucket:{key}"], args=[capacity, refill_per_second]))
+        except Exception as e:
+            logger.warning("Login throttle check failed, letting the attempt through: %s", e)
+            return 0.0
+
+    async def locked_for(self, key: str) -> float:
+        try:
+            remaining_ms = await self._redis.pttl(self._keys(key)[1])
+        except Exception as e:
+            logger.warning("Login lockout check failed, letting the attempt through: %s", e)
+            return 0.0
+        return remaining_ms / 1000 if remaining_ms > 0 else 0.0
+
+    async def record_failure(self, key: str, threshold: int, lockout_seconds: float, lockout_max_seconds: float) -> float:
+        try:
+            return float(await self._record_failure(keys=list(self._keys(key)), args=[threshold, lockout_seconds, lockout_max_seconds]))
+        except Exception as e:
+            logger.warning("Failed to record a failed login: %s", e)
+            return 0.0
+
+    async def reset(self, key: str) -> None:
+        try:
+            await self._redis.delete(*self._keys(key))
+        except Exception as e:
+            logger.warning("Failed to reset the login lockout: %s", e)
+
+    async def close(self) -> None:
+        await self._redis.aclose()
+
+
+def create_login_throttle_store(url: str | None) -> LoginThrottleStore:
+    if url:
+        return RedisLoginThrottleStore(url)
+    return InMemoryLoginThrottleStore()
+
+
+class LoginThrottle:
+    def __init__(self, store: LoginThrottleStore, enabled: bool = True,
+                 ip_burst: int = 20, ip_per_minute: float = 10.0,
+                 account_burst: int = 10, account_per_minute: float = 5.0,
+                 lockout_threshold: int = 5, lockout_seconds: float = 30.0, lockout_max_seconds: float = 900.0):
+        self.store = store
+        self.enabled = enabled
+        self.ip_burst = ip_burst
+        self.ip_refill = ip_per_minute / 60
+        self.account_burst = account_burst
+        self.account_refill = account_per_minute / 60
+        self.lockout_threshold = lockout_threshold
+        self.lockout_seconds = lockout_seconds
+        self.lockout_max_seconds = lockout_max_seconds
+
+    @staticmethod
+    def _account(username: str) -> str:
+        return f"account:{username.strip().lower()}"
+
+    async def check(self, ip: str, username: str) -> None:
+        """ Raises LoginThrottled when the attempt has to be turned away. Call it before doing anything expensive """
+        if not self.enabled:
+            return
+
+        account = self._account(username)
+        self._reject_if("lockout", await self.store.locked_for(account))
+        self._reject_if("ip", await self.store.take(f"ip:{ip}", self.ip_burst, self.ip_refill))
+        self._reject_if("account", await self.store.take(account, self.account_burst, self.account_refill))
+
+    @staticmethod
+    def _reject_if(reason: str, retry_after: float) -> None:
+        if retry_after > 0:
+            auth_login_throttled.inc((reason,))
+            raise LoginThrottled(reason, retry_after)
+
+    async def failed(self, username: str) -> None:
+        if not self.enabled:
+            return
+        lockout = await self.store.record_failure(self._account(username), self.lockout_threshold,
+                                                  self.lockout_seconds, self.lockout_max_seconds)
+        if lockout:
+            logger.warning("Locked logins for %s for %.0fs after repeated failures", username, lockout)
+
+    async def succeeded(self, username: str) -> None:
+        if self.enabled:
+            await self.store.reset(self._account(username))
+
+    async def close(self) -> None:
+        await self.store.close()
@@ -2,19 +2,27 @@ import logging
 from uuid import uuid4, UUID
 from datetime import timedelta
 from typing import Annotated
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Response
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy import select
 from starlette import status
-from src.auth.schemas import RegisterUserRequest, Token, RefreshTokenRequest
-from src.auth.service import get_password_hash, authenticate_user, create_token, verify_token
-from src.database.core import DB_Session
+from src.auth.dependencies import enforce_login_rate_limit, require_introspection_key
+from src.auth.schemas import RegisterUserRequest, Token, RefreshTokenRequest, IntrospectRequest, IntrospectResponse, normalize_email
+from src.auth.service import (get_password_hash, insert_new_users, authenticate_user, create_token, verify_token, token_store, get_key_ring,
+                              introspect_tokens, login_throttle, refresh_sessions, auth_logins, auth_revoked_tokens)
+from src.auth.sessions import RefreshTokenRecentlyRotated, RefreshTokenReused
+from src.database.core import DB_Session, DB_ReadSession, recent_writes
 from src.core.entities import User
 from src.core.config import settings
+from src.core.responses import model_response
+from src.logging import SAMPLED
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/auth", tags=['auth'])       # tags are just for documentation purposes for grouping together all auth edpts in docs together
+jwks_router = APIRouter(tags=['auth'])                  # Lives at the root since /.well-known is a fixed location
+
+_EMPTY_JWKS = b'{"keys":[]}'
 
 @router.post("/register", status_code=status.HTTP_201_CREATED)
 async def register(db: DB_Session, register_user_data: RegisterUserRequest) -> None:
@@ -30,40 +38,43 @@ async def register(db: DB_Session, register_user_data: RegisterUserRequest) -> N
     user has been registered, it does not issues tokens. This is done via explicit login.
     """
     try:
-        # Check if user already exists
-        result = await db.execute(select(User).filter(User.email == register_user_data.email))
-        existing_user = result.scalars().first()
-        if existing_user:
+        password_hash = await get_password_hash(register_user_data.password)
+
+        # One statement: the unique index on email decides whether the user is new, so concurrent signups with the same email can't race into a 500
+        result = await db.execute(
+            insert_new_users()
+            .values(id=uuid4(),
+                    email=register_user_data.email,
+                    first_name=register_user_data.first_name,
+                    last_name=register_user_data.last_name,
+                    password_hash=password_hash)
+            .returning(User.id))
+
+        if result.scalar_one_or_none() is None:
             logger.error("Failed to Register User. User already exists.")
             raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="User with this email already exists")     # 409 conflict indicates a valid request but it conflicts with the existing state of the application
 
-        # Create a new user entity
-        user = User(
-            id = uuid4(),
-            email=register_user_data.email,
-            first_name=register_user_data.first_name,
-            last_name=register_user_data.last_name,
-            password_hash=get_password_hash(register_user_data.password)
-        )
-
-        db.add(user)
         await db.commit()
-        logger.info(f"Successfully registered user: {register_user_data.email}")
+        recent_writes.remember(register_user_data.email)       # So logging in right after registering doesn't hit a replica that hasn't seen the row yet
+        logger.info("Successfully registered user: %s", register_user_data.email)
     except HTTPException:
         raise
     except Exception as e:
         await db.rollback()
-        logger.error(f"Failed to register user: {register_user_data.email}. Error: {str(e)}")
+        logger.error("Failed to register user: %s. Error: %s", register_user_data.email, e)
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to register user")
 
 
-@router.post("/token", response_model=Token)
-async def login(db: DB_Session, form_data: Annotated[OAuth2PasswordRequestForm, Depends()]) -> Token:
+@router.post("/token", response_model=Token, dependencies=[Depends(enforce_login_rate_limit)])
+async def login(db: DB_Session, read_db: DB_ReadSession,
+                form_data: Annotated[OAuth2PasswordRequestForm, Depends()]) -> Token | Response:
     """
     Docstring for login
 
-    :param db: used for retrieving the saved user for password validation
+    :param db: used for saving the new refresh token session
     :type db: DB_Session
+    :param read_db: used for retrieving the saved user for password validation, may be a read replica
+    :type read_db: DB_ReadSession
     :param form_data: used to securely recieve username and password via OAuth standard format
     :type form_data: Annotated[OAuth2PasswordRequestForm, Depends()]
     :return: returns a Token model which contains the access token, the refresh token, and the type (bearer)
@@ -71,54 +82,69 @@ async def login(db: DB_Session, form_data: Annotated[OAuth2PasswordRequestForm,
 
     Now, when calling requests from the frontend, there needs to be authorization in the request headers of all requests made to the backend.
     """
+    email = normalize_email(form_data.username)        # Same key as the stored email and the throttle, whatever case it was typed in
     try:
-        user = await authenticate_user(form_data.username, form_data.password, db)
+        recent_writes.route(read_db, email)
+        user = await authenticate_user(email, form_data.password, read_db)
 
         # If no user is returned, there was either a wrong password or user wasn't found
         if not user:
-            logger.warning(f"Failed authentication attempt for email: {form_data.username}")
+            auth_logins.inc(("failure",))
+            await login_throttle.failed(email)
+            logger.warning("Failed authentication attempt for email: %s", email)
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                                 detail="Incorrect username or password",
                                 headers={"WWW-Authenticate": "Bearer"})     # Headers are required for 401 Unauthorized
 
         access_token = create_token(
-            user_id=user.id,   # type: ignore
-            token_version=user.token_version, # type: ignore
+            user_id=user.id,
+            token_version=user.token_version,
             expiry=timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES), # type: ignore
             SECRET_KEY=settings.SECRET_KEY,
             ALGORITHM=settings.ALGORITHM,
             refresh=False)
 
+        session = await refresh_sessions.start(db, user.id)        # Every login starts a new token family
         refresh_token = create_token(
-            user_id=user.id,   # type: ignore
-            token_version=user.token_version, #type: ignore
+            user_id=user.id,
+            token_version=user.token_version,
             expiry=timedelta(minutes=settings.REFRESH_TOKEN_EXPIRE_MINUTES),
             SECRET_KEY=settings.SECRET_KEY,
             ALGORITHM=settings.ALGORITHM,
-            refresh=True)
+            refresh=True,
+            session=session)
 
-        logger.info(f"Successful login for user: {form_data.username}")
-        return Token(access_token=access_token, refresh_token=refresh_token, token_type="bearer")
+        await token_store.add(user.id, user.token_version)     # Warms the store so the first requests with these tokens need no query
+        await login_throttle.succeeded(email)
+        auth_logins.inc(("success",))
+        logger.info("Successful login for user: %s", email, extra=SAMPLED)
+        return model_response(Token, Token(access_token=access_token, refresh_token=refresh_token, token_type="bearer"))
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Unexpected error during login for {form_data.username}: {str(e)}")
+        logger.error("Unexpected error during login for %s: %s", email, e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="An error occurred during login")
 
 
 @router.post("/refresh", response_model=Token)
-async def refresh(payload: RefreshTokenRequest, db: DB_Session) -> Token:
+async def refresh(payload: RefreshTokenRequest, db: DB_Session, read_db: DB_ReadSession) -> Token | Response:
     """
     Docstring for refresh
 
     :param payload: for recieving the data needed to refresh the access token
     :type payload: RefreshTokenRequest
-    :return: a Token object containing the refresh token the user already has along with a new refresh_token
+    :param db: used for rotating the refresh token session
+    :type db: DB_Session
+    :param read_db: used for reading the user's token_version when the token store doesn't have it, may be a read replica
+    :type read_db: DB_ReadSession
+    :return: a Token object containing a new access token and a new refresh token. The refresh token that was sent can't be used again
     :rtype: Token
 
     Note: here, the payload which is of type RefreshTokenRequest only contains the refresh_token but it must be in the body of the request because it is a
     long-lived secret meaning it should not be given out in the headers. It is merely used for refreshing access tokens.
+    Sending a refresh token that was already exchanged revokes every refresh token from the same login (see src/auth/sessions.py), unless it was
+    exchanged less than REFRESH_REUSE_GRACE_SECONDS ago: then it only gets a 409.
     """
 
     token_data = verify_token(token=payload.refresh_token,
@@ -126,7 +152,8 @@ async def refresh(payload: RefreshTokenRequest, db: DB_Session) -> Token:
                               ALGORITHM=settings.ALGORITHM,
                               refresh=True)
 
-    if not token_data:
+    # Refresh tokens issued before rotation existed have no session, their owners have to log in again
+    if not token_data or "jti" not in token_data:
         logger.warning("Failed to refresh access token. Invalid refresh token.")
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -135,32 +162,101 @@ async def refresh(payload: RefreshTokenRequest, db: DB_Session) -> Token:
 
     user_id = UUID(token_data['sub'])
 
-    # Fetch the user to verify token_version and sub
-    result = await db.execute(select(User).filter(User.id == user_id))
-    user = result.scalars().first()
+    # Check token_version against the token store first and only read it from the database when the store doesn't know this user
+    token_version = await token_store.get(user_id)
+    if token_version is None:
+        recent_writes.route(read_db, user_id)
+        result = await read_db.execute(select(User.token_version).filter(User.id == user_id))
+        token_version = result.scalars().first()
+
+        if token_version is None:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Invalid token",
+                headers={"WWW-Authenticate": "Bearer"})
+
+        await token_store.add(user_id, token_version)
 
-    if not user:
+    if token_version != token_data['token_version']:
+        auth_revoked_tokens.inc(("refresh",))
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED, detail="Token revoked"
+        )
+
+    try:
+        session = await refresh_sessions.rotate(db, user_id, UUID(token_data['jti']), UUID(token_data['fam']))
+    except RefreshTokenRecentlyRotated:
+        # 409 rather than 401: the session is fine, the client should use the tokens the first request got
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Refresh token was just exchanged by another request. Use the tokens that request returned")
+    except RefreshTokenReused:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid token",
+            detail="Refresh token already used. Please log in again",
             headers={"WWW-Authenticate": "Bearer"})
+    except Exception as e:
+        logger.error("Failed to rotate refresh token for user %s. Error: %s", user_id, e)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="An error occurred while refreshing the token")
 
-    if user.token_version != token_data['token_version']:
+    if session is None:
         raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED, detail="Token revoked"
-        )
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid or expired refresh token",
+            headers={"WWW-Authenticate": "Bearer"})
 
-    # If we have a valid refresh_token, then using the token_data, create a new access token
-    new_access_token = create_token(user_id=UUID(token_data['sub']),
+    # If we have a valid refresh_token, then using the token_data, create a new access token and the refresh token that replaces the one sent
+    new_access_token = create_token(user_id=user_id,
                                     token_version=token_data['token_version'],
                                     expiry=timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES),
                                     SECRET_KEY=settings.SECRET_KEY,
                                     ALGORITHM=settings.ALGORITHM,
                                     refresh=False)
 
-    logger.info(f"Successfully refreshed access token for user: {token_data['sub']}")
+    new_refresh_token = create_token(user_id=user_id,
+                                     token_version=token_data['token_version'],
+                                     expiry=timedelta(minutes=settings.REFRESH_TOKEN_EXPIRE_MINUTES),
+                                     SECRET_KEY=settings.SECRET_KEY,
+                                     ALGORITHM=settings.ALGORITHM,
+                                     refresh=True,
+                                     session=session)
+
+    logger.info("Successfully refreshed access token for user: %s", token_data['sub'], extra=SAMPLED)
+
+    return model_response(Token, Token(access_token=new_access_token, refresh_token=new_refresh_token, token_type="bearer"))
+
 
-    return Token(access_token=new_access_token, refresh_token=payload.refresh_token, token_type="bearer")
+@router.post("/introspect", response_model=IntrospectResponse, dependencies=[Depends(require_introspection_key)])
+async def introspect(payload: IntrospectRequest, db: DB_ReadSession) -> IntrospectResponse | Response:
+    """
+    Docstring for introspect
+
+    :param payload: up to INTROSPECT_MAX_TOKENS access tokens
+    :type payload: IntrospectRequest
+    :param db: used for the token versions the token store doesn't have, may be a read replica
+    :type db: DB_ReadSession
+    :return: one result per token, in the same order, saying whether it's active and if not why
+    :rtype: IntrospectResponse
+
+    For other services (e.g. a gateway) that need to validate many user tokens: one call here replaces a GET /users/me per token.
+    Signatures are checked in process and all the users are looked up at once, so a batch costs at most one query.
+    """
+    try:
+        results = await introspect_tokens(payload.tokens, db)
+    except Exception as e:
+        logger.error("Failed to introspect %d tokens. Error: %s", len(payload.tokens), e)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Unable to introspect tokens at this time")
 
+    return model_response(IntrospectResponse, IntrospectResponse(results=results))
 
 
+@jwks_router.get("/.well-known/jwks.json")
+async def jwks() -> Response:
+    """
+    Publishes the public keys (by kid) that our tokens can be verified with so other services can validate them locally.
+    The document is serialized once when the key ring loads and clients may cache it for a few minutes. With HS256 there is nothing to publish.
+    """
+    key_ring = get_key_ring()
+    content = key_ring.jwks_json if key_ring is not None else _EMPTY_JWKS
+    return Response(content=content, media_type="application/json", headers={"Cache-Control": "public, max-age=300"})
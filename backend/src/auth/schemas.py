@@ -1,10 +1,18 @@
-from pydantic import BaseModel, EmailStr
+from pydantic import AfterValidator, BaseModel, EmailStr, Field, field_validator
 from datetime import datetime
 from uuid import UUID
-from typing import Optional
+from typing import Annotated, Any, List, Literal, Optional
+from src.core.config import settings
+
+def normalize_email(email: str) -> str:
+    """ Emails are stored lowercased and every lookup lowercases its input the same way, so the plain unique index on email serves them all """
+    return email.strip().lower()
+
+# Foo@x.edu and foo@x.edu are the same account. Any request field holding an email we store or look up should use this
+NormalizedEmail = Annotated[EmailStr, AfterValidator(normalize_email)]
 
 class RegisterUserRequest(BaseModel):
-    email: EmailStr
+    email: NormalizedEmail
     first_name: str
     last_name: str
     password: str
@@ -17,3 +25,25 @@ class Token(BaseModel):
 class RefreshTokenRequest(BaseModel):
     refresh_token: str
 
+
+class IntrospectRequest(BaseModel):
+    tokens: List[str] = Field(min_length=1)      # Access tokens, at most INTROSPECT_MAX_TOKENS
+
+    # Checked before the items so an oversized batch is turned away without validating any of it. Not max_length=, the settings can't be read on
+    # import
+    @field_validator("tokens", mode="before")
+    @classmethod
+    def _at_most_max_tokens(cls, tokens: Any) -> Any:
+        if isinstance(tokens, list) and len(tokens) > settings.INTROSPECT_MAX_TOKENS:
+            raise ValueError(f"At most {settings.INTROSPECT_MAX_TOKENS} tokens per request")
+        return tokens
+
+class TokenIntrospection(BaseModel):
+    active: bool
+    status: Literal["active", "invalid", "revoked", "unknown_user"]     # invalid = bad signature, expired or not an access token
+    sub: Optional[UUID] = None
+    token_version: Optional[int] = None
+    exp: Optional[int] = None
+
+class IntrospectResponse(BaseModel):
+    results: List[TokenIntrospection]      # Same order as the tokens in the request
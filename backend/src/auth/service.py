@@ -1,30 +1,245 @@
+import asyncio
+import hashlib
+import logging
+import secrets
+import time
+from dataclasses import dataclass
+from functools import lru_cache
 import jwt
 from jwt import PyJWTError
-from typing import Dict, Any
+from typing import Dict, Any, List, Sequence, Set
 from datetime import timedelta, datetime, timezone
 from uuid import UUID
-from sqlalchemy import select
-from passlib.context import CryptContext
+from fastapi import HTTPException
+from starlette import status
+from sqlalchemy import select, inspect, update, any_, bindparam
+from sqlalchemy.dialects.postgresql import ARRAY, UUID as PG_UUID, insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import make_transient_to_detached
+from src.auth.hashing import PasswordHasher, PasswordHasherBusy
+from src.auth.keys import KeyRing, load_key_ring
+from src.auth.schemas import TokenIntrospection, normalize_email
+from src.auth.rate_limit import LoginThrottle, create_login_throttle_store
+from src.auth.sessions import IssuedSession, RefreshSessions, create_session_index
+from src.auth.token_store import create_token_version_store
+from src.core.cache import TTLCache
+from src.core.config import settings
+from src.core.lazy import lazy
 from src.core.entities import User
+from src.core.metrics import Counter
+from src.core.singleflight import SingleFlight
+from src.database.core import engine, AsyncSessionLocal, ReadSessionLocal, recent_writes
+from src.database.replicas import use_primary
 
-bcrypt_context = CryptContext(schemes=['bcrypt'], deprecated='auto')
+logger = logging.getLogger(__name__)
 
-def get_password_hash(password: str) -> str:
-    return bcrypt_context.hash(password)
+# Auth outcomes for alerting on the login path (exported on /metrics)
+auth_token_verify_failures = Counter("auth_token_verify_failures_total", "Tokens rejected for a bad signature, expiry or wrong type",
+                                     labelnames=("type",))
+auth_revoked_tokens = Counter("auth_revoked_tokens_total", "Valid tokens rejected because their token_version was revoked", labelnames=("type",))
+auth_logins = Counter("auth_logins_total", "Login attempts by outcome", labelnames=("outcome",))
+password_rehashes = Counter("password_rehashes_total", "Stored hashes upgraded to BCRYPT_ROUNDS after a login, by outcome", labelnames=("outcome",))
 
-async def authenticate_user(username: str, password: str, db) -> User | None:
-    result = await db.execute(select(User).filter(User.email == username))
-    user = result.scalars().first()
-    
-    # If the user does not exist or the password is incorrect, return None
-    if not user or not verify_password(password, user.password_hash): 
+# All bcrypt work goes through this pool so it never runs on the event loop thread
+# The singletons in this module are built on first use (see src/core/lazy.py) so importing it doesn't read the settings
+password_hasher = lazy(lambda: PasswordHasher(executor=settings.PASSWORD_HASH_EXECUTOR,
+                                              max_workers=settings.PASSWORD_HASH_WORKERS,
+                                              max_pending=settings.PASSWORD_HASH_MAX_PENDING,
+                                              rounds=settings.BCRYPT_ROUNDS))
+
+def _hasher_busy() -> HTTPException:
+    # 503 + Retry-After tells clients (and load balancers) to back off instead of retrying straight into the same queue
+    return HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                         detail="Server is busy. Please try again shortly",
+                         headers={"Retry-After": "1"})
+
+async def get_password_hash(password: str) -> str:
+    try:
+        return await password_hasher.hash(password)
+    except PasswordHasherBusy:
+        raise _hasher_busy()
+
+# Column values of recently authenticated users keyed by id. We cache plain values rather than ORM objects since an ORM object belongs to the session
+# that loaded it and every request gets its own session
+user_cache = lazy(lambda: TTLCache(maxsize=settings.USER_CACHE_MAX_SIZE, ttl=settings.USER_CACHE_TTL_SECONDS))
+_USER_COLUMN_ATTRS = [getattr(User, attr.key) for attr in inspect(User).column_attrs]
+# Cache misses for the same user that happen at the same time share one select, see load_user_snapshot
+user_loads = SingleFlight()
+
+
+@dataclass(frozen=True, slots=True)
+class Principal:
+    """
+    Who is making the request, which is all most auth checks need. Building one costs no query when the token store knows the user; routes that
+    modify the user ask for the full ORM object (CurrentUser) instead.
+    """
+    id: UUID
+    token_version: int
+
+# Parsed signing/verification keys when ALGORITHM is asymmetric, None when tokens are signed with SECRET_KEY
+@lru_cache(maxsize=None)
+def get_key_ring() -> KeyRing | None:
+    return load_key_ring(settings.ALGORITHM, keys_dir=settings.JWT_KEYS_DIR, active_kid=settings.JWT_ACTIVE_KID)
+
+# Payloads of tokens that already passed verify_token, keyed by (sha256 of the token, expected type). Entries expire together with the token itself
+# so a cached payload is never returned past its exp. Only successful decodes are cached and the key is a fixed size digest, so memory is capped at
+# TOKEN_CACHE_MAX_SIZE small dicts however many (or however large) tokens clients send
+token_cache = lazy(lambda: TTLCache(maxsize=settings.TOKEN_CACHE_MAX_SIZE, ttl=settings.ACCESS_TOKEN_EXPIRE_MINUTES * 60))
+
+# user_id -> token_version, shared across workers when TOKEN_STORE_URL is set
+token_store = lazy(lambda: create_token_version_store(settings.TOKEN_STORE_URL, ttl=settings.TOKEN_STORE_TTL_SECONDS,
+                                                      local_ttl=settings.TOKEN_STORE_LOCAL_TTL_SECONDS))
+
+# Turns away login attempts over the per IP / per account limits before any bcrypt work
+login_throttle = lazy(lambda: LoginThrottle(create_login_throttle_store(settings.LOGIN_THROTTLE_URL or settings.TOKEN_STORE_URL),
+                                            enabled=settings.LOGIN_THROTTLE_ENABLED,
+                                            ip_burst=settings.LOGIN_IP_BURST,
+                                            ip_per_minute=settings.LOGIN_IP_PER_MINUTE,
+                                            account_burst=settings.LOGIN_ACCOUNT_BURST,
+                                            account_per_minute=settings.LOGIN_ACCOUNT_PER_MINUTE,
+                                            lockout_threshold=settings.LOGIN_LOCKOUT_THRESHOLD,
+                                            lockout_seconds=settings.LOGIN_LOCKOUT_SECONDS,
+                                            lockout_max_seconds=settings.LOGIN_LOCKOUT_MAX_SECONDS))
+
+# Server side refresh token sessions, rotated on every refresh
+refresh_sessions = lazy(lambda: RefreshSessions(create_session_index(settings.TOKEN_STORE_URL),
+                                                lifetime=timedelta(minutes=settings.REFRESH_TOKEN_EXPIRE_MINUTES),
+                                                reuse_grace=timedelta(seconds=settings.REFRESH_REUSE_GRACE_SECONDS)))
+
+async def load_user_snapshot(user_id: UUID, db, token_version: int | None = None) -> Dict[str, Any] | None:
+    """
+    The user's column values as a plain dict, served from user_cache when possible. A miss is a column-only select (plain rows, no ORM entity
+    or identity map involved) and db can be a read replica session.
+
+    token_version is what the token store currently holds for this user. The local cache is only trusted when it agrees with it, that way a
+    change made on another node (which always updates or clears the store) is never hidden by this node's cache.
+    Note: the returned dict is shared with the cache, treat it as read-only
+    """
+    snapshot = user_cache.get(user_id) if token_version is not None else None
+    if snapshot is None or snapshot['token_version'] != token_version:
+        # Plain sessions and read sessions pinned by read-your-writes read from the primary, the shared load has to do the same
+        primary = "replicas" not in db.info or bool(db.info.get("use_primary"))
+        snapshot = await user_loads.do((user_id, primary), lambda: _select_user_snapshot(user_id, primary))
+    return snapshot
+
+async def _select_user_snapshot(user_id: UUID, primary: bool) -> Dict[str, Any] | None:
+    """
+    The select behind load_user_snapshot. It gets a session of its own since the callers sharing it each have theirs, and whichever caller started
+    it may be cancelled (or finish) before the others are done with the result
+    """
+    async with ReadSessionLocal() as db:
+        if primary:
+            use_primary(db)
+        result = await db.execute(select(*_USER_COLUMN_ATTRS).filter(User.id == user_id))
+        row = result.mappings().first()
+    if row is None:
+        return None
+    snapshot = dict(row)
+    # When the user was invalidated while this ran, the row may be from before the change. The callers that were already waiting still get it,
+    # but it must not go in the cache where requests arriving after the change would find it
+    if user_loads.is_current((user_id, primary)):
+        user_cache.set(user_id, snapshot)
+    return snapshot
+
+async def load_user(user_id: UUID, db, token_version: int | None = None, read_db=None) -> User | None:
+    """
+    Returns the full ORM user attached to db, for routes that modify it. The values come from load_user_snapshot (read through read_db when
+    given) and are turned back into a persistent (clean) User, so db itself never queries and routes can still modify it and commit as usual.
+    """
+    snapshot = await load_user_snapshot(user_id, read_db or db, token_version=token_version)
+    if snapshot is None:
         return None
-    return user
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return bcrypt_context.verify(plain_password, hashed_password)
+    user = User(**snapshot)
+    make_transient_to_detached(user)                # Treat it as if it was just loaded from the database
+    return await db.merge(user, load=False)         # load=False attaches it to the session without a SELECT
+
+def insert_new_users():
+    """ INSERT INTO user ... ON CONFLICT (email) DO NOTHING for the dialect we run on. Add .values() and .returning() to find out which rows went in """
+    dialect_insert = sqlite_insert if engine.dialect.name == "sqlite" else postgresql_insert
+    return dialect_insert(User).on_conflict_do_nothing(index_elements=[User.email])
+
+def invalidate_cached_user(user_id: UUID) -> None:
+    """ Must be called whenever a user row is changed or deleted so the next request reloads it """
+    user_cache.pop(user_id)
+    user_loads.forget((user_id, True))      # A load that started before the change could still hand out the old row
+    user_loads.forget((user_id, False))
+
+async def authenticate_user(username: str, password: str, db) -> Principal | None:
+    # Only the columns login needs, no ORM entity. Emails are stored normalized, so comparing the normalized input keeps this on the email index
+    # (lower(email) = ... would not be)
+    result = await db.execute(select(User.id, User.token_version, User.password_hash).filter(User.email == normalize_email(username)))
+    row = result.first()
+    await db.commit()       # Ends the read so the connection goes back to the pool during bcrypt instead of being held for the whole hash
+
+    # An unknown email still pays for a full verify so the response time doesn't tell whether the email is registered
+    if not row:
+        await verify_password(password, await _dummy_password_hash())
+        return None
+
+    # If the password is incorrect, return None
+    if not await verify_password(password, row.password_hash):
+        return None
 
-def create_token(user_id: UUID, token_version: int, expiry: timedelta, SECRET_KEY: str, ALGORITHM: str, refresh: bool):
+    # This is the only moment we have the plain password, so it's when a hash made with a lower cost can be upgraded. It runs in the background
+    # so the login response never waits for a second bcrypt run
+    if password_hasher.needs_update(row.password_hash):
+        _schedule_rehash(row.id, password, row.password_hash)
+    return Principal(id=row.id, token_version=row.token_version)
+
+_dummy_hash: str | None = None
+
+async def _dummy_password_hash() -> str:
+    """ A hash of a random password at the configured cost, made on first use, for verifying against when there is no user """
+    global _dummy_hash
+    if _dummy_hash is None:
+        _dummy_hash = await get_password_hash(secrets.token_urlsafe(32))
+    return _dummy_hash
+
+# Background rehashes that are still running. Holding a reference keeps them from being garbage collected mid-way and lets shutdown wait for them
+_rehash_tasks: Set[asyncio.Task] = set()
+_rehashing: Set[UUID] = set()       # Users with a rehash in flight, so a burst of logins only upgrades once
+
+def _schedule_rehash(user_id: UUID, password: str, old_hash: str) -> None:
+    if user_id in _rehashing:
+        return
+    _rehashing.add(user_id)
+    task = asyncio.create_task(_rehash_password(user_id, password, old_hash))
+    _rehash_tasks.add(task)
+    task.add_done_callback(_rehash_tasks.discard)
+
+async def _rehash_password(user_id: UUID, password: str, old_hash: str) -> None:
+    try:
+        new_hash = await password_hasher.hash(password)
+        async with AsyncSessionLocal() as db:
+            # Only replaces the hash we verified against, if the password was changed in the meantime the new one is left alone
+            result = await db.execute(update(User)
+                                      .where(User.id == user_id, User.password_hash == old_hash)
+                                      .values(password_hash=new_hash))
+            await db.commit()
+        invalidate_cached_user(user_id)
+        password_rehashes.inc(("upgraded" if result.rowcount else "skipped",))
+    except PasswordHasherBusy:
+        password_rehashes.inc(("skipped",))     # The hasher is needed for logins right now, we'll upgrade on a later login
+    except Exception as e:
+        password_rehashes.inc(("failed",))
+        logger.error("Failed to upgrade the password hash for user %s. Error: %s", user_id, e)
+    finally:
+        _rehashing.discard(user_id)
+
+async def wait_for_rehashes() -> None:
+    """ Called on shutdown so upgrades that already started get written """
+    if _rehash_tasks:
+        await asyncio.gather(*_rehash_tasks, return_exceptions=True)
+
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    try:
+        return await password_hasher.verify(plain_password, hashed_password)
+    except PasswordHasherBusy:
+        raise _hasher_busy()
+
+def create_token(user_id: UUID, token_version: int, expiry: timedelta, SECRET_KEY: str, ALGORITHM: str, refresh: bool,
+                 session: IssuedSession | None = None):
     if refresh:
         token_type = "refresh"
     else:
@@ -37,6 +252,17 @@ def create_token(user_id: UUID, token_version: int, expiry: timedelta, SECRET_KE
         "iat": datetime.now(timezone.utc),
         "exp": datetime.now(timezone.utc) + expiry,
     }
+    # Refresh tokens point at their row in refresh_session and the token family it belongs to
+    if session is not None:
+        encode["jti"] = str(session.jti)
+        encode["fam"] = str(session.family_id)
+        encode["exp"] = session.expires_at
+
+    # With a key ring, sign with the active private key and put its kid in the header so verifiers know which public key to use
+    key_ring = get_key_ring()
+    if key_ring is not None and ALGORITHM == key_ring.algorithm:
+        kid, private_key = key_ring.signing_key()
+        return jwt.encode(payload=encode, key=private_key, algorithm=ALGORITHM, headers={"kid": kid})
 
     return jwt.encode(payload=encode, key=SECRET_KEY, algorithm=ALGORITHM)
 
@@ -44,11 +270,76 @@ def verify_token(token: str, SECRET_KEY: str, ALGORITHM: str, refresh: bool) ->
     if refresh:
         token_type = "refresh"
     else:
-        token_type = "access"  
+        token_type = "access"
+
+    # Clients send the same token over and over until it expires so skip the decode if we have already verified this exact token.
+    # Note: the returned payload is shared with the cache, callers must treat it as read-only
+    cache_key = (hashlib.sha256(token.encode()).digest(), token_type)
+    payload = token_cache.get(cache_key)
+    if payload is not None:
+        return payload
+
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        key: Any = SECRET_KEY
+        key_ring = get_key_ring()
+        if key_ring is not None and ALGORITHM == key_ring.algorithm:
+            key = key_ring.verification_key(jwt.get_unverified_header(token).get("kid"))
+            if key is None:
+                auth_token_verify_failures.inc((token_type,))
+                return None
+
+        payload = jwt.decode(token, key, algorithms=[ALGORITHM])
         if payload.get("type") != token_type:
+            auth_token_verify_failures.inc((token_type,))
             return None
+        if "exp" in payload:
+            token_cache.set(cache_key, payload, ttl=payload["exp"] - time.time())
         return payload
     except PyJWTError as e:
-        return None
\ No newline at end of file
+        auth_token_verify_failures.inc((token_type,))
+        return None
+
+def _user_id_in(user_ids: Sequence[UUID]):
+    """
+    On postgres this is id = ANY(:user_ids) with the whole list bound as one array parameter, so the SQL is the same for any batch size and
+    asyncpg reuses one prepared statement (an IN list renders a different statement for every length). Other dialects get a plain IN.
+    """
+    if engine.dialect.name == "postgresql":
+        return User.id == any_(bindparam("user_ids", list(user_ids), type_=ARRAY(PG_UUID(as_uuid=True))))
+    return User.id.in_(user_ids)
+
+async def load_token_versions(user_ids: Sequence[UUID], db) -> Dict[UUID, int]:
+    """ Current token_version of every user in user_ids that exists. The token store answers first and one query covers everything it didn't know """
+    versions = await token_store.get_many(user_ids)
+    missing = [user_id for user_id in user_ids if user_id not in versions]
+    if missing:
+        recent_writes.route(db, *missing)
+        result = await db.execute(select(User.id, User.token_version).where(_user_id_in(missing)))
+        loaded = {row.id: row.token_version for row in result}
+        versions.update(loaded)
+        await token_store.add_many(loaded)      # One round-trip however many the store was missing
+    return versions
+
+async def introspect_tokens(tokens: List[str], db) -> List[TokenIntrospection]:
+    """ Checks a batch of access tokens the same way get_current_principal checks one, with a single lookup for all of their users """
+    payloads = [verify_token(token=token, SECRET_KEY=settings.SECRET_KEY, ALGORITHM=settings.ALGORITHM, refresh=False) for token in tokens]
+    user_ids = list({UUID(payload['sub']) for payload in payloads if payload})
+    versions = await load_token_versions(user_ids, db) if user_ids else {}
+
+    results = []
+    for payload in payloads:
+        if not payload:
+            results.append(TokenIntrospection(active=False, status="invalid"))
+            continue
+
+        user_id = UUID(payload['sub'])
+        current_version = versions.get(user_id)
+        if current_version is None:
+            token_status = "unknown_user"
+        elif current_version != payload['token_version']:
+            token_status = "revoked"
+        else:
+            token_status = "active"
+        results.append(TokenIntrospection(active=token_status == "active", status=token_status, sub=user_id,
+                                          token_version=payload['token_version'], exp=payload.get('exp')))
+    return results
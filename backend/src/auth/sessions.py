@@ -0,0 +1,270 @@
+import abc
+import asyncio
+import logging
+import math
+import random
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from uuid import UUID, uuid4
+from sqlalchemy import delete, select, update
+from src.core.cache import TTLCache
+from src.core.entities import RefreshSession
+from src.core.metrics import Counter
+from src.database.core import AsyncSessionLocal
+
+logger = logging.getLogger(__name__)
+
+"""
+Refresh token rotation. Every refresh token carries a jti (its row in refresh_session) and a family id (the login it descends from):
+
+- login starts a new family with one active session
+- /auth/refresh exchanges the presented token for a new one in the same family and marks the old one rotated. The swap is a single conditional
+  UPDATE ... WHERE rotated_at IS NULL, so of two concurrent refreshes with the same token only one can win
+- presenting a rotated token again means it was copied (or the client replayed an old one), and as we can't tell the thief from the owner the
+  whole family is revoked and both have to log in again. Except within reuse_grace of the rotation: a client that double-submitted, or retried
+  a refresh whose response it lost, would otherwise log itself out. That request is turned away (RefreshTokenRecentlyRotated) and the family
+  is left alone. Its successor isn't handed out again, whoever presents the old token (the owner or a thief) doesn't get a live one from it
+
+The session index (jti -> state, plus the revoked families) sits in front of the table. It answers "is this token still good?" with one key lookup
+and turns replays and revoked families away without touching the database or loading the user. The table stays the source of truth: a miss,
+or "active", still goes through the conditional UPDATE, which is what catches a rotation done by another node with its own in-memory index.
+Use the Redis index (TOKEN_STORE_URL) with several workers so reuse is caught up front on every node.
+
+Expired rows are batch-deleted by run_sweeper (started in the app lifespan). Password changes don't need to touch the index, the token_version
+check in front of the rotation already rejects every older refresh token.
+"""
+
+ACTIVE = "active"
+ROTATED = "rotated"
+REVOKED = "revoked"     # The token's family was revoked after a reuse
+
+auth_refresh_rotations = Counter("auth_refresh_rotations_total", "Refresh token exchanges by outcome (rotated, reused, grace, invalid)",
+                                 labelnames=("outcome",))
+auth_sessions_swept = Counter("auth_sessions_swept_total", "Expired refresh sessions deleted by the sweeper")
+
+
+class RefreshTokenReused(Exception):
+    def __init__(self, family_id: UUID):
+        super().__init__(f"Refresh token reused in family {family_id}")
+        self.family_id = family_id
+
+
+class RefreshTokenRecentlyRotated(Exception):
+    """ The token was exchanged moments ago (within the reuse grace), most likely by the same client """
+
+
+@dataclass(frozen=True, slots=True)
+class IssuedSession:
+    jti: UUID
+    family_id: UUID
+    expires_at: datetime
+
+
+def _seconds_until(expires_at: datetime) -> float:
+    return (expires_at - datetime.now(timezone.utc)).total_seconds()
+
+
+class SessionIndex(abc.ABC):
+    @abc.abstractmethod
+    async def state(self, jti: UUID, family_id: UUID) -> str | None:
+        """ ACTIVE, ROTATED or REVOKED, None when the index doesn't know the token (ask the database) """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def set(self, jti: UUID, state: str, expires_at: datetime) -> None:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def revoke_family(self, family_id: UUID, expires_at: datetime) -> None:
+        """ expires_at is the latest any token of the family can expire, the marker is useless after that """
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        pass
+
+
+class InMemorySessionIndex(SessionIndex):
+    def __init__(self, maxsize: int = 100_000):
+        # Entries carry their own ttl (until the token expires), the cache wide one is never used
+        self._sessions = TTLCache(maxsize=maxsize, ttl=3600)
+        self._revoked_families = TTLCache(maxsize=maxsize, ttl=3600)
+
+    async def state(self, jti: UUID, family_id: UUID) -> str | None:
+        if self._revoked_families.get(family_id) is not None:
+            return REVOKED
+        return self._sessions.get(jti)
+
+    async def set(self, jti: UUID, state: str, expires_at: datetime) -> None:
+        self._sessions.set(jti, state, ttl=_seconds_until(expires_at))
+
+    async def revoke_family(self, family_id: UUID, expires_at: datetime) -> None:
+        self._revoked_families.set(family_id, True, ttl=_seconds_until(expires_at))
+
+
+class RedisSessionIndex(SessionIndex):
+    def __init__(self, url: str, prefix: str = "refresh_session:"):
+        try:
+            from redis import asyncio as redis
+        except ImportError as e:
+            raise RuntimeError("TOKEN_STORE_URL is set but the redis package is not installed (pip install 'backend[redis]')") from e
+
+        self._redis = redis.from_url(url)
+        self._prefix = prefix
+
+    def _session_key(self, jti: UUID) -> str:
+        return f"{self._prefix}{jti}"
+
+    def _family_key(self, family_id: UUID) -> str:
+        return f"{self._prefix}revoked_family:{family_id}"
+
+    async def state(self, jti: UUID, family_id: UUID) -> str | None:
+        try:
+            # Both keys in one round-trip
+            session_state, family_revoked = await self._redis.mget(self._session_key(jti), self._family_key(family_id))
+        except Exception as e:
+            # Never fail a refresh because redis is down, the database check still catches reuse
+            logger.warning("Session index read failed, falling back to the database: %s", e)
+            return None
+        if family_revoked is not None:
+            return REVOKED
+        return session_state.decode() if session_state is not None else None
+
+    async def set(self, jti: UUID, state: str, expires_at: datetime) -> None:
+        ttl = math.ceil(_seconds_until(expires_at))
+        if ttl <= 0:
+            return
+        try:
+            await self._redis.set(self._session_key(jti), state, ex=ttl)
+        except Exception as e:
+            logger.warning("Session index write failed: %s", e)
+
+    async def revoke_family(self, family_id: UUID, expires_at: datetime) -> None:
+        ttl = math.ceil(_seconds_until(expires_at))
+        if ttl <= 0:
+            return
+        try:
+            await self._redis.set(self._family_key(family_id), 1, ex=ttl)
+        except Exception as e:
+            # The rows are already gone so the family is revoked anyway, other nodes just find out from the database
+            logger.error("Failed to publish the revocation of token family %s: %s", family_id, e)
+
+    async def close(self) -> None:
+        await self._redis.aclose()
+
+
+def create_session_index(url: str | None) -> SessionIndex:
+    if url:
+        return RedisSessionIndex(url)
+    return InMemorySessionIndex()
+
+
+class RefreshSessions:
+    def __init__(self, index: SessionIndex, lifetime: timedelta, reuse_grace: timedelta = timedelta(0)):
+        self.index = index
+        self.lifetime = lifetime
+        self.reuse_grace = reuse_grace
+
+    def _issue(self, db, user_id: UUID, family_id: UUID) -> IssuedSession:
+        session = IssuedSession(jti=uuid4(), family_id=family_id, expires_at=datetime.now(timezone.utc) + self.lifetime)
+        db.add(RefreshSession(jti=session.jti, family_id=family_id, user_id=user_id, expires_at=session.expires_at))
+        return session
+
+    async def start(self, db, user_id: UUID) -> IssuedSession:
+        """ Starts a new token family, called on login. db must be a primary session """
+        session = self._issue(db, user_id, uuid4())
+        await db.commit()
+        await self.index.set(session.jti, ACTIVE, session.expires_at)
+        return session
+
+    async def rotate(self, db, user_id: UUID, jti: UUID, family_id: UUID) -> IssuedSession | None:
+        """
+        Exchanges the session jti for a new one in the same family. Returns None when the token is unknown, expired or its family was revoked,
+        raises RefreshTokenRecentlyRotated when it was exchanged within reuse_grace and RefreshTokenReused (after revoking the family) when it
+        was exchanged before that.
+        """
+        state = await self.index.state(jti, family_id)
+        if state == REVOKED:
+            auth_refresh_rotations.inc(("invalid",))
+            return None
+        if state == ROTATED:
+            result = await db.execute(select(RefreshSession.rotated_at).where(RefreshSession.jti == jti))
+            row = result.first()
+            if row is not None and row.rotated_at is not None:
+                await self._reused(db, user_id, family_id, row.rotated_at)
+
+        now = datetime.now(timezone.utc)
+        result = await db.execute(update(RefreshSession)
+                                  .where(RefreshSession.jti == jti,
+                                         RefreshSession.user_id == user_id,
+                                         RefreshSession.family_id == family_id,
+                                         RefreshSession.rotated_at.is_(None),
+                                         RefreshSession.expires_at > now)
+                                  .values(rotated_at=now))
+        if result.rowcount != 1:
+            await db.rollback()
+            result = await db.execute(select(RefreshSession.rotated_at).where(RefreshSession.jti == jti))
+            row = result.first()
+            if row is not None and row.rotated_at is not None:
+                await self._reused(db, user_id, family_id, row.rotated_at)
+            auth_refresh_rotations.inc(("invalid",))
+            return None
+
+        session = self._issue(db, user_id, family_id)
+        await db.commit()
+
+        await self.index.set(jti, ROTATED, now + self.lifetime)
+        await self.index.set(session.jti, ACTIVE, session.expires_at)
+        auth_refresh_rotations.inc(("rotated",))
+        return session
+
+    async def _reused(self, db, user_id: UUID, family_id: UUID, rotated_at: datetime) -> None:
+        if rotated_at.tzinfo is None:       # SQLite hands timestamps back without their timezone, they are stored in UTC
+            rotated_at = rotated_at.replace(tzinfo=timezone.utc)
+        if datetime.now(timezone.utc) - rotated_at <= self.reuse_grace:
+            auth_refresh_rotations.inc(("grace",))
+            logger.info("Refresh token of family %s presented again %.1fs after its rotation, rejected without revoking", family_id,
+                        (datetime.now(timezone.utc) - rotated_at).total_seconds())
+            raise RefreshTokenRecentlyRotated()
+
+        await db.execute(delete(RefreshSession).where(RefreshSession.family_id == family_id))
+        await db.commit()
+        await self.index.revoke_family(family_id, datetime.now(timezone.utc) + self.lifetime)
+
+        auth_refresh_rotations.inc(("reused",))
+        logger.warning("Refresh token reuse detected for user %s, revoked token family %s", user_id, family_id)
+        raise RefreshTokenReused(family_id)
+
+    async def revoke_user(self, db, user_id: UUID) -> None:
+        """ Deletes all of the user's sessions as part of db's transaction, the caller commits """
+        await db.execute(delete(RefreshSession).where(RefreshSession.user_id == user_id))
+
+    async def sweep(self, batch_size: int) -> int:
+        """ Deletes expired sessions batch_size rows (and one short transaction) at a time. Returns how many were deleted """
+        deleted = 0
+        async with AsyncSessionLocal() as db:
+            while True:
+                expired = (select(RefreshSession.jti)
+                           .where(RefreshSession.expires_at <= datetime.now(timezone.utc))
+                           .limit(batch_size))
+                result = await db.execute(delete(RefreshSession).where(RefreshSession.jti.in_(expired)))
+                await db.commit()
+                deleted += result.rowcount
+                if result.rowcount < batch_size:
+                    break
+                await asyncio.sleep(0)      # Let requests in between batches
+        if deleted:
+            auth_sessions_swept.inc(amount=deleted)
+            logger.info("Deleted %d expired refresh sessions", deleted)
+        return deleted
+
+    async def run_sweeper(self, interval: float, batch_size: int) -> None:
+        """ Runs until cancelled. The jitter keeps several workers from all sweeping at the same moment """
+        while True:
+            await asyncio.sleep(interval * random.uniform(0.5, 1.5))
+            try:
+                await self.sweep(batch_size)
+            except Exception as e:
+                logger.error("Failed to delete expired refresh sessions. Error: %s", e)
+
+    async def close(self) -> None:
+        await self.index.close()
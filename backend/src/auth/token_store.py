@@ -0,0 +1,167 @@
+import abc
+import logging
+from typing import Dict, Sequence
+from uuid import UUID
+from src.core.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+"""
+The token store holds user_id -> token_version so that checking whether a token was revoked doesn't need a users-table read.
+
+With several workers/pods the store has to be shared or a password change on one node would not revoke tokens on the others, which is what the
+Redis store is for: every node reads the same key on every request so a bump is seen everywhere at once. The in-memory store is the default
+(single worker setups and tests) and behaves exactly the same within one process.
+
+Rules every caller follows:
+- the database stays the source of truth, the store is only ever populated from it (add) or updated right after a commit (set/revoke/delete)
+- add() never overwrites an existing value, so a slow reader can't put back a version that a concurrent password change already bumped
+- a miss (or the store being down) just means "go ask the database". A failed set() (which is also what revoke() does) raises
+  TokenStoreWriteFailed instead: the other nodes would keep accepting the old version until the key expires, and the request that changed it
+  has to say so rather than report success
+
+The in-memory store can't tell the other workers about a change, so its entries only live a few seconds (TOKEN_STORE_LOCAL_TTL_SECONDS): with
+several workers and no TOKEN_STORE_URL, a revocation on one of them is seen by the others once their entry expired and they ask the database.
+"""
+
+REVOKED = 0     # token_version starts at 1 so no token can ever match this; used for deleted users
+
+
+class TokenStoreWriteFailed(Exception):
+    """ A new token_version couldn't be published, other nodes may accept the old one until its key expires """
+
+
+class TokenVersionStore(abc.ABC):
+    @abc.abstractmethod
+    async def get(self, user_id: UUID) -> int | None:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def get_many(self, user_ids: Sequence[UUID]) -> Dict[UUID, int]:
+        """ The versions the store knows, users it doesn't know are left out """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def add(self, user_id: UUID, token_version: int) -> None:
+        """ Store the version only if the store doesn't already know this user """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def add_many(self, token_versions: Dict[UUID, int]) -> None:
+        """ add() for a batch of users, in one round-trip where the store has a network in between """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def set(self, user_id: UUID, token_version: int) -> None:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def delete(self, user_id: UUID) -> None:
+        raise NotImplementedError
+
+    async def revoke(self, user_id: UUID) -> None:
+        await self.set(user_id, REVOKED)
+
+    async def close(self) -> None:
+        pass
+
+
+class InMemoryTokenVersionStore(TokenVersionStore):
+    def __init__(self, ttl: float, maxsize: int = 100_000):
+        self._versions = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    async def get(self, user_id: UUID) -> int | None:
+        return self._versions.get(user_id)
+
+    async def get_many(self, user_ids: Sequence[UUID]) -> Dict[UUID, int]:
+        versions = {user_id: self._versions.get(user_id) for user_id in user_ids}
+        return {user_id: version for user_id, version in versions.items() if version is not None}
+
+    async def add(self, user_id: UUID, token_version: int) -> None:
+        if self._versions.get(user_id) is None:
+            self._versions.set(user_id, token_version)
+
+    async def add_many(self, token_versions: Dict[UUID, int]) -> None:
+        for user_id, token_version in token_versions.items():
+            await self.add(user_id, token_version)
+
+    async def set(self, user_id: UUID, token_version: int) -> None:
+        self._versions.set(user_id, token_version)
+
+    async def delete(self, user_id: UUID) -> None:
+        self._versions.pop(user_id)
+
+
+class RedisTokenVersionStore(TokenVersionStore):
+    def __init__(self, url: str, ttl: int, prefix: str = "token_version:"):
+        try:
+            from redis import asyncio as redis
+        except ImportError as e:
+            raise RuntimeError("TOKEN_STORE_URL is set but the redis package is not installed (pip install 'backend[redis]')") from e
+
+        self._redis = redis.from_url(url)
+        self._ttl = ttl
+        self._prefix = prefix
+
+    def _key(self, user_id: UUID) -> str:
+        return f"{self._prefix}{user_id}"
+
+    async def get(self, user_id: UUID) -> int | None:
+        try:
+            value = await self._redis.get(self._key(user_id))
+        except Exception as e:
+            # Never fail a request because redis is down, treat it as a miss and let the caller use the database
+            logger.warning("Token store read failed, falling back to the database: %s", e)
+            return None
+        return int(value) if value is not None else None
+
+    async def get_many(self, user_ids: Sequence[UUID]) -> Dict[UUID, int]:
+        if not user_ids:
+            return {}
+        try:
+            values = await self._redis.mget([self._key(user_id) for user_id in user_ids])      # One round-trip for the whole batch
+        except Exception as e:
+            logger.warning("Token store read failed, falling back to the database: %s", e)
+            return {}
+        return {user_id: int(value) for user_id, value in zip(user_ids, values) if value is not None}
+
+    async def add(self, user_id: UUID, token_version: int) -> None:
+        try:
+            await self._redis.set(self._key(user_id), token_version, ex=self._ttl, nx=True)
+        except Exception as e:
+            logger.warning("Token store write failed: %s", e)
+
+    async def add_many(self, token_versions: Dict[UUID, int]) -> None:
+        if not token_versions:
+            return
+        try:
+            # Pipelined without MULTI: each SET NX stands on its own, they only share the round-trip
+            async with self._redis.pipeline(transaction=False) as pipe:
+                for user_id, token_version in token_versions.items():
+                    pipe.set(self._key(user_id), token_version, ex=self._ttl, nx=True)
+                await pipe.execute()
+        except Exception as e:
+            logger.warning("Token store write failed: %s", e)
+
+    async def set(self, user_id: UUID, token_version: int) -> None:
+        try:
+            await self._redis.set(self._key(user_id), token_version, ex=self._ttl)
+        except Exception as e:
+            # Other nodes may keep accepting the old version until the key expires, the caller has to know
+            logger.error("Failed to publish token_version %s for user %s: %s", token_version, user_id, e)
+            raise TokenStoreWriteFailed(str(e)) from e
+
+    async def delete(self, user_id: UUID) -> None:
+        try:
+            await self._redis.delete(self._key(user_id))
+        except Exception as e:
+            logger.error("Failed to delete token_version for user %s: %s", user_id, e)
+
+    async def close(self) -> None:
+        await self._redis.aclose()
+
+
+def create_token_version_store(url: str | None, ttl: int, local_ttl: float) -> TokenVersionStore:
+    if url:
+        return RedisTokenVersionStore(url, ttl=ttl)
+    return InMemoryTokenVersionStore(ttl=local_ttl)
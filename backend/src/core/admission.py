@@ -0,0 +1,167 @@
+import math
+import os
+import time
+from typing import Dict, Tuple
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from src.core.config import settings
+from src.core.metrics import Counter, Gauge
+
+"""
+Admission control. Every request takes a slot from the concurrency limit of its route class before it runs, and when the class is at its limit the
+request is turned away straight away with a 503 + Retry-After instead of queueing behind the others. Under overload that keeps the latency of what
+we do accept in check (and tells clients to back off) rather than everything slowing down until it times out.
+
+The limits aren't fixed, each class adjusts its own with AIMD (additive increase, multiplicative decrease):
+- a request that got its response started within the class' latency target, while the class was actually using its limit, raises it by 1/limit
+  (so about +1 once a whole limit's worth of requests went well)
+- one that was slower than the target, or that came back as a 503 from further in (e.g. the password hasher's queue was full), multiplies it by
+  BACKOFF. When it was admitted with the class (nearly) at its limit, the limit is what made it wait, and it is brought down further to what
+  the class actually got through: the requests in flight when it was admitted all finished within its latency, so in flight * target / latency
+  is about what fits in the target (Little's law). That gets a high starting limit down in one step under a flood, while a single slow request
+  on a quiet class only costs one BACKOFF. Only requests admitted after the previous decrease can shrink it again, otherwise the backlog that
+  was admitted before the limit came down would keep shrinking it all the way to the minimum
+
+Some routes are slow by design rather than because of load (the bulk import only responds once the whole file is in). They take a slot of
+their class like any other request, but their latency isn't used as a sample (UNSAMPLED_ROUTES).
+
+The route classes keep the expensive bcrypt routes (login, register, change-password, bulk import) from starving the cheap ones: a login burst
+can only use up the hashing budget and /users/me or /auth/refresh still get in. /metrics and the JWKS are never limited.
+Note: the limits are per process, with several workers each one adjusts its own.
+"""
+
+BACKOFF = 0.9
+
+# (method, path) -> route class. The route isn't known before the router runs, so the classes go by the raw path
+ROUTE_CLASSES: Dict[Tuple[str, str], str] = {
+    ("POST", "/auth/token"): "hashing",
+    ("POST", "/auth/register"): "hashing",
+    ("PATCH", "/users/me/change-password"): "hashing",
+    ("POST", "/users/import"): "hashing",
+    ("GET", "/metrics"): "exempt",
+    ("GET", "/.well-known/jwks.json"): "exempt",
+}
+DEFAULT_CLASS = "default"
+UNSAMPLED_ROUTES = {("POST", "/users/import")}
+
+
+class AIMDLimit:
+    """ The concurrency limit of one route class. Like TTLCache there is no locking, it is only touched from the event loop thread """
+
+    def __init__(self, initial: int, min_limit: int, max_limit: int, target_seconds: float):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.target_seconds = target_seconds
+        self.limit = float(min(max(initial, min_limit), max_limit))
+        self.in_flight = 0
+        self._backed_off_at = 0.0
+
+        self.admitted = 0
+        self.rejected = 0
+
+    def try_acquire(self) -> bool:
+        if self.in_flight >= int(self.limit):
+            self.rejected += 1
+            return False
+        self.in_flight += 1
+        self.admitted += 1
+        return True
+
+    def release(self, admitted_at: float, admitted_in_flight: int, seconds: float, overloaded: bool) -> None:
+        """
+        admitted_in_flight is the in_flight count right after the request was admitted, seconds how long it took to start its response and
+        overloaded whether it was shed further in
+        """
+        # Growing only makes sense when the limit is what's holding requests back, otherwise a quiet period would let it grow without bound
+        in_use = self.in_flight * 2 >= self.limit
+        self.in_flight -= 1
+        if overloaded or seconds > self.target_seconds:
+            if admitted_at >= self._backed_off_at:
+                limit = self.limit * BACKOFF
+                if not overloaded and admitted_in_flight >= limit:       # Admitted within one backoff of the limit
+                    limit = min(limit, admitted_in_flight * self.target_seconds / seconds)
+                self.limit = max(self.min_limit, limit)
+                self._backed_off_at = time.perf_counter()
+        elif in_use:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+    def discard(self) -> None:
+        """ Frees the slot of a request whose latency says nothing about load (UNSAMPLED_ROUTES) """
+        self.in_flight -= 1
+
+
+def create_limits() -> Dict[str, AIMDLimit]:
+    # The hashing class starts out admitting as many requests as the password hasher accepts before it sheds jobs itself (a burst of signups
+    # is let through) and from there only the latency target brings it down. It never goes below the number of workers, so they stay busy
+    hash_workers = settings.PASSWORD_HASH_WORKERS or os.cpu_count() or 1      # The same default as PasswordHasher
+    hashing_limit = settings.ADMISSION_HASHING_LIMIT or hash_workers + settings.PASSWORD_HASH_MAX_PENDING
+    hashing_min_limit = settings.ADMISSION_HASHING_MIN_LIMIT or hash_workers
+    return {
+        "hashing": AIMDLimit(hashing_limit, hashing_min_limit, settings.ADMISSION_HASHING_MAX_LIMIT,
+                             target_seconds=settings.ADMISSION_HASHING_TARGET_SECONDS),
+        DEFAULT_CLASS: AIMDLimit(settings.ADMISSION_DEFAULT_LIMIT, settings.ADMISSION_DEFAULT_MIN_LIMIT, settings.ADMISSION_DEFAULT_MAX_LIMIT,
+                                 target_seconds=settings.ADMISSION_DEFAULT_TARGET_SECONDS),
+    }
+
+
+# The limits of the running app, read by the gauges below at scrape time. Set when the middleware is built
+limits: Dict[str, AIMDLimit] = {}
+
+Gauge("admission_limit", "Current concurrency limit of each route class", labelnames=("route_class",),
+      collect=lambda: {(name,): limit.limit for name, limit in limits.items()})
+Gauge("admission_in_flight", "Requests currently admitted per route class", labelnames=("route_class",),
+      collect=lambda: {(name,): limit.in_flight for name, limit in limits.items()})
+Counter("admission_rejected_total", "Requests turned away with a 503 because their route class was at its limit", labelnames=("route_class",),
+        collect=lambda: {(name,): limit.rejected for name, limit in limits.items()})
+
+
+class AdmissionControlMiddleware:
+    """ Pure ASGI middleware. Turned off with ADMISSION_CONTROL=false, read when Starlette builds the middleware (on startup), not on import """
+
+    def __init__(self, app: ASGIApp):
+        global limits
+        self.app = app
+        self.enabled = settings.ADMISSION_CONTROL
+        self.limits = limits = create_limits()
+        self.retry_after = str(math.ceil(settings.ADMISSION_RETRY_AFTER_SECONDS))
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not self.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        route_class = ROUTE_CLASSES.get((scope["method"], scope["path"]), DEFAULT_CLASS)
+        if route_class == "exempt":
+            await self.app(scope, receive, send)
+            return
+
+        limit = self.limits[route_class]
+        sampled = (scope["method"], scope["path"]) not in UNSAMPLED_ROUTES
+        if not limit.try_acquire():
+            scope["admission_shed"] = route_class      # The router never sees it, this tells route_label why there is no route
+            response = JSONResponse({"detail": "Server is busy. Please try again shortly"}, status_code=503,
+                                    headers={"Retry-After": self.retry_after})
+            await response(scope, receive, send)
+            return
+
+        admitted_in_flight = limit.in_flight
+        started_at = time.perf_counter()
+        # The sample is the time to the response start rather than to the end, so a slow client reading a long response doesn't count as overload
+        response_started_after: float | None = None
+        status_code = 500
+
+        async def send_with_timing(message: Message) -> None:
+            nonlocal response_started_after, status_code
+            if message["type"] == "http.response.start":
+                response_started_after = time.perf_counter() - started_at
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            seconds = response_started_after if response_started_after is not None else time.perf_counter() - started_at
+            if sampled:
+                limit.release(started_at, admitted_in_flight, seconds, overloaded=status_code == 503)
+            else:
+                limit.discard()
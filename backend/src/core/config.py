@@ -1,4 +1,6 @@
+from functools import lru_cache
 from pydantic_settings import BaseSettings
+from src.core.lazy import lazy
 
 class Settings(BaseSettings):
     CELERY_BROKER_URL: str
@@ -10,11 +12,103 @@ class Settings(BaseSettings):
     DB_PASSWORD: str
     DB_NAME: str
     SECRET_KEY: str
-    ALGORITHM: str
+    ALGORITHM: str                          # HS256 signs with SECRET_KEY. RS256/ES256/EdDSA sign with the key ring below (see src/auth/keys.py)
     ACCESS_TOKEN_EXPIRE_MINUTES: int
     REFRESH_TOKEN_EXPIRE_MINUTES: int
+    JWT_KEYS_DIR: str | None = None         # Only used with an asymmetric ALGORITHM
+    JWT_ACTIVE_KID: str | None = None       # Which key in JWT_KEYS_DIR signs new tokens
+
+    # Password hashing pool (see src/auth/hashing.py)
+    PASSWORD_HASH_EXECUTOR: str = "thread"      # "thread" or "process"
+    PASSWORD_HASH_WORKERS: int | None = None    # Defaults to the number of cores
+    PASSWORD_HASH_MAX_PENDING: int = 64         # How many hash jobs may wait for a worker before new ones get a 503
+    BCRYPT_ROUNDS: int = 12                     # Cost of new hashes, each +1 doubles the time. python -m src.auth.hashing picks one for your hardware
+
+    # In-process cache of authenticated users (see load_user_snapshot in src/auth/service.py). Set either to 0 to disable it
+    USER_CACHE_TTL_SECONDS: float = 30.0
+    USER_CACHE_MAX_SIZE: int = 10_000
+
+    # Shared user_id -> token_version store (see src/auth/token_store.py). Leave the url unset to keep it in-process, point it at redis
+    # (e.g. redis://redis:6379/1) when running more than one worker so revocations are seen by every node
+    TOKEN_STORE_URL: str | None = None
+    TOKEN_STORE_TTL_SECONDS: int = 3600
+    TOKEN_STORE_LOCAL_TTL_SECONDS: float = 5.0  # Without the url: how stale another worker's view of a revocation can get
+
+    # Login throttling (see src/auth/rate_limit.py). Over-limit attempts get a 429 before any bcrypt work is done
+    LOGIN_THROTTLE_ENABLED: bool = True
+    LOGIN_THROTTLE_URL: str | None = None       # Redis URL so all nodes share the limits. Falls back to TOKEN_STORE_URL, in-memory when neither is set
+    LOGIN_IP_BURST: int = 20                    # Attempts one IP can make back to back...
+    LOGIN_IP_PER_MINUTE: float = 10.0           # ...after which it gets this many per minute
+    LOGIN_ACCOUNT_BURST: int = 10               # Same for attempts on one account, from any IP
+    LOGIN_ACCOUNT_PER_MINUTE: float = 5.0
+    LOGIN_LOCKOUT_THRESHOLD: int = 5            # Failures in a row before the account gets locked
+    LOGIN_LOCKOUT_SECONDS: float = 30.0         # First lockout, doubles with every further failure...
+    LOGIN_LOCKOUT_MAX_SECONDS: float = 900.0    # ...up to this
+
+    # Refresh token sessions (see src/auth/sessions.py). The session index shares TOKEN_STORE_URL
+    REFRESH_REUSE_GRACE_SECONDS: float = 10.0       # A rotated token presented again this soon is rejected without revoking its family
+    SESSION_SWEEP_INTERVAL_SECONDS: float = 300.0   # How often expired sessions are deleted. 0 turns the sweeper off
+    SESSION_SWEEP_BATCH_SIZE: int = 1000            # Rows per DELETE, so the sweeper never holds long locks
+
+    # POST /auth/introspect for other services checking tokens in bulk. With the key set callers have to send it in X-API-Key
+    INTROSPECT_API_KEY: str | None = None
+    INTROSPECT_MAX_TOKENS: int = 500
+
+    # How many decoded tokens verify_token keeps around (see src/auth/service.py). 0 disables the cache
+    TOKEN_CACHE_MAX_SIZE: int = 50_000
+
+    # Connection pool (see src/database/core.py)
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10               # Extra connections allowed on top of DB_POOL_SIZE under load
+    DB_POOL_TIMEOUT: float = 30.0           # Seconds to wait for a free connection before failing the request
+    DB_POOL_RECYCLE: int = -1               # Replace connections older than this many seconds. -1 keeps them forever
+    DB_POOL_PRE_PING: bool = True           # Ping on every checkout. Costs a round-trip; with it off, use DB_POOL_RECYCLE to drop stale connections
+    DB_PGBOUNCER_MODE: bool = False         # Running behind pgbouncer (transaction pooling): no local pool and no prepared statement caching
+
+    # Logging (see src/logging.py)
+    LOG_JSON: bool = False                      # One JSON object per line with request id, route and latency
+    LOG_QUEUE: bool = False                     # Write log lines (and format them) on a background thread instead of the event loop
+    LOG_SUCCESS_SAMPLE_RATE: float = 1.0        # Fraction of high-volume success logs (logins, refreshes, 2xx/3xx requests) that are kept
+
+    # Render the user and token responses with pydantic-core, skipping FastAPI's second validation pass (see src/core/responses.py)
+    FAST_JSON_RESPONSES: bool = False
+
+    # Admin only endpoints (bulk import) are open to these accounts. Given as a JSON list, e.g. ADMIN_EMAILS='["admin@university.edu"]'
+    ADMIN_EMAILS: list[str] = []
+
+    # Bulk user import (see src/users/service.py): rows per hashing round, INSERT statement and commit
+    BULK_IMPORT_BATCH_SIZE: int = 500
+
+    # Read replicas (see src/database/replicas.py). Given as a JSON list, e.g. DATABASE_REPLICA_URLS='["postgresql+asyncpg://user:pw@replica1/db"]'
+    DATABASE_REPLICA_URLS: list[str] = []   # Empty means every read goes to the primary
+    DB_REPLICA_RETRY_SECONDS: float = 30.0  # A replica that failed to connect is skipped for this long before we try it again
+    READ_YOUR_WRITES_SECONDS: float = 5.0   # After a user's row changes their reads stick to the primary for this long. Keep it above the replica lag
+
+    # Admission control (see src/core/admission.py). Each route class gets a concurrency limit that adapts to its latency, requests over it get a 503
+    ADMISSION_CONTROL: bool = True
+    ADMISSION_RETRY_AFTER_SECONDS: float = 1.0
+    # Starting limit for the bcrypt routes (login, register, change-password, import), by default what the password hasher accepts before it
+    # sheds jobs itself (PASSWORD_HASH_WORKERS + PASSWORD_HASH_MAX_PENDING)...
+    ADMISSION_HASHING_LIMIT: int | None = None
+    ADMISSION_HASHING_MIN_LIMIT: int | None = None  # ...never shrinks below this (by default the hasher's workers)...
+    ADMISSION_HASHING_MAX_LIMIT: int = 128          # ...nor grows above this
+    ADMISSION_HASHING_TARGET_SECONDS: float = 2.0   # Responses slower than this shrink the limit
+    ADMISSION_DEFAULT_LIMIT: int = 200              # Same for every other route
+    ADMISSION_DEFAULT_MIN_LIMIT: int = 10
+    ADMISSION_DEFAULT_MAX_LIMIT: int = 2000
+    ADMISSION_DEFAULT_TARGET_SECONDS: float = 0.5
+
+    # Database instrumentation (see src/database/instrumentation.py)
+    DB_SLOW_QUERY_MS: float = 200.0         # Statements slower than this are logged with their route
+    DB_STATS_HEADERS: bool = False          # Add X-DB-Query-Count / X-DB-Time-Ms to every response. Handy locally, leave off in production
 
     class Config:
         env_file = "../../../.env"
 
-settings = Settings() # type: ignore
\ No newline at end of file
+@lru_cache(maxsize=None)
+def get_settings() -> Settings:
+    """ Reads the environment (and .env) the first time it's called rather than when this module is imported """
+    return Settings() # type: ignore
+
+# Use settings.X as before, the environment is only read on the first attribute access
+settings = lazy(get_settings)
\ No newline at end of file
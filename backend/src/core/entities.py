@@ -1,6 +1,6 @@
 import uuid 
 
-from sqlalchemy import func, Column, DateTime, ForeignKey, Text, String, Integer, text
+from sqlalchemy import func, CheckConstraint, Column, DateTime, ForeignKey, Index, Text, String, Integer, text
 from sqlalchemy.dialects.postgresql import UUID, JSONB      # JSONB is for storing JSON data as binary within the database
 from sqlalchemy.orm import relationship
 
@@ -19,5 +19,37 @@ class User(Base):
     time_created = Column(DateTime(timezone=True), server_default=func.now())
     time_updated = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
+    # For the admin listing (see src/users/listing.py): keyset pagination walks (time_created, id) and the search matches case-insensitive prefixes.
+    # On Postgres the prefix indexes need the pattern opclass, a plain btree can't serve LIKE 'abc%' under a non-C collation
+    __table_args__ = (
+        # Emails are stored lowercased (see normalize_email in src/auth/schemas.py), so the unique index on email is case-insensitive in effect and
+        # lookups compare the normalized input against it. This makes sure nothing writes one that isn't
+        CheckConstraint("email = lower(trim(email))", name="ck_user_email_normalized"),
+        Index("ix_user_time_created_id", "time_created", "id"),
+        Index("ix_user_email_prefix", func.lower(email).label("email_lower"), postgresql_ops={"email_lower": "varchar_pattern_ops"}),
+        Index("ix_user_first_name_prefix", func.lower(first_name).label("first_name_lower"),
+              postgresql_ops={"first_name_lower": "varchar_pattern_ops"}),
+        Index("ix_user_last_name_prefix", func.lower(last_name).label("last_name_lower"),
+              postgresql_ops={"last_name_lower": "varchar_pattern_ops"}),
+    )
+
     def __repr__(self):
         return f"<User(id='{self.id}', first_name='{self.first_name}', last_name='{self.last_name}'), email='{self.email}')>"
+
+
+class RefreshSession(Base):
+    """
+    One row per refresh token handed out. A login starts a family, every refresh marks the presented token as rotated and adds its successor
+    to the same family. Rows are deleted when their token expires (see the sweeper in src/auth/sessions.py) or when their family is revoked.
+    """
+    __tablename__ = "refresh_session"
+
+    jti = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    family_id = Column(UUID(as_uuid=True), nullable=False, index=True)
+    user_id = Column(UUID(as_uuid=True), ForeignKey("user.id", ondelete="CASCADE"), nullable=False, index=True)
+    expires_at = Column(DateTime(timezone=True), nullable=False, index=True)
+    rotated_at = Column(DateTime(timezone=True), nullable=True)     # Set once the token has been exchanged, presenting it again is a reuse
+    time_created = Column(DateTime(timezone=True), server_default=func.now())
+
+    def __repr__(self):
+        return f"<RefreshSession(jti='{self.jti}', family_id='{self.family_id}', user_id='{self.user_id}')>"
@@ -0,0 +1,54 @@
+from typing import Any, Callable, Generic, TypeVar
+
+"""
+Module level singletons (settings, the token store, the password hasher...) that are only built when first used instead of when their module is
+imported. That way importing a module never needs the environment/.env, and a pre-forking server (gunicorn --preload) can import the whole app in
+the parent without every worker inheriting objects made before the fork.
+
+Callers use the proxy exactly like the object itself. Each attribute access costs one extra Python call, which is nothing next to what these
+objects do, but don't wrap anything that sits in a tight loop.
+Note: the proxy has no public attributes of its own (they would hide the wrapped object's), use resolve() to get at the real object.
+"""
+
+T = TypeVar("T")
+
+
+class Lazy(Generic[T]):
+    __slots__ = ("_lazy_factory", "_lazy_instance")
+
+    def __init__(self, factory: Callable[[], T]):
+        object.__setattr__(self, "_lazy_factory", factory)
+        object.__setattr__(self, "_lazy_instance", None)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(resolve(self), name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        setattr(resolve(self), name, value)
+
+    def __call__(self, *args: Any, **kwargs: Any) -> Any:
+        return resolve(self)(*args, **kwargs)
+
+    def __len__(self) -> int:
+        return len(resolve(self))      # type: ignore
+
+
+def lazy(factory: Callable[[], T]) -> T:
+    """ Returns a stand-in for factory() that calls it on first use. Typed as T so callers (and type checkers) see the real object """
+    return Lazy(factory)    # type: ignore
+
+
+def resolve(value: Any) -> Any:
+    """ The object behind a lazy() proxy, built now if it wasn't yet. Anything else is returned as is """
+    if not isinstance(value, Lazy):
+        return value
+    instance = object.__getattribute__(value, "_lazy_instance")
+    if instance is None:
+        instance = object.__getattribute__(value, "_lazy_factory")()
+        object.__setattr__(value, "_lazy_instance", instance)
+    return instance
+
+
+def is_created(value: Any) -> bool:
+    """ False for a lazy() proxy that was never used, so shutdown code can skip closing what was never opened """
+    return not isinstance(value, Lazy) or object.__getattribute__(value, "_lazy_instance") is not None
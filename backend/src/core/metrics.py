@@ -0,0 +1,148 @@
+from bisect import bisect_left
+from typing import Any, Callable, Dict, List, Mapping, Sequence, Tuple
+
+"""
+Minimal Prometheus style metrics (counters, gauges and histograms) rendered in the text exposition format.
+
+These get updated on every request so they are built to stay off the hot path:
+- no locks. Everything is updated from the event loop thread and an update never awaits, so nothing can interleave
+- no allocations once a label combination has been seen: a series is created the first time its labels show up and after that an update is a dict
+  lookup plus a couple of in-place number updates (histograms find their bucket with a bisect over a preallocated list)
+
+Label values are passed as a tuple in the same order as labelnames, e.g. request_latency.observe(0.012, ("GET", "/users/me"))
+"""
+
+Labels = Tuple[str, ...]
+
+_registry: List["_Metric"] = []
+
+
+def _format_labels(labelnames: Sequence[str], labels: Labels, extra: str = "") -> str:
+    parts = [f'{name}="{value}"' for name, value in zip(labelnames, labels)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        _registry.append(self)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"] + self._render_samples()
+
+    def _render_samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """ Like Gauge, collect reads the totals at scrape time from something that already counts them """
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 collect: Callable[[], Dict[Labels, float]] | None = None):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Labels, float] = {}
+        self._collect = collect
+
+    def inc(self, labels: Labels = (), amount: float = 1.0) -> None:
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def value(self, labels: Labels = ()) -> float:
+        return self._values.get(labels, 0.0)
+
+    def _render_samples(self) -> List[str]:
+        values = self._collect() if self._collect is not None else self._values
+        return [f"{self.name}{_format_labels(self.labelnames, labels)} {value}" for labels, value in values.items()]
+
+
+class Gauge(_Metric):
+    """
+    Either set directly (set/inc/dec) or, when collect is given, read at scrape time from a callable returning {labels: value}.
+    The callable form is for values something else already tracks (pool sizes, queue depths) so we don't have to mirror them on every change.
+    """
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 collect: Callable[[], Dict[Labels, float]] | None = None):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Labels, float] = {}
+        self._collect = collect
+
+    def set(self, value: float, labels: Labels = ()) -> None:
+        self._values[labels] = value
+
+    def inc(self, labels: Labels = (), amount: float = 1.0) -> None:
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def dec(self, labels: Labels = (), amount: float = 1.0) -> None:
+        self._values[labels] = self._values.get(labels, 0.0) - amount
+
+    def _render_samples(self) -> List[str]:
+        values = self._collect() if self._collect is not None else self._values
+        return [f"{self.name}{_format_labels(self.labelnames, labels)} {value}" for labels, value in values.items()]
+
+
+class _HistogramSeries:
+    __slots__ = ("bucket_counts", "sum", "count")
+
+    def __init__(self, size: int):
+        self.bucket_counts = [0] * size     # Not cumulative, the +Inf bucket is the last slot
+        self.sum = 0.0
+        self.count = 0
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, buckets: Sequence[float], labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Labels, _HistogramSeries] = {}
+
+    def observe(self, value: float, labels: Labels = ()) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = _HistogramSeries(len(self.buckets) + 1)
+        series.bucket_counts[bisect_left(self.buckets, value)] += 1
+        series.sum += value
+        series.count += 1
+
+    def _render_samples(self) -> List[str]:
+        lines = []
+        for labels, series in self._series.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, series.bucket_counts):
+                cumulative += bucket_count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {series.count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {series.sum}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {series.count}")
+        return lines
+
+
+def route_label(scope: Mapping[str, Any]) -> str:
+    """
+    The route template (e.g. /users/me) for per-route labels. It is only in the scope once routing happened, so call this after the app ran.
+    Unmatched paths (404s, scanners) are lumped together so they can't blow up the number of series, requests admission control turned away
+    before routing get "shed".
+    """
+    route = scope.get("route")
+    if route is None and "admission_shed" in scope:
+        return "shed"
+    return getattr(route, "path", None) or "unmatched"
+
+
+def render_metrics() -> str:
+    """ Every registered metric in the Prometheus text format """
+    lines: List[str] = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
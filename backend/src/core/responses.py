@@ -0,0 +1,41 @@
+from functools import lru_cache
+from typing import Any, Type, TypeVar
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, TypeAdapter
+from pydantic_core import to_json
+from src.core.config import settings
+
+"""
+Fast path for JSON responses (opt-in with FAST_JSON_RESPONSES).
+
+Normally a route builds its response model (validation #1) and returns it, then FastAPI validates it again against response_model
+(validation #2), dumps it to python objects and json.dumps those. With the fast path model_response validates once through a cached TypeAdapter
+and returns a FastJSONResponse, which FastAPI passes through untouched, and the model is written straight to JSON bytes by pydantic-core.
+Keep response_model on the route so the docs stay the same. See benchmarks/bench_serialization.py for the numbers.
+"""
+
+Model = TypeVar("Model", bound=BaseModel)
+
+
+class FastJSONResponse(JSONResponse):
+    """ JSONResponse rendered by pydantic-core instead of json.dumps. Takes pydantic models directly (plus dicts, datetimes, UUIDs...) """
+
+    def render(self, content: Any) -> bytes:
+        return to_json(content)
+
+
+@lru_cache(maxsize=None)
+def type_adapter(model: Type[Model]) -> TypeAdapter[Model]:
+    """ Building a TypeAdapter compiles its validator/serializer, so we only ever do it once per type """
+    return TypeAdapter(model)
+
+
+def model_response(model: Type[Model], value: Any, status_code: int = 200) -> Any:
+    """
+    Validates value (an instance of model, a dict or an ORM object) into model once. With FAST_JSON_RESPONSES off the model itself is returned
+    and FastAPI handles it as before, with it on it comes back as an already rendered FastJSONResponse.
+    """
+    instance = value if isinstance(value, model) else type_adapter(model).validate_python(value, from_attributes=True)
+    if not settings.FAST_JSON_RESPONSES:
+        return instance
+    return FastJSONResponse(instance, status_code=status_code)
@@ -0,0 +1,54 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, Hashable, TypeVar
+
+"""
+Coalesces concurrent identical loads within the process: while a load for a key is running, every other caller asking for the same key awaits that
+one load and gets its result (or its exception) instead of starting another. A client fanning out 20 requests with the same token, or a cold cache
+right after a deploy, then costs one query per key instead of one per request.
+
+- The load runs in its own task. Callers await it through asyncio.shield, so a caller that gets cancelled (client went away, timeout) only stops
+  waiting; the load carries on for everyone else. That also means the load must not use anything owned by the caller, like its DB session.
+- Nothing is cached here. Once the load finishes the key is free again and the next caller starts a new one, caching is the caller's job. A load
+  that caches its result should check is_current() first: after forget() its result may predate the change that made the caller forget it
+
+Like TTLCache there is no locking, everything runs on the event loop thread.
+"""
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    def __init__(self) -> None:
+        self._flights: Dict[Hashable, asyncio.Task] = {}
+
+        self.loads = 0
+        self.shared = 0
+
+    async def do(self, key: Hashable, load: Callable[[], Awaitable[T]]) -> T:
+        task = self._flights.get(key)
+        if task is None:
+            self.loads += 1
+            task = asyncio.ensure_future(load())
+            self._flights[key] = task
+            task.add_done_callback(lambda done: self._finished(key, done))
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
+
+    def _finished(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._flights.get(key) is task:      # forget() may have replaced it already
+            del self._flights[key]
+        # Marks the exception as retrieved, when every caller was cancelled nobody else would and asyncio would log it as never retrieved
+        if not task.cancelled():
+            task.exception()
+
+    def forget(self, key: Hashable) -> None:
+        """ Callers arriving from now on start a new load instead of joining the running one, e.g. because the row was just changed """
+        self._flights.pop(key, None)
+
+    def is_current(self, key: Hashable) -> bool:
+        """ Called from inside a load: whether it is still the registered load for key, i.e. nobody called forget(key) since it started """
+        return self._flights.get(key) is asyncio.current_task()
+
+    def __len__(self) -> int:
+        return len(self._flights)
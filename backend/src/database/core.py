@@ -1,15 +1,70 @@
-from typing import Annotated
+from typing import Annotated, Any, Dict
+from uuid import uuid4
 from src.core.config import settings
+from src.core.lazy import lazy, resolve, is_created
 
 from fastapi import Depends
 from sqlalchemy.orm import declarative_base
-from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
+from src.database.instrumentation import instrument_engine, InstrumentedAsyncQueuePool, InstrumentedNullPool
+from src.database.replicas import ReplicaSet, ReplicaRoutingSession, RecentWrites
 
-# Create the engine using the DB URL
-engine = create_async_engine(settings.DATABASE_URL, pool_pre_ping=True, pool_size=5, max_overflow=10)
+def _engine_options() -> Dict[str, Any]:
+    """
+    Pool settings come from config so every deployment can be tuned without code changes.
+
+    In pgbouncer mode pgbouncer is the pool, so we open a connection per checkout (NullPool) and turn off prepared statement caching: in
+    transaction pooling mode consecutive statements can land on different server connections, which breaks both asyncpg's statement cache and
+    SQLAlchemy's. Statements still get unique names so two clients can never clash on the same server connection.
+    """
+    if settings.DB_PGBOUNCER_MODE:
+        return {
+            "poolclass": InstrumentedNullPool,
+            "pool_pre_ping": settings.DB_POOL_PRE_PING,
+            "connect_args": {
+                "statement_cache_size": 0,
+                "prepared_statement_cache_size": 0,
+                "prepared_statement_name_func": lambda: f"__asyncpg_{uuid4()}__",
+            },
+        }
+
+    return {
+        "poolclass": InstrumentedAsyncQueuePool,
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+        "pool_pre_ping": settings.DB_POOL_PRE_PING,
+    }
+
+def _create_engine(url: str) -> AsyncEngine:
+    engine = create_async_engine(url, **_engine_options())
+    instrument_engine(engine, slow_query_ms=settings.DB_SLOW_QUERY_MS)     # Per-request query counts/timings and slow-query logging
+    return engine
+
+# Everything below is created on first use (see src/core/lazy.py) rather than on import, so importing this module needs no DATABASE_URL and a
+# pre-forking server never hands a parent's engine to its workers. dispose_engines() closes them again on shutdown
+engine = lazy(lambda: _create_engine(settings.DATABASE_URL))
+
+# Read replicas, same pool settings as the primary. Without any configured every read session just uses the primary engine
+replicas = lazy(lambda: ReplicaSet([_create_engine(url) for url in settings.DATABASE_REPLICA_URLS],
+                                   retry_after=settings.DB_REPLICA_RETRY_SECONDS))
+recent_writes = lazy(lambda: RecentWrites(window=settings.READ_YOUR_WRITES_SECONDS if settings.DATABASE_REPLICA_URLS else 0))
 
 # Config for each individual DB session
-AsyncSessionLocal = async_sessionmaker(autocommit=False, autoflush=False, bind=engine)
+AsyncSessionLocal = lazy(lambda: async_sessionmaker(autocommit=False, autoflush=False, bind=resolve(engine)))
+
+# Read sessions pick a replica (or the primary) when their first statement runs, see ReplicaRoutingSession. Never write through these
+ReadSessionLocal = lazy(lambda: async_sessionmaker(autocommit=False, autoflush=False, sync_session_class=ReplicaRoutingSession,
+                                                   info={"primary": resolve(engine), "replicas": resolve(replicas)}))
+
+async def dispose_engines() -> None:
+    """ Closes the pooled connections of the engines that were actually created """
+    if is_created(engine):
+        await engine.dispose()
+    if is_created(replicas):
+        for replica_engine in replicas.engines:
+            await replica_engine.dispose()
 
 # Base used to extend all sqlalchemy database tables
 Base = declarative_base()
@@ -23,4 +78,14 @@ async def get_db():
         await db.close()
 
 # This is the type annotation we will use to start a DB session automatically; this is what we will import to other files from this file
-DB_Session = Annotated[AsyncSession, Depends(get_db)]
\ No newline at end of file
+DB_Session = Annotated[AsyncSession, Depends(get_db)]
+
+# Same as get_db but for read-only queries that are fine being served by a replica
+async def get_read_db():
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        await db.close()
+
+DB_ReadSession = Annotated[AsyncSession, Depends(get_read_db)]
@@ -0,0 +1,141 @@
+import logging
+import time
+from contextvars import ContextVar
+from sqlalchemy import event, exc
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from src.core.config import settings
+from src.core.metrics import Counter, Histogram, route_label
+
+logger = logging.getLogger(__name__)
+
+"""
+Per-request database instrumentation. SQLAlchemy cursor events count every statement and time it, the totals are attached to the current request
+(through a ContextVar, which SQLAlchemy carries into the greenlet that runs the query) and QueryStatsMiddleware reports them once the request is
+done: as histograms per route, as a debug log line and optionally as X-DB-Query-Count / X-DB-Time-Ms response headers.
+
+Any single statement slower than the slow-query threshold is logged with its timing and the route that issued it.
+This is how N+1 patterns and redundant loads show up: look for routes whose queries-per-request is higher than it should be.
+"""
+
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 4, 5, 8, 13, 21, 50)
+DB_TIME_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+db_queries_per_request = Histogram("db_queries_per_request", "Database statements issued per request",
+                                   buckets=QUERY_COUNT_BUCKETS, labelnames=("method", "route"))
+db_time_per_request = Histogram("db_time_per_request_seconds", "Total time spent in database statements per request",
+                                buckets=DB_TIME_BUCKETS, labelnames=("method", "route"))
+db_slow_queries = Counter("db_slow_queries_total", "Statements slower than DB_SLOW_QUERY_MS", labelnames=("route",))
+db_pool_checkout = Histogram("db_pool_checkout_seconds", "Time to get a connection from the pool (waiting, connecting and pre-ping included)",
+                             buckets=(0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0, 30.0))
+db_pool_checkout_timeouts = Counter("db_pool_checkout_timeouts_total", "Checkouts that gave up after DB_POOL_TIMEOUT")
+
+
+class QueryStats:
+    __slots__ = ("scope", "count", "seconds")
+
+    def __init__(self, scope: Scope | None = None):
+        self.scope = scope
+        self.count = 0
+        self.seconds = 0.0
+
+    @property
+    def route(self) -> str:
+        # Resolved lazily since the matched route is only known once routing happened
+        return route_label(self.scope) if self.scope is not None else "background"
+
+
+_current_stats: ContextVar[QueryStats | None] = ContextVar("db_query_stats", default=None)
+
+
+def current_query_stats() -> QueryStats | None:
+    return _current_stats.get()
+
+
+def instrument_engine(engine: AsyncEngine, slow_query_ms: float) -> None:
+    slow_query_seconds = slow_query_ms / 1000
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        # Kept on the statement's execution context rather than on the connection: a statement that raises never gets its
+        # after_cursor_execute, and a value on the connection would outlive it. Statements without a context (a few dialect internals) aren't timed
+        if context is not None:
+            context._query_started_at = time.perf_counter()
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if context is None:
+            return
+        elapsed = time.perf_counter() - context._query_started_at
+
+        stats = _current_stats.get()
+        if stats is not None:
+            stats.count += 1
+            stats.seconds += elapsed
+
+        if elapsed >= slow_query_seconds:
+            route = stats.route if stats is not None else "background"
+            db_slow_queries.inc((route,))
+            logger.warning("Slow query (%.1f ms) on %s: %s", elapsed * 1000, route, statement)
+
+
+class QueryStatsMiddleware:
+    """ Pure ASGI middleware (no BaseHTTPMiddleware) so it doesn't add a task and a memory stream to every request """
+
+    def __init__(self, app: ASGIApp, headers: bool | None = None):
+        self.app = app
+        # None means DB_STATS_HEADERS. Starlette only builds the middleware when the app starts, so the settings aren't read on import
+        self.headers = settings.DB_STATS_HEADERS if headers is None else headers
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = QueryStats(scope)
+        token = _current_stats.set(stats)
+
+        async def send_with_stats(message: Message) -> None:
+            if self.headers and message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((b"x-db-query-count", str(stats.count).encode()))
+                headers.append((b"x-db-time-ms", f"{stats.seconds * 1000:.2f}".encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_stats)
+        finally:
+            _current_stats.reset(token)
+            labels = (scope["method"], stats.route)
+            db_queries_per_request.observe(stats.count, labels)
+            db_time_per_request.observe(stats.seconds, labels)
+            logger.debug("%s %s issued %d queries in %.2f ms", scope["method"], stats.route, stats.count, stats.seconds * 1000)
+
+
+class _CheckoutTimingMixin:
+    """
+    Times every pool checkout. When requests queue on the pool (all pool_size + max_overflow connections busy) this is where the time goes, and with
+    pre-ping on it also includes that extra round-trip, so it is the number to watch when tuning the pool settings.
+    """
+
+    def connect(self):
+        started_at = time.perf_counter()
+        try:
+            return super().connect()        # type: ignore[misc]
+        except exc.TimeoutError:
+            db_pool_checkout_timeouts.inc()
+            raise
+        finally:
+            db_pool_checkout.observe(time.perf_counter() - started_at)
+
+
+# SQLAlchemy names a pool's logger after its class, which would put these under src.database.instrumentation. The namespace keeps them on the
+# logger of the pool they extend, so echo_pool and any sqlalchemy.pool logging config still apply
+class InstrumentedAsyncQueuePool(_CheckoutTimingMixin, AsyncAdaptedQueuePool):
+    _sqla_logger_namespace = "sqlalchemy.pool.impl.AsyncAdaptedQueuePool"
+
+
+class InstrumentedNullPool(_CheckoutTimingMixin, NullPool):
+    _sqla_logger_namespace = "sqlalchemy.pool.impl.NullPool"
@@ -0,0 +1,104 @@
+import logging
+import time
+from typing import Hashable, List
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+from sqlalchemy.orm import Session
+from src.core.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+"""
+Read-only auth queries (the user lookup behind every authenticated request, the password hash on login, token_version on refresh) can be served by
+read replicas so they don't compete with writes for the primary's connections.
+
+- Replicas are picked round-robin per session. One that fails to connect (or drops the connection) is taken out of rotation for retry_after
+  seconds, and when none are left reads simply go to the primary.
+- Replicas lag behind the primary. Whoever just changed a user row (register, profile update, password change, delete) would otherwise read the old
+  row back, so those keys are remembered for a short window and reads for them are pinned to the primary (read-your-writes).
+
+Note: the read-your-writes window is tracked per process. Revocation doesn't depend on it since token versions are published through the token
+store, but another node can serve a slightly stale profile until the replica catches up.
+"""
+
+
+class ReplicaSet:
+    def __init__(self, engines: List[AsyncEngine], retry_after: float):
+        self.engines = engines
+        self.retry_after = retry_after
+        self._down_until = [0.0] * len(engines)
+        self._next = 0
+
+        for index, engine in enumerate(engines):
+            self._watch(index, engine)
+
+    def _watch(self, index: int, engine: AsyncEngine) -> None:
+        @event.listens_for(engine.sync_engine, "handle_error")
+        def _handle_error(context):
+            # Only connection level failures say something about the replica itself, a failing statement would fail on the primary too
+            if context.is_disconnect or context.connection is None:
+                self.mark_down(index)
+
+        @event.listens_for(engine.sync_engine, "do_connect")
+        def _do_connect(dialect, connection_record, cargs, cparams):
+            # Drivers raise plain OSErrors (refused, unreachable, timed out) when the server can't be reached and those never reach handle_error,
+            # so we make the connection ourselves to see them
+            try:
+                return dialect.connect(*cargs, **cparams)
+            except Exception:
+                self.mark_down(index)
+                raise
+
+    def mark_down(self, index: int) -> None:
+        now = time.monotonic()
+        if self._down_until[index] <= now:
+            logger.warning("Read replica %d is unreachable, sending its reads elsewhere for %.0fs", index, self.retry_after)
+        self._down_until[index] = now + self.retry_after
+
+    def choose(self) -> AsyncEngine | None:
+        """ Next healthy replica in round-robin order, None when there are no replicas or all of them are down """
+        now = time.monotonic()
+        for _ in range(len(self.engines)):
+            index = self._next
+            self._next = (index + 1) % len(self.engines)
+            if self._down_until[index] <= now:
+                return self.engines[index]
+        return None
+
+    def healthy(self) -> int:
+        now = time.monotonic()
+        return sum(1 for down_until in self._down_until if down_until <= now)
+
+
+class ReplicaRoutingSession(Session):
+    """
+    Sync session class behind the read sessions. The engine is only picked when the first statement runs, which gives the route a chance to
+    pin the session to the primary (use_primary) once it knows whose data it is reading. The choice then sticks for the rest of the session.
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        bind = self.info.get("bind")
+        if bind is None:
+            engine = None if self.info.get("use_primary") else self.info["replicas"].choose()
+            bind = self.info["bind"] = (engine or self.info["primary"]).sync_engine
+        return bind
+
+
+def use_primary(db: AsyncSession) -> None:
+    db.info["use_primary"] = True
+
+
+class RecentWrites:
+    """ Keys (user ids, emails) whose row changed within the last window seconds. A window of 0 (no replicas) turns it into a no-op """
+
+    def __init__(self, window: float, maxsize: int = 100_000):
+        self._keys = TTLCache(maxsize=maxsize, ttl=window)
+
+    def remember(self, *keys: Hashable) -> None:
+        for key in keys:
+            self._keys.set(key, True)
+
+    def route(self, db: AsyncSession, *keys: Hashable) -> None:
+        """ Pins the read session to the primary if any of the keys was written recently """
+        if any(self._keys.get(key, False) for key in keys):
+            use_primary(db)
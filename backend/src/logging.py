@@ -1,5 +1,17 @@
+import atexit
+import json
 import logging
+import queue
+import random
+import time
+from contextvars import ContextVar
+from datetime import datetime, timezone
 from enum import StrEnum
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict
+from uuid import uuid4
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from src.core.metrics import route_label
 
 """
 This file is for configuring our global logging system for this entire backend. Per-file logging is handled very simply inside each module.
@@ -22,22 +34,160 @@ class LogLevels(StrEnum):
     debug = "DEBUG"
 
 
-def configure_logging(log_level: str = LogLevels.error):
+# Pass as extra= on high-volume success logs (e.g. successful logins) so they are subject to the success sample rate
+SAMPLED = {"sampled": True}
+
+
+class _RequestContext:
+    __slots__ = ("request_id", "scope", "started_at")
+
+    def __init__(self, request_id: str, scope: Scope):
+        self.request_id = request_id
+        self.scope = scope
+        self.started_at = time.perf_counter()
+
+
+_request_context: ContextVar[_RequestContext | None] = ContextVar("log_request_context", default=None)
+
+
+class RequestContextFilter(logging.Filter):
+    """ Stamps every record with the request it was logged from: request id, method, route and the time since the request started """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        context = _request_context.get()
+        if context is not None:
+            record.request_id = context.request_id
+            record.method = context.scope.get("method")
+            record.route = route_label(context.scope)
+            record.latency_ms = round((time.perf_counter() - context.started_at) * 1000, 2)
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """ Keeps only a fraction (rate) of the records logged with extra=SAMPLED, everything else always goes through """
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return not getattr(record, "sampled", False) or random.random() < self.rate
+
+
+class JSONFormatter(logging.Formatter):
+    """ One JSON object per line, for log shippers """
+
+    _CONTEXT_FIELDS = ("request_id", "method", "route", "latency_ms", "status")
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in self._CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class RequestContextMiddleware:
+    """
+    Pure ASGI middleware giving every request an id (the incoming X-Request-ID header when there is one) that all its log lines carry and that is
+    echoed back in the response. It also logs one line per finished request with its status and latency; successful ones count as SAMPLED.
+    That line replaces uvicorn's access log, which can be turned off with --no-access-log.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self.logger = logging.getLogger("src.access")
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope["headers"]:
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")[:128]
+                break
+        context = _RequestContext(request_id or uuid4().hex, scope)
+        token = _request_context.set(context)
+        status_code = 500
+
+        async def send_with_request_id(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message = {**message, "headers": [*message.get("headers", []), (b"x-request-id", context.request_id.encode("latin-1"))]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            extra = {"status": status_code, "sampled": status_code < 400}
+            self.logger.info("%s %s %d", scope["method"], route_label(scope), status_code, extra=extra)
+            _request_context.reset(token)
+
+
+# The queue listener of the current configuration. configure_logging can run more than once (every time the lifespan starts), each call stops the
+# previous listener before setting up a new one
+_queue_listener: QueueListener | None = None
+
+
+def _stop_queue_listener() -> None:
+    """ Flushes whatever is still queued and stops the listener thread. Also registered with atexit so the last records are written on shutdown """
+    global _queue_listener
+    if _queue_listener is not None:
+        _queue_listener.stop()
+        _queue_listener = None
+
+
+atexit.register(_stop_queue_listener)
+
+
+def configure_logging(log_level: str = LogLevels.error, json_format: bool = False, use_queue: bool = False, success_sample_rate: float = 1.0):
+    global _queue_listener
     log_level = str(log_level).upper()
     log_levels = [level.value for level in LogLevels]       # Make a list of all possible log level values
 
     # if the user passed in an invalid log_level, then configure an error which immediately just logs an error to console
     if log_level not in log_levels:
-        logging.basicConfig(level=LogLevels.error)
+        logging.basicConfig(level=LogLevels.error, force=True)
         return
 
     # if the user passed in "DEBUG" then we start it up in debug mode and use the format we specified above
-    if log_level == LogLevels.debug:
-        logging.basicConfig(level=log_level, format=LOG_FORMAT_DEBUG)
-        return
-
     # otherwise just instantiate it with whatever other log level (Info or Warn)
-    logging.basicConfig(level=log_level)
+    stream_handler = logging.StreamHandler()
+    if json_format:
+        stream_handler.setFormatter(JSONFormatter())
+    elif log_level == LogLevels.debug:
+        stream_handler.setFormatter(logging.Formatter(LOG_FORMAT_DEBUG))
+    else:
+        stream_handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+
+    # With use_queue the writing (and the final formatting, e.g. the JSON) happens on a background thread, so a slow stderr/pipe can never stall
+    # requests. The calling thread still runs the filters (they read the request's context), merges the args into the message and renders any
+    # traceback before the record goes on the queue
+    _stop_queue_listener()
+    handler: logging.Handler = stream_handler
+    if use_queue:
+        log_queue: queue.SimpleQueue = queue.SimpleQueue()
+        handler = QueueHandler(log_queue)
+        handler.setFormatter(logging.Formatter("%(message)s"))     # Only merges the args (and traceback) into the message, the listener's handler does the rest
+        _queue_listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+        _queue_listener.start()
+
+    handler.addFilter(SamplingFilter(success_sample_rate))
+    handler.addFilter(RequestContextFilter())
+    # force: without it basicConfig does nothing once the root logger has a handler, so calling this again (every time the lifespan starts) would
+    # keep the first call's level, format and sample rate. It removes and closes the previous handlers
+    logging.basicConfig(level=log_level, handlers=[handler], force=True)
 
 
 """
@@ -51,4 +201,7 @@ logger = logging.getLogger(__name__)        # __name__ organized the loggers by
 logger.debug("...")
 logger.info("...")
 logger.error("DB connection failed...")
+
+Use %-style arguments rather than f-strings, e.g. logger.info("Created user %s", email). The message is then only formatted when the record is
+actually emitted (not for filtered levels or sampled out success logs).
 """
\ No newline at end of file
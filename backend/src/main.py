@@ -2,14 +2,61 @@
 FASTAPI ROOT FILE 
 """
 
+import asyncio
+from contextlib import asynccontextmanager, suppress
 from fastapi import FastAPI
-from src.logging import configure_logging, LogLevels
-from src.auth.router import router as auth_router
+from src.logging import configure_logging, LogLevels, RequestContextMiddleware
+from src.auth.router import router as auth_router, jwks_router
+from src.auth.service import password_hasher, token_store, login_throttle, refresh_sessions, wait_for_rehashes, get_key_ring
 from src.users.router import router as users_router
+from src.metrics.router import router as metrics_router
+from src.metrics.middleware import MetricsMiddleware
+from src.core.admission import AdmissionControlMiddleware
+from src.core.config import settings
+from src.core.lazy import is_created
+from src.database.core import dispose_engines
+from src.database.instrumentation import QueryStatsMiddleware
 
-configure_logging(LogLevels.info)
+"""
+Importing this module only defines the app: nothing here reads the settings, opens connections or starts threads until the lifespan runs, and the
+database engine, token store etc. are created on first use (see src/core/lazy.py). So a pre-forking server (gunicorn --preload) can import the app
+once in the parent and every worker still sets up its own logging thread, pools and clients after the fork.
+python -m benchmarks.bench_import_time keeps an eye on how long the import takes.
+"""
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    configure_logging(LogLevels.info,
+                      json_format=settings.LOG_JSON,
+                      use_queue=settings.LOG_QUEUE,
+                      success_sample_rate=settings.LOG_SUCCESS_SAMPLE_RATE)
+    get_key_ring()      # A bad key file should stop the worker now rather than fail the first login
+
+    # Deletes expired refresh token sessions in the background
+    sweeper = None
+    if settings.SESSION_SWEEP_INTERVAL_SECONDS > 0:
+        sweeper = asyncio.create_task(refresh_sessions.run_sweeper(settings.SESSION_SWEEP_INTERVAL_SECONDS, settings.SESSION_SWEEP_BATCH_SIZE))
+    yield
+    if sweeper is not None:
+        sweeper.cancel()
+        with suppress(asyncio.CancelledError):
+            await sweeper
+    # Let any in-flight hashes (and password upgrades) finish and stop the worker pool on shutdown
+    await wait_for_rehashes()
+    if is_created(password_hasher):
+        password_hasher.shutdown()
+    for client in (token_store, login_throttle, refresh_sessions):
+        if is_created(client):
+            await client.close()
+    await dispose_engines()
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(QueryStatsMiddleware)         # Reads DB_STATS_HEADERS on startup
+app.add_middleware(RequestContextMiddleware)    # Request id for every log line plus one access log line per request
+app.add_middleware(AdmissionControlMiddleware)  # Sheds load with a 503 before any per-request work (logging, DB) is done for it
+app.add_middleware(MetricsMiddleware)       # Added last so it is the outermost middleware and times everything
 
 app.include_router(auth_router)
-app.include_router(users_router)
\ No newline at end of file
+app.include_router(jwks_router)
+app.include_router(users_router)
+app.include_router(metrics_router)
\ No newline at end of file
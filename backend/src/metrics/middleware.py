@@ -0,0 +1,49 @@
+import time
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from src.core.metrics import Counter, Gauge, Histogram, route_label
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+http_requests = Counter("http_requests_total", "Requests by method, route and status code", labelnames=("method", "route", "status"))
+http_request_latency = Histogram("http_request_duration_seconds", "Request latency by method and route",
+                                 buckets=LATENCY_BUCKETS, labelnames=("method", "route"))
+http_requests_in_flight = Gauge("http_requests_in_flight", "Requests currently being handled", labelnames=("method",))
+
+# Status codes as label strings so we don't format an int on every request
+_STATUS_LABELS = {code: str(code) for code in range(100, 600)}
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware recording request counts, latency and in-flight requests. It wraps send only to read the status code and does nothing else
+    per request besides a few dict lookups. In-flight is labelled by method only because the route isn't known until the router ran.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status_code = 500       # What the client ends up seeing if the app raises before starting a response
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        in_flight_labels = (method,)
+        http_requests_in_flight.inc(in_flight_labels)
+        started_at = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started_at
+            http_requests_in_flight.dec(in_flight_labels)
+            route = route_label(scope)
+            http_requests.inc((method, route, _STATUS_LABELS.get(status_code, str(status_code))))
+            http_request_latency.observe(elapsed, (method, route))
@@ -0,0 +1,51 @@
+from typing import Dict
+from fastapi import APIRouter, Response
+from src.auth.service import password_hasher, user_cache, token_cache, user_loads
+from src.core.metrics import Counter, Gauge, Labels, render_metrics
+from src.database.core import engine, replicas
+
+router = APIRouter(tags=['metrics'])
+
+"""
+Everything below reads values that something else already keeps track of (the connection pool, the password hasher, the caches) so they cost nothing
+until Prometheus scrapes /metrics.
+"""
+
+def _pool_stats() -> Dict[Labels, float]:
+    pool = engine.pool
+    stats: Dict[Labels, float] = {}
+    # Not every pool class keeps these (e.g. NullPool), only report what the current one has
+    for name in ("size", "checkedout", "checkedin", "overflow"):
+        method = getattr(pool, name, None)
+        if method is not None:
+            stats[(name,)] = method()
+    if ("overflow",) in stats:
+        # SQLAlchemy counts overflow from -pool_size upwards, only the part above zero is actual overflow connections
+        stats[("overflow",)] = max(0, stats[("overflow",)])
+    return stats
+
+Gauge("db_pool_connections", "Connection pool state: configured size, checked out, idle (checkedin) and overflow connections",
+      labelnames=("state",), collect=_pool_stats)
+Gauge("db_replicas_healthy", "Read replicas currently in rotation (reads fall back to the primary at 0)",
+      collect=lambda: {(): replicas.healthy()})
+
+Gauge("password_hash_jobs", "Password hash jobs waiting for a worker (pending) and running (in_flight)", labelnames=("state",),
+      collect=lambda: {("pending",): password_hasher.pending, ("in_flight",): password_hasher.in_flight})
+Counter("password_hash_rejected_total", "Password hash jobs shed because the queue was full",
+        collect=lambda: {(): password_hasher.rejected})
+
+_caches = {"user": user_cache, "token": token_cache}
+Counter("cache_hits_total", "In-process cache hits", labelnames=("cache",),
+        collect=lambda: {(name,): cache.hits for name, cache in _caches.items()})
+Counter("cache_misses_total", "In-process cache misses", labelnames=("cache",),
+        collect=lambda: {(name,): cache.misses for name, cache in _caches.items()})
+Gauge("cache_entries", "Entries currently held by each in-process cache", labelnames=("cache",),
+      collect=lambda: {(name,): len(cache) for name, cache in _caches.items()})
+
+Counter("user_loads_total", "User cache misses by whether they ran the select (load) or waited for one already running (shared)",
+        labelnames=("outcome",), collect=lambda: {("load",): user_loads.loads, ("shared",): user_loads.shared})
+
+
+@router.get("/metrics", include_in_schema=False)
+async def metrics() -> Response:
+    return Response(content=render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,109 @@
+import base64
+import csv
+import io
+from datetime import datetime
+from typing import Any, AsyncIterator, List, Sequence, Tuple
+from uuid import UUID
+from pydantic_core import to_json
+from sqlalchemy import Row, Select, func, or_, select, tuple_
+from src.core.entities import User
+from src.database.core import ReadSessionLocal
+
+"""
+Admin listing and export of users (GET /users and GET /users/export).
+
+- Pages are keyset based: newest first on (time_created, id) and the cursor is the last row of the previous page, so page 10,000 costs the same
+  index range scan as page 1. OFFSET would read and throw away every row before the page.
+- q matches case-insensitive prefixes of the email, first name or last name. Each of them has a lower(...) varchar_pattern_ops index, so the
+  three LIKE 'q%' are index range scans OR'd together rather than a scan of the whole table.
+- The export streams the same query through a server side cursor (yield_per) and writes it out a batch at a time, so memory stays flat no matter
+  how many users there are. It opens its own read session since it keeps running after the route returned the StreamingResponse.
+- CSV cells that a spreadsheet would take for a formula get a leading ' (see _csv_cell). NDJSON is left as is, it isn't opened in spreadsheets.
+"""
+
+EXPORT_BATCH_SIZE = 1000
+
+_COLUMNS = (User.id, User.email, User.first_name, User.last_name, User.university, User.time_created)
+_FIELDS = [column.key for column in _COLUMNS]
+_FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(time_created: datetime, user_id: UUID) -> str:
+    """ Opaque to clients, it's just the sort key of the last row they got """
+    raw = f"{time_created.isoformat()}|{user_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, UUID]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        time_created, user_id = raw.split("|")
+        return datetime.fromisoformat(time_created), UUID(user_id)
+    except ValueError as e:     # Covers bad base64 (binascii.Error), bad UTF-8, a missing separator and bad values
+        raise InvalidCursor(cursor) from e
+
+
+def _escape_like(value: str) -> str:
+    # "/" rather than a backslash, whose quoting in the ESCAPE clause differs between dialects
+    return value.replace("/", "//").replace("%", "/%").replace("_", "/_")
+
+
+def _users_query(q: str | None) -> Select:
+    # The pattern is built here rather than in SQL (lower(:q) || '%') so Postgres sees a plain prefix and can use the pattern indexes
+    query = select(*_COLUMNS).order_by(User.time_created.desc(), User.id.desc())
+    if q:
+        pattern = _escape_like(q.lower()) + "%"
+        query = query.filter(or_(func.lower(User.email).like(pattern, escape="/"),
+                                 func.lower(User.first_name).like(pattern, escape="/"),
+                                 func.lower(User.last_name).like(pattern, escape="/")))
+    return query
+
+
+async def list_users(db, q: str | None, cursor: str | None, limit: int) -> Tuple[Sequence[Row], str | None]:
+    """ One page of users and the cursor for the next one (None on the last page). Raises InvalidCursor """
+    query = _users_query(q).limit(limit + 1)        # One extra row tells us whether there is a next page
+    if cursor:
+        time_created, user_id = decode_cursor(cursor)
+        query = query.filter(tuple_(User.time_created, User.id) < tuple_(time_created, user_id))
+
+    rows = (await db.execute(query)).all()
+    if len(rows) <= limit:
+        return rows, None
+    last = rows[limit - 1]
+    return rows[:limit], encode_cursor(last.time_created, last.id)
+
+
+def _ndjson_lines(rows: List[Row]) -> bytes:
+    return b"".join(to_json(dict(zip(_FIELDS, row))) + b"\n" for row in rows)
+
+
+def _csv_cell(value: Any) -> Any:
+    # Spreadsheets run a cell starting with one of these as a formula, and names and emails are whatever users typed in. The leading ' makes
+    # them show it as text instead (OWASP's advice for CSV injection)
+    if isinstance(value, str) and value.startswith(_FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def _csv_lines(rows: List[Row], buffer: io.StringIO, writer) -> bytes:
+    buffer.seek(0)
+    buffer.truncate()
+    writer.writerows([_csv_cell(value) for value in row] for row in rows)
+    return buffer.getvalue().encode()
+
+
+async def export_users(format: str, q: str | None) -> AsyncIterator[bytes]:
+    """ Yields the export one batch of rows at a time, for a StreamingResponse """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if format == "csv":
+        yield _csv_lines([_FIELDS], buffer, writer)     # type: ignore
+
+    async with ReadSessionLocal() as db:
+        result = await db.stream(_users_query(q).execution_options(yield_per=EXPORT_BATCH_SIZE))
+        async for rows in result.partitions():
+            yield _csv_lines(rows, buffer, writer) if format == "csv" else _ndjson_lines(rows)
@@ -1,18 +1,55 @@
 import logging
 from starlette import status
-from fastapi import APIRouter, HTTPException
-from src.auth.dependencies import CurrentUser
-from src.auth.service import verify_password, get_password_hash
-from src.database.core import DB_Session
-from src.users.schemas import UserUpdateRequest, CurrentUserResponse, ChangePasswordRequest
+from typing import Annotated, Literal
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from src.auth.dependencies import CurrentPrincipal, CurrentUser, AdminUser
+from src.auth.service import (verify_password, get_password_hash, invalidate_cached_user, load_user_snapshot, token_store,
+                              refresh_sessions)
+from src.auth.token_store import TokenStoreWriteFailed
+from src.core.responses import model_response
+from src.database.core import DB_Session, DB_ReadSession, recent_writes
+from src.users.listing import InvalidCursor, list_users, export_users
+from src.users.schemas import UserUpdateRequest, CurrentUserResponse, ChangePasswordRequest, ImportResult, AdminUserResponse, UserListResponse
+from src.users.service import import_users
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/users", tags=['user'])
 
+# Case-insensitive prefix of the email, first name or last name
+Search = Annotated[str | None, Query(min_length=1, max_length=255)]
+
+@router.get("", response_model=UserListResponse)
+async def get_users(admin: AdminUser, read_db: DB_ReadSession, q: Search = None, cursor: str | None = None,
+                    limit: Annotated[int, Query(ge=1, le=500)] = 50):
+    """ Lists users newest first, a page at a time. Pass next_cursor back as cursor to get the next page (see src/users/listing.py) """
+    try:
+        rows, next_cursor = await list_users(read_db, q, cursor, limit)
+    except InvalidCursor:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    except Exception as e:
+        logger.error("Failed to list users | Error: %s", e)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to list users")
+    return model_response(UserListResponse, {"users": [AdminUserResponse.model_validate(row) for row in rows], "next_cursor": next_cursor})
+
+
+@router.get("/export", response_class=StreamingResponse)
+async def export_all_users(admin: AdminUser, format: Literal["ndjson", "csv"] = "ndjson", q: Search = None):
+    """ Every user (or every match of q) as NDJSON or CSV, streamed straight from a server side cursor """
+    logger.info("User export (%s, q=%r) started by %s", format, q, admin.email)
+    media_type = "application/x-ndjson" if format == "ndjson" else "text/csv"
+    return StreamingResponse(export_users(format, q), media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="users.{format}"'})
+
+
 @router.get("/me", response_model=CurrentUserResponse)
-async def get_user(user: CurrentUser):
-    return CurrentUserResponse.model_validate(user)
+async def get_user(principal: CurrentPrincipal, read_db: DB_ReadSession):
+    # Read only, so no ORM object: the cached column values are enough to build the response
+    profile = await load_user_snapshot(principal.id, read_db, token_version=principal.token_version)
+    if profile is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token", headers={"WWW-Authenticate": "Bearer"})
+    return model_response(CurrentUserResponse, profile)
 
 
 @router.patch("/me", response_model=CurrentUserResponse)
@@ -22,28 +59,47 @@ async def update_user(update_info: UserUpdateRequest, user: CurrentUser, db: DB_
     the changes and it will reflect itself within the database
     """
     try:
+        previous_email = user.email
         for field, value in update_info.model_dump(exclude_unset=True).items():
             setattr(user, field, value)     # Set the attribute in obj=user with name=field with the passed in value=value
 
         await db.commit()
         await db.refresh(user)
+        invalidate_cached_user(user.id) # type: ignore
+        recent_writes.remember(user.id, previous_email, user.email)
+        await token_store.delete(user.id) # type: ignore    # Makes every other node reload this user instead of serving its cached copy
 
-        logger.info(f"User {user.email} has been successfully updated")
-        return CurrentUserResponse.model_validate(user)
+        logger.info("User %s has been successfully updated", user.email)
+        return model_response(CurrentUserResponse, user)
     except HTTPException:
         raise
     except Exception as e:
         await db.rollback()
-        logger.error(f"Failed to update user {user.email} | Error: {e}")
+        logger.error("Failed to update user %s | Error: %s", previous_email, e)
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to Update User")
 
 
+def _revocation_failed(done: str) -> HTTPException:
+    # The change itself is committed, but other nodes may keep accepting the user's old tokens until the token store is reachable again.
+    # Reporting success would hide that, e.g. from someone changing their password because it leaked
+    return HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                         detail=f"{done}, but signing out existing sessions on every server failed. They may stay valid for a while")
+
+
 @router.delete("/me", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_user(user: CurrentUser, db: DB_Session):
+    user_id, email = user.id, user.email
+
     await db.delete(user)
     await db.commit()
+    invalidate_cached_user(user_id) # type: ignore
+    recent_writes.remember(user_id, email)
+    try:
+        await token_store.revoke(user_id) # type: ignore
+    except TokenStoreWriteFailed:
+        raise _revocation_failed("Account deleted")
 
-    logger.info(f"User {user.email} has been successfully deleted")
+    logger.info("User %s has been successfully deleted", email)
 
 
 @router.patch("/me/change-password", status_code=status.HTTP_204_NO_CONTENT)
@@ -52,24 +108,51 @@ async def change_password(pwd_info: ChangePasswordRequest, user: CurrentUser, db
     Verify the old password, then update with the new password.
     """
 
+    user_id, email = user.id, user.email     # Read them up front, the ORM object is expired once we commit
+
+    # Neither session holds a pooled connection during the two bcrypt runs below: CurrentUser released the read and attached the user to db
+    # without a query, so db only connects for the final write
     try:
-        if not verify_password(plain_password=pwd_info.current_password, hashed_password=user.password_hash): # type: ignore
-            logger.info(f"Failed to change password for user {user.email}. Incorrect Password")
+        if not await verify_password(plain_password=pwd_info.current_password, hashed_password=user.password_hash): # type: ignore
+            logger.info("Failed to change password for user %s. Incorrect Password", email)
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Current Password is Incorrect")
 
         # Create a new password hash using the new password
-        new_pwd_hash = get_password_hash(password=pwd_info.new_password)
+        new_pwd_hash = await get_password_hash(password=pwd_info.new_password)
         user.password_hash = new_pwd_hash # type: ignore
         user.token_version += 1 # type: ignore
+        new_token_version = user.token_version
+        await refresh_sessions.revoke_user(db, user_id)      # The bump already rejects them, this just drops the rows in the same commit
 
         await db.commit()
-        logger.info(f"Password for user {user.email} successfully changed")
+        invalidate_cached_user(user_id) # type: ignore
+        recent_writes.remember(user_id, email)
+        await token_store.set(user_id, new_token_version) # type: ignore    # Publishes the bump so every node rejects the old tokens right away
+        logger.info("Password for user %s successfully changed", email)
 
     except HTTPException:
         raise
+    except TokenStoreWriteFailed:       # The new password is committed, only telling the other nodes failed
+        raise _revocation_failed("Password changed")
     except Exception as e:
         await db.rollback()
-        logger.error(f"Error changing password for user {user.email}")
+        logger.error("Error changing password for user %s", email)
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Unable to change password at this time")
 
 
+@router.post("/import", response_model=ImportResult)
+async def bulk_import(request: Request, admin: AdminUser, db: DB_Session, format: Literal["csv", "jsonl"] = "csv") -> ImportResult:
+    """
+    Registers a whole cohort in one request. The body is the raw file (CSV with a header row of email, first_name, last_name, password and
+    optionally university, or one JSON object per line with the same keys) and is streamed, so it can be large. Rows that fail don't stop
+    the import, they come back in errors with their line number.
+    """
+    admin_email = admin.email
+    try:
+        result = await import_users(request.stream(), format, db)
+        logger.info("Bulk import by %s: %d users created, %d rows failed", admin_email, result.created, result.failed)
+        return result
+    except Exception as e:
+        await db.rollback()
+        logger.error("Bulk import by %s failed. Error: %s", admin_email, e)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to import users")
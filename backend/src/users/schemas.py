@@ -1,12 +1,14 @@
 from pydantic import BaseModel, ConfigDict
-from typing import Optional
-from datetime import datetime 
+from typing import List, Optional
+from datetime import datetime
+from uuid import UUID
+from src.auth.schemas import NormalizedEmail
 
 class UserUpdateRequest(BaseModel):
     """ This is the request model for Put requests so it must have all data avaliable """
     first_name: Optional[str] = None
     last_name: Optional[str] = None
-    email: Optional[str] = None
+    email: Optional[NormalizedEmail] = None
     university: Optional[str] = None
 
 class CurrentUserResponse(BaseModel):
@@ -20,4 +22,37 @@ class CurrentUserResponse(BaseModel):
 
 class ChangePasswordRequest(BaseModel):
     current_password: str
-    new_password: str
\ No newline at end of file
+    new_password: str
+
+class ImportUserRow(BaseModel):
+    """ One row of a bulk import (CSV columns or JSONL keys). Same fields as registration plus the optional university """
+    email: NormalizedEmail
+    first_name: str
+    last_name: str
+    password: str
+    university: Optional[str] = None
+
+class ImportRowError(BaseModel):
+    line: int               # 1-based line in the uploaded file (the CSV header is line 1)
+    email: Optional[str]
+    error: str
+
+class ImportResult(BaseModel):
+    created: int
+    failed: int
+    errors: List[ImportRowError]
+
+class AdminUserResponse(BaseModel):
+    """ One user in the admin listing and export """
+    id: UUID
+    email: str
+    first_name: str
+    last_name: str
+    university: Optional[str]
+    time_created: datetime
+
+    model_config = ConfigDict(from_attributes=True)
+
+class UserListResponse(BaseModel):
+    users: List[AdminUserResponse]
+    next_cursor: Optional[str]      # Pass it back as ?cursor= for the next page, None on the last one
@@ -0,0 +1,211 @@
+import argparse
+import asyncio
+import csv
+import json
+import logging
+import sys
+from typing import Any, AsyncIterator, Dict, List, Set, Tuple
+from uuid import uuid4
+from pydantic import ValidationError
+from sqlalchemy import select
+from src.auth.service import password_hasher, insert_new_users
+from src.core.config import settings
+from src.core.entities import User
+from src.database.core import AsyncSessionLocal, engine, recent_writes
+from src.users.schemas import ImportUserRow, ImportRowError, ImportResult
+
+logger = logging.getLogger(__name__)
+
+"""
+Bulk user import, used by POST /users/import and by the CLI at the bottom of this file (python -m src.users.service users.csv).
+
+The input (CSV with a header row, or JSON lines) is streamed and handled in batches of BULK_IMPORT_BATCH_SIZE rows, so the rows in memory are one
+batch no matter how big the file is. What does grow with the file is the list of failed rows, since the response reports every one of them.
+Per batch:
+
+1. one SELECT finds the emails that already exist (instead of one query per row), so we don't waste bcrypt time on rows that can't go in
+2. the remaining passwords are hashed in parallel on the password hasher's workers
+3. one multi-row INSERT ... ON CONFLICT (email) DO NOTHING RETURNING email writes the batch and tells us which rows made it in, then we commit
+
+A bad row never fails the import, it is reported with its line number and the rest carries on. Duplicates are only looked for within the batch:
+a later row repeating an email from an earlier batch finds that row already in the table in step 1 and is reported as an existing user.
+Note: COPY would be a bit faster for the insert but it aborts the whole batch on the first duplicate (e.g. someone registering while the import runs),
+and at this point bcrypt is what takes the time anyway.
+"""
+
+FORMATS = ("csv", "jsonl")
+
+ImportRow = Dict[str, Any] | str    # A parsed row, or why the line couldn't be parsed
+
+
+async def _iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[Tuple[int, bytes]]:
+    buffer = b""
+    line_number = 0
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            line_number += 1
+            yield line_number, line
+    if buffer:
+        yield line_number + 1, buffer
+
+
+async def iter_rows(chunks: AsyncIterator[bytes], format: str) -> AsyncIterator[Tuple[int, ImportRow]]:
+    """ Parses the byte stream line by line. Note: CSV fields can't contain line breaks since every line is parsed on its own """
+    header: List[str] | None = None
+    async for line_number, raw in _iter_lines(chunks):
+        try:
+            line = raw.decode("utf-8-sig" if line_number == 1 else "utf-8").rstrip("\r")
+        except UnicodeDecodeError:
+            yield line_number, "Line is not valid UTF-8"
+            continue
+        if not line.strip():
+            continue
+
+        if format == "csv":
+            values = next(csv.reader([line]))
+            if header is None:
+                header = [name.strip() for name in values]
+                continue
+            if len(values) != len(header):
+                yield line_number, f"Expected {len(header)} columns, got {len(values)}"
+                continue
+            # Empty cells count as missing so optional columns can be left blank
+            yield line_number, {name: value for name, value in zip(header, values) if value != ""}
+        else:
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError:
+                yield line_number, "Invalid JSON"
+                continue
+            yield line_number, row if isinstance(row, dict) else "Expected a JSON object"
+
+
+def _describe(error: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(str(part) for part in detail['loc'])}: {detail['msg']}" for detail in error.errors())
+
+
+class UserImporter:
+    def __init__(self, db, batch_size: int):
+        self.db = db
+        self.batch_size = batch_size
+        self.created = 0
+        self.errors: List[ImportRowError] = []
+        self._batch: List[Tuple[int, ImportUserRow]] = []
+        self._batch_emails: Set[str] = set()    # Emails already taken by an earlier row of the batch
+
+    def _fail(self, line: int, email: Any, error: str) -> None:
+        self.errors.append(ImportRowError(line=line, email=email if isinstance(email, str) else None, error=error))
+
+    async def add(self, line: int, row: ImportRow) -> None:
+        if isinstance(row, str):
+            self._fail(line, None, row)
+            return
+
+        try:
+            user = ImportUserRow.model_validate(row)
+        except ValidationError as e:
+            self._fail(line, row.get("email"), _describe(e))
+            return
+
+        if user.email in self._batch_emails:
+            self._fail(line, user.email, "Duplicate email in this file")
+            return
+        self._batch_emails.add(user.email)
+
+        self._batch.append((line, user))
+        if len(self._batch) >= self.batch_size:
+            await self.flush()
+
+    async def flush(self) -> None:
+        batch, self._batch = self._batch, []
+        self._batch_emails = set()
+        if not batch:
+            return
+
+        result = await self.db.execute(select(User.email).where(User.email.in_([user.email for _, user in batch])))
+        existing = set(result.scalars())
+        await self.db.commit()      # Ends the read so the connection goes back to the pool while we hash
+
+        new_users = []
+        for line, user in batch:
+            if user.email in existing:
+                self._fail(line, user.email, "User with this email already exists")
+            else:
+                new_users.append((line, user))
+        if not new_users:
+            return
+
+        password_hashes = await password_hasher.hash_many([user.password for _, user in new_users])
+        values = [
+            {
+                "id": uuid4(),
+                "email": user.email,
+                "first_name": user.first_name,
+                "last_name": user.last_name,
+                "university": user.university,
+                "password_hash": password_hash,
+            }
+            for (_, user), password_hash in zip(new_users, password_hashes)
+        ]
+
+        try:
+            result = await self.db.execute(insert_new_users().values(values).returning(User.email))
+            inserted = set(result.scalars())
+            await self.db.commit()
+        except Exception as e:
+            await self.db.rollback()
+            logger.error("Bulk import failed to insert a batch of %d users. Error: %s", len(values), e)
+            for line, user in new_users:
+                self._fail(line, user.email, "Failed to save user")
+            return
+
+        for line, user in new_users:
+            if user.email not in inserted:
+                self._fail(line, user.email, "User with this email already exists")     # Registered by someone else since our SELECT
+        self.created += len(inserted)
+        recent_writes.remember(*inserted)
+
+    def result(self) -> ImportResult:
+        self.errors.sort(key=lambda error: error.line)
+        return ImportResult(created=self.created, failed=len(self.errors), errors=self.errors)
+
+
+async def import_users(chunks: AsyncIterator[bytes], format: str, db, batch_size: int | None = None) -> ImportResult:
+    importer = UserImporter(db, batch_size or settings.BULK_IMPORT_BATCH_SIZE)
+    async for line, row in iter_rows(chunks, format):
+        await importer.add(line, row)
+    await importer.flush()
+    return importer.result()
+
+
+async def _read_file(path: str, chunk_size: int = 64 * 1024) -> AsyncIterator[bytes]:
+    with open(path, "rb") as file:
+        while chunk := file.read(chunk_size):
+            yield chunk
+
+
+async def _main(path: str, format: str, batch_size: int | None) -> ImportResult:
+    try:
+        async with AsyncSessionLocal() as db:
+            return await import_users(_read_file(path), format, db, batch_size)
+    finally:
+        password_hasher.shutdown()
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    # e.g. python -m src.users.service cohort.csv   (prints the failed rows as JSON lines, one per line, then a summary)
+    parser = argparse.ArgumentParser(description="Bulk import users from a CSV (with a header row) or JSONL file")
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=FORMATS, help="Defaults to jsonl for .jsonl/.ndjson files and csv otherwise")
+    parser.add_argument("--batch-size", type=int, default=None)
+    args = parser.parse_args()
+
+    format = args.format or ("jsonl" if args.path.endswith((".jsonl", ".ndjson")) else "csv")
+    import_result = asyncio.run(_main(args.path, format, args.batch_size))
+    for error in import_result.errors:
+        print(error.model_dump_json())
+    print(f"Created {import_result.created} users, {import_result.failed} rows failed", file=sys.stderr)
+    sys.exit(1 if import_result.failed else 0)